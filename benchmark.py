@@ -0,0 +1,229 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import chess
+import numpy as np
+
+import chess_environment.chessboard as cb
+from chess_environment.encoding import encode_board
+from dqn_tools.memory import ArrayMemory, SimpleMemory, as_memory_batch
+from training_tools import DQNChessRecord
+
+# Seeded benchmarks of the environment, inference, replay memory and training.
+# Results are written as JSON and, given a baseline written before, every benchmark slower than
+# baseline by more than the threshold is reported as regression (exit code 1), e.g.
+#   python benchmark.py --output tmp/benchmark.json --save-baseline benchmarks_baseline.json
+#   python benchmark.py --baseline benchmarks_baseline.json --threshold 0.1
+
+SEED = 12345
+BENCHMARK_FENS = {
+    "opening": chess.STARTING_FEN,
+    "middlegame": "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N2N2/PP2BPPP/R2QKB1R w KQ - 4 8",
+    "endgame": "8/5pk1/6p1/8/3R4/6P1/5PKP/8 w - - 0 40",
+}
+# active and target networks of every shipped model
+MODEL_PATTERNS = ["final/*.h5f", "models/*/FinalModel/*.h5f", "models/*/*.h5"]
+MEMORY_SIZE = 10000
+MEMORY_FILLS = (0.1, 0.5, 1.)
+BATCH_SIZE = 32
+SEARCH_DEPTH = 2
+
+
+def measure(function, number: int, repeat: int):
+    """Runs function number times in each of repeat rounds, returns seconds per call of every round"""
+    rounds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            function()
+        rounds.append((time.perf_counter() - started) / number)
+    return rounds
+
+
+def result(rounds: list, number: int):
+    return {"seconds": float(np.median(rounds)), "min_seconds": min(rounds), "number": number, "repeat": len(rounds)}
+
+
+def make_records(number: int):
+    """Records of seeded random games, as the templates' `action` stores them"""
+    board = chess.Board()
+    records = []
+    while len(records) < number:
+        if board.is_game_over():
+            board = chess.Board()
+        move = random.choice(list(board.legal_moves))
+        board.push(move)
+        seen_board = board.mirror() if board.turn == chess.WHITE else board
+        record = DQNChessRecord()
+        record.state = encode_board(seen_board)
+        record.fen = seen_board.fen()
+        record.reward = np.array([[random.choice([0, cb.ATTACK])]])
+        records.append(record)
+    return records
+
+
+def environment_benchmarks(repeat: int):
+    results = {}
+    for position, fen in BENCHMARK_FENS.items():
+        board = cb.ChessBoard(fen)
+        board_fen = fen.split(" ")[0]
+        number = 200
+        results["encode_board/{}".format(position)] = result(
+            measure(lambda: board._encode_board(board_fen), number, repeat), number)
+        for name, get_moves in (("get_moves", lambda: board.get_moves()),
+                                ("get_moves_lazy_fens", lambda: board.get_moves(lazy_fens=True)),
+                                ("get_moves_batch", lambda: board.get_moves_batch())):
+            results["{}/{}".format(name, position)] = result(measure(get_moves, number, repeat), number)
+    return results
+
+
+def memory_benchmarks(repeat: int):
+    """Sampling a training batch as templates use it, `MemoryBatch` of stacked arrays"""
+    results = {}
+    records = make_records(MEMORY_SIZE)
+    for memory_type in (SimpleMemory, ArrayMemory):
+        for fill in MEMORY_FILLS:
+            memory = memory_type(MEMORY_SIZE)
+            for record in records[:int(MEMORY_SIZE * fill)]:
+                memory.add(record)
+            number = 200
+            results["memory_batch/{}/{:.0%}".format(memory_type.__name__, fill)] = result(
+                measure(lambda: as_memory_batch(memory.get_batch(BATCH_SIZE, min_rows=0)), number, repeat), number)
+    return results
+
+
+def inference_benchmarks(repeat: int):
+    from engine import DQNChessEngine
+    from dqn_tools.numpy_model import load_numpy_model
+
+    results = {}
+    for path in sorted(set(path for pattern in MODEL_PATTERNS for path in glob.glob(pattern))):
+        numpy_model = load_numpy_model(path)
+        state_shape = (1,) + tuple(1 if size is None else size for size in numpy_model.input_shape[1:])
+        backends = [("numpy", numpy_model)]
+        try:
+            from keras.engine.saving import load_model
+            backends.append(("keras", load_model(path)))
+        except ImportError:
+            pass
+        for backend, model in backends:
+            engine = DQNChessEngine(model)
+            for position, fen in BENCHMARK_FENS.items():
+                board = cb.ChessBoard(fen)
+                engine.choose_move(board, state_shape=state_shape)
+                number = 20
+                results["choose_move/{}/{}/{}".format(backend, os.path.basename(path), position)] = result(
+                    measure(lambda: engine.choose_move(board, state_shape=state_shape), number, repeat), number)
+        engine = DQNChessEngine(numpy_model, state_shape=state_shape)
+        for position, fen in BENCHMARK_FENS.items():
+            board = cb.ChessBoard(fen)
+
+            def search():
+                engine.searcher.clear()
+                engine.choose_move(board, depth=SEARCH_DEPTH)
+            results["search/depth_{}/{}/{}".format(SEARCH_DEPTH, os.path.basename(path), position)] = result(
+                measure(search, 1, repeat), 1)
+    return results
+
+
+def training_benchmarks(repeat: int, selfplay_steps: int):
+    from dqn_tools.trainers import DQNTrainer
+    from models.model_template import ModelTemplate
+
+    results = {}
+    template = ModelTemplate()
+    memory = SimpleMemory(template.MEMORY_SIZE)
+    for record in make_records(template.MEMORY_SIZE):
+        memory.add(record)
+    trainer = DQNTrainer(template.new_model(SEED), memory, template.action, template.training)
+    trainer.train(template.BATCH, template.GAMMA, template.THETA)
+    number = 10
+    results["training_step/{}".format(template.NAME)] = result(
+        measure(lambda: trainer.train(template.BATCH, template.GAMMA, template.THETA), number, repeat), number)
+
+    trainer = DQNTrainer(template.new_model(SEED), SimpleMemory(template.MEMORY_SIZE), template.action,
+                         template.training)
+    board = cb.ChessBoard()
+
+    def play():
+        for step in range(selfplay_steps):
+            trainer.take_action(board, template.get_epsilon(step))
+            trainer.train(template.BATCH, template.GAMMA, template.THETA)
+    results["selfplay/{}_steps".format(selfplay_steps)] = result(measure(play, 1, 1), 1)
+    return results
+
+
+def run(repeat: int, selfplay_steps: int):
+    random.seed(SEED)
+    np.random.seed(SEED)
+    results = {}
+    skipped = {}
+    results.update(environment_benchmarks(repeat))
+    results.update(memory_benchmarks(repeat))
+    for name, benchmarks in (("inference", lambda: inference_benchmarks(repeat)),
+                             ("training", lambda: training_benchmarks(repeat, selfplay_steps))):
+        try:
+            results.update(benchmarks())
+        except ImportError as error:
+            skipped[name] = str(error)
+    return {
+        "meta": {"time": time.time(), "python": platform.python_version(), "numpy": np.__version__,
+                 "chess": chess.__version__, "machine": platform.machine(), "processor": platform.processor(),
+                 "seed": SEED, "repeat": repeat, "selfplay_steps": selfplay_steps},
+        "results": results,
+        "skipped": skipped,
+    }
+
+
+def compare(report: dict, baseline: dict, threshold: float):
+    """Lists benchmarks slower than in baseline by more than threshold (e.g. 0.1 for 10%)"""
+    regressions = []
+    for name, current in sorted(report["results"].items()):
+        if name not in baseline["results"]:
+            continue
+        ratio = current["seconds"] / baseline["results"][name]["seconds"]
+        print("{:60} {:12.6f}s {:+7.1%}".format(name, current["seconds"], ratio - 1))
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return regressions
+
+
+def write(path: str, report: dict):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, "w") as handler:
+        json.dump(report, handler, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of DQNChessEngine")
+    parser.add_argument("--output", default="tmp/benchmark.json", help="where results are written")
+    parser.add_argument("--baseline", help="results to compare with")
+    parser.add_argument("--save-baseline", help="also write results as baseline to this path")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed slowdown against baseline")
+    parser.add_argument("--repeat", type=int, default=5, help="rounds of each micro-benchmark")
+    parser.add_argument("--selfplay-steps", type=int, default=1000)
+    arguments = parser.parse_args()
+
+    report = run(arguments.repeat, arguments.selfplay_steps)
+    write(arguments.output, report)
+    if arguments.save_baseline:
+        write(arguments.save_baseline, report)
+    for name, reason in report["skipped"].items():
+        print("Skipped {} benchmarks: {}".format(name, reason))
+    if arguments.baseline:
+        with open(arguments.baseline, "r") as handler:
+            regressions = compare(report, json.load(handler), arguments.threshold)
+        if regressions:
+            print("Slower by more than {:.0%}: {}".format(arguments.threshold, ", ".join(regressions)))
+            sys.exit(1)
+    else:
+        for name, current in sorted(report["results"].items()):
+            print("{:60} {:12.6f}s".format(name, current["seconds"]))
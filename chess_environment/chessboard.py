@@ -2,6 +2,8 @@ import numpy as np
 import chess
 import re
 
+from chess_environment.encoding import encode_board, encode_children, encode_deltas, mirror_states, STATE_SIZE
+
 
 class IllegalMoveException(Exception):
     def __init__(self):
@@ -14,6 +16,45 @@ STALEMATE = -50
 IGNORE_GO = 420
 
 
+def mirror_move(move: chess.Move):
+    """Maps move between the real board and the board seen by the other player (`chess.Board.mirror`)"""
+    return chess.Move(chess.square_mirror(move.from_square), chess.square_mirror(move.to_square), move.promotion)
+
+
+def mirror_fen(fen: str):
+    """Gets FEN of `chess.Board(fen).mirror()` by rewriting the FEN text"""
+    placement, turn, castling, en_passant, halfmove, fullmove = fen.split(" ")
+    placement = "/".join(reversed(placement.split("/"))).swapcase()
+    turn = "b" if turn == "w" else "w"
+    castling = "".join(right for right in "KQkq" if right.swapcase() in castling) or "-"
+    if en_passant != "-":
+        en_passant = en_passant[0] + ("6" if en_passant[1] == "3" else "3")
+    return " ".join([placement, turn, castling, en_passant, halfmove, fullmove])
+
+
+class LazyFens:
+    """Sequence of FENs of positions after given moves, each built on first access
+
+    If `mirrored` is True, FENs are of the positions seen by the other player.
+    """
+    def __init__(self, board: chess.Board, moves: list, mirrored=False):
+        self._board = board.copy(stack=False)
+        self._moves = moves
+        self._mirrored = mirrored
+        self._fens = {}
+
+    def __len__(self):
+        return len(self._moves)
+
+    def __getitem__(self, index: int):
+        if index not in self._fens:
+            self._board.push(self._moves[index])
+            fen = self._board.fen()
+            self._board.pop()
+            self._fens[index] = mirror_fen(fen) if self._mirrored else fen
+        return self._fens[index]
+
+
 class ChessBoard:
     def __init__(self, starting_fen=chess.STARTING_BOARD_FEN):
         self._current_state = chess.Board(starting_fen)
@@ -62,39 +103,98 @@ class ChessBoard:
 
         return encoded_board
 
-    def get_moves(self, flip=False):
-        board = self._current_state if not flip else self._current_state.mirror()
-        possible_moves = board.legal_moves
-        possible_states = []
-        possible_states_fens = []
+    """Get possible moves with states and FENs of positions after them
+
+    Flipped moves, states and FENs are the ones of mirrored board (`chess.Board.mirror`),
+    that is as seen by the player to move if it were white. They are obtained by mirroring
+    results of the real board, without building mirrored boards.
 
-        for move in possible_moves:
-            future_board = board.copy()
-            future_board.push(move)
-            future_board_fen = future_board.fen()
-            future_board = self._encode_board(future_board_fen)
-            possible_states.append(future_board)
-            possible_states_fens.append(future_board_fen)
+    # Arguments
+        flip: if True, moves are generated for mirrored board
+        lazy_fens: if True, FENs are returned as `LazyFens`, which builds only the ones accessed
+    """
+    def get_moves(self, flip=False, lazy_fens=False):
+        board = self._current_state
+        real_moves = list(board.legal_moves)
+        possible_states = self._encode_children(real_moves, flip)
+        possible_moves = self._flip_moves(real_moves, flip)
+        possible_states = possible_states.tolist()
+        if lazy_fens:
+            possible_states_fens = LazyFens(board, real_moves, mirrored=flip)
+        else:
+            possible_states_fens = []
+            for move in real_moves:
+                board.push(move)
+                fen = board.fen()
+                board.pop()
+                possible_states_fens.append(mirror_fen(fen) if flip else fen)
 
         return possible_moves, possible_states, possible_states_fens
 
+    """Get possible moves with their states packed into one array
+
+    # Arguments
+        flip: if True, moves are generated for mirrored board (as in `get_moves`)
+        out: optional caller-owned buffer of shape (capacity, 384) reused between calls,
+            e.g. `np.empty((MAX_MOVES, 384), dtype=np.float32)`
+        dtype: type of allocated array when `out` is not given
+
+    # Returns
+        list of legal moves and (number of moves, 384) array of states after them,
+        which is a view on first rows of `out` if it was given
+    """
+    def get_moves_batch(self, flip=False, out: np.ndarray = None, dtype=np.int8):
+        real_moves = list(self._current_state.legal_moves)
+        moves_num = len(real_moves)
+        if out is None:
+            out = np.empty((moves_num, STATE_SIZE), dtype=dtype)
+        elif out.shape[0] < moves_num or out.shape[1:] != (STATE_SIZE,):
+            raise ValueError("Buffer of shape {} cannot hold {} states".format(out.shape, moves_num))
+        possible_states = self._encode_children(real_moves, flip, out=out[:moves_num])
+        return self._flip_moves(real_moves, flip), possible_states
+
+    """Get possible moves as changes of the current state's encoding, for incremental evaluation
+
+    # Arguments
+        flip: if True, moves are generated for mirrored board (as in `get_moves`)
+
+    # Returns
+        list of legal moves, encoding of the current state (384 int8 array) and, for each move,
+        indices and changes of `encode_deltas` turning it into the state after the move
+    """
+    def get_moves_deltas(self, flip=False):
+        board = self._current_state
+        real_moves = list(board.legal_moves)
+        state = encode_board(board)
+        if flip:
+            state = mirror_states(state)
+        indices, changes = encode_deltas(board, real_moves, mirrored=flip)
+        return self._flip_moves(real_moves, flip), state, indices, changes
+
+    def _encode_children(self, real_moves: list, flip: bool, out: np.ndarray = None):
+        states = encode_children(self._current_state, real_moves, out=None if flip else out)
+        if flip:
+            states = mirror_states(states, out=out)
+        return states
+
+    @staticmethod
+    def _flip_moves(real_moves: list, flip: bool):
+        return [mirror_move(move) for move in real_moves] if flip else real_moves
+
     def _check_attack(self, board: chess.Board, move: chess.Move):
         possible_attacks = board.attacks(move.to_square)
         if move.from_square in possible_attacks:
             self._attacked = True
 
     def make_move(self, move: chess.Move, flipped=False):
+        board = self._current_state
         if flipped:
-            board = self._current_state.mirror()
-        else:
-            board = self._current_state
+            move = mirror_move(move)
         assert isinstance(board, chess.Board)
         if not board.is_legal(move):
             raise IllegalMoveException()
         self._check_attack(board, move)
         board.push(move)
-        if flipped:
-            self._current_state = board.mirror()
 
     """
     True = WHITE
@@ -124,3 +224,100 @@ class ChessBoard:
 
     def turn(self):
         return self._current_state.turn
+
+
+class VectorChessBoard:
+    """Several independent games stepped together
+
+    Children of every game's position are generated into one array, so a single forward pass
+    can value moves of all games. Rewards follow `ChessBoard.get_results` and finished games
+    start again from the initial position.
+
+    # Arguments
+        games: number of games
+        starting_fen: position every game starts from
+    """
+    def __init__(self, games: int, starting_fen=chess.STARTING_BOARD_FEN):
+        self.boards = [ChessBoard(starting_fen) for _ in range(games)]
+
+    def __len__(self):
+        return len(self.boards)
+
+    """Side to move in every game (True = WHITE, False = BLACK)"""
+    def current_turns(self):
+        return np.array([board.current_turn() for board in self.boards], dtype=bool)
+
+    """Get possible moves of all games with their states in one array
+
+    # Arguments
+        flip: bool for all games or sequence of bools for each one, by default games with
+            black to move are flipped (so states are always seen by the side to move)
+        out: optional caller-owned buffer of shape (capacity, 384), e.g. `(games * MAX_MOVES, 384)`
+        dtype: type of allocated array when `out` is not given
+
+    # Returns
+        list of moves lists (one per game), (total number of moves, 384) array of states
+        and (games + 1) array of offsets, states of i-th game are `states[offsets[i]:offsets[i + 1]]`
+    """
+    def get_moves_batch(self, flip=None, out: np.ndarray = None, dtype=np.int8):
+        flips = self._flips(flip)
+        real_moves = [list(board._current_state.legal_moves) for board in self.boards]
+        offsets = np.zeros(len(self.boards) + 1, dtype=np.int64)
+        np.cumsum([len(moves) for moves in real_moves], out=offsets[1:])
+        if out is None:
+            out = np.empty((offsets[-1], STATE_SIZE), dtype=dtype)
+        elif out.shape[0] < offsets[-1] or out.shape[1:] != (STATE_SIZE,):
+            raise ValueError("Buffer of shape {} cannot hold {} states".format(out.shape, offsets[-1]))
+        possible_moves = []
+        for i, (board, moves) in enumerate(zip(self.boards, real_moves)):
+            board._encode_children(moves, flips[i], out=out[offsets[i]:offsets[i + 1]])
+            possible_moves.append(board._flip_moves(moves, flips[i]))
+        return possible_moves, out[:offsets[-1]], offsets
+
+    """Make one move in every game
+
+    # Arguments
+        moves: move for each game, None leaves the game as it is
+        flipped: bool for all games or sequence of bools, as `flip` given to `get_moves_batch`
+    """
+    def make_moves(self, moves: list, flipped=None):
+        if len(moves) != len(self.boards):
+            raise ValueError("Got {} moves for {} games".format(len(moves), len(self.boards)))
+        flips = self._flips(flipped)
+        for board, move, flip in zip(self.boards, moves, flips):
+            if move is not None:
+                board.make_move(move, flip)
+
+    """FENs of positions after one move in every game, as seen by the player making it if flipped
+
+    # Arguments
+        moves, flipped: as given to `make_moves`
+
+    # Returns
+        list of FENs, None for games without a move
+    """
+    def get_fens(self, moves: list, flipped=None):
+        flips = self._flips(flipped)
+        return [LazyFens(board._current_state, [mirror_move(move) if flip else move], mirrored=flip)[0]
+                if move is not None else None
+                for board, move, flip in zip(self.boards, moves, flips)]
+
+    """Rewards of last moves, games which are over start again
+
+    # Returns
+        array of rewards, as given by `ChessBoard.get_results` for each game
+    """
+    def get_results(self):
+        return np.array([board.get_results() for board in self.boards])
+
+    def game_over(self):
+        return np.array([board.game_over() for board in self.boards], dtype=bool)
+
+    def _flips(self, flip):
+        if flip is None:
+            return ~self.current_turns()
+        if isinstance(flip, (bool, np.bool_)):
+            return np.full(len(self.boards), flip, dtype=bool)
+        if len(flip) != len(self.boards):
+            raise ValueError("Got {} flips for {} games".format(len(flip), len(self.boards)))
+        return np.asarray(flip, dtype=bool)
@@ -1,6 +1,19 @@
 import unittest
 import chess
+import chess.polyglot
+import numpy as np
 import chess_environment.chessboard as cb
+from chess_environment.encoding import apply_delta, decode_board_fens, encode_board, encode_children, \
+    encode_deltas, mirror_states, pack_moves, pack_position_keys, pack_states, unpack_moves, unpack_position_keys, \
+    unpack_states, zobrist_child_keys, zobrist_keys, MAX_MOVES
+
+TEST_FENS = [
+    chess.STARTING_FEN,
+    "rnbqkbnr/ppp1pppp/8/3p4/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 1",
+    "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N2N2/PP2BPPP/R2QKB1R w KQ - 4 8",
+    "r3k2r/pPpp1ppp/8/3Pp3/8/8/P1PP1PPP/R3K2R w KQkq e6 0 10",
+    "8/8/8/5K1k/8/8/8/6R1 w - - 0 1",
+]
 
 
 class ChessBoardTests(unittest.TestCase):
@@ -56,6 +69,38 @@ class ChessBoardTests(unittest.TestCase):
         actual_output = self.board._encode_board(board.fen())
         self.assertListEqual(actual_output, desired_output)
 
+    def test_bitboard_encoding_matches_fen_encoding(self):
+        for fen_code in TEST_FENS:
+            board = chess.Board(fen_code)
+            actual_output = encode_board(board)
+            self.assertEqual(actual_output.dtype, np.int8)
+            self.assertListEqual(actual_output.tolist(), self.board._encode_board(board.fen()))
+
+    def test_incremental_children_encoding(self):
+        for fen_code in TEST_FENS:
+            for board in (chess.Board(fen_code), chess.Board(fen_code).mirror()):
+                moves = list(board.legal_moves)
+                states = encode_children(board, moves)
+                for move, state in zip(moves, states):
+                    future_board = board.copy()
+                    future_board.push(move)
+                    self.assertListEqual(state.tolist(), encode_board(future_board).tolist())
+
+    def test_packing_states_and_moves(self):
+        board = chess.Board(TEST_FENS[3])
+        moves = list(board.legal_moves)
+        states = encode_children(board, moves)
+        packed_states = pack_states(states)
+        self.assertEqual(packed_states.shape, (len(moves), 96))
+        self.assertListEqual(unpack_states(packed_states).tolist(), states.tolist())
+        self.assertListEqual(unpack_moves(pack_moves(moves)), moves)
+
+    def test_fens_from_states_and_position_keys(self):
+        fens = TEST_FENS + [chess.Board(fen).mirror().fen() for fen in TEST_FENS]
+        states = np.array([encode_board(chess.Board(fen)) for fen in fens])
+        self.assertListEqual(decode_board_fens(states), [fen.split(" ")[0] for fen in fens])
+        self.assertListEqual(unpack_position_keys(decode_board_fens(states), pack_position_keys(fens)), fens)
+
     def test_getting_possible_moves(self):
         inner_board = self.board._current_state
         moves, states, _ = self.board.get_moves()
@@ -83,6 +128,58 @@ class ChessBoardTests(unittest.TestCase):
         inner_board_flipped_coded = self.board._encode_board(inner_board_flipped.fen())
         self.assertListEqual(test_state, inner_board_flipped_coded)
 
+    def test_getting_possible_moves_batch(self):
+        for flip in (False, True):
+            board = cb.ChessBoard(TEST_FENS[3])
+            moves, states, _ = board.get_moves(flip=flip)
+            batch_moves, batch_states = board.get_moves_batch(flip=flip)
+            self.assertListEqual(batch_moves, list(moves))
+            self.assertEqual(batch_states.shape, (len(batch_moves), 384))
+            self.assertListEqual(batch_states.tolist(), states)
+
+    def test_zobrist_keys(self):
+        hasher = chess.polyglot.ZobristHasher(chess.polyglot.POLYGLOT_RANDOM_ARRAY)
+        for fen_code in TEST_FENS:
+            for board in (chess.Board(fen_code), chess.Board(fen_code).mirror()):
+                moves = list(board.legal_moves)
+                state = encode_board(board)
+                key = zobrist_keys(state)
+                self.assertEqual(int(key), hasher.hash_board(board))
+                indices, changes = encode_deltas(board, moves)
+                child_keys = zobrist_child_keys(key, state, indices, changes)
+                self.assertListEqual(child_keys.tolist(), zobrist_keys(encode_children(board, moves)).tolist())
+
+    def test_getting_possible_moves_deltas(self):
+        for fen_code in TEST_FENS:
+            for flip in (False, True):
+                board = cb.ChessBoard(fen_code)
+                batch_moves, batch_states = board.get_moves_batch(flip=flip)
+                moves, state, indices, changes = board.get_moves_deltas(flip=flip)
+                self.assertListEqual(moves, batch_moves)
+                for i in range(len(moves)):
+                    self.assertListEqual(apply_delta(state, indices[i], changes[i]).tolist(), batch_states[i].tolist())
+
+    def test_getting_possible_moves_batch_into_buffer(self):
+        buffer = np.zeros((MAX_MOVES, 384), dtype=np.float32)
+        moves, states = self.board.get_moves_batch(out=buffer)
+        self.assertEqual(states.dtype, np.float32)
+        self.assertTrue(np.shares_memory(states, buffer))
+        self.assertListEqual(states.tolist(), self.board.get_moves()[1])
+        with self.assertRaises(ValueError):
+            self.board.get_moves_batch(out=buffer[:len(moves) - 1])
+
+    def test_getting_possible_moves_lazy_fens(self):
+        for flip in (False, True):
+            moves, _, fens = self.board.get_moves(flip=flip)
+            lazy_moves, _, lazy_fens = self.board.get_moves(flip=flip, lazy_fens=True)
+            self.assertIsInstance(lazy_fens, cb.LazyFens)
+            self.assertEqual(len(lazy_fens._fens), 0)
+            self.assertEqual(lazy_fens[3], fens[3])
+            self.assertEqual(len(lazy_fens._fens), 1)
+            self.board.make_move(lazy_moves[0], flipped=flip)
+            self.assertListEqual(list(lazy_fens), fens)
+            self.board = cb.ChessBoard()
+
     def test_making_move(self):
         test_board = self.board._current_state.copy()
         move = None
@@ -103,8 +200,22 @@ class ChessBoardTests(unittest.TestCase):
             break
 
         test_board.push(move)
+        real_board = self.board._current_state.copy()
+        real_board.push(cb.mirror_move(move))
         self.board.make_move(move, flipped=True)
-        self.assertEqual(self.board._current_state.fen(), test_board.mirror().fen())
+        self.assertEqual(self.board._current_state.board_fen(), test_board.mirror().board_fen())
+        self.assertEqual(self.board._current_state.fen(), real_board.fen())
+
+    def test_mirroring_fen(self):
+        for fen_code in TEST_FENS:
+            board = chess.Board(fen_code)
+            self.assertEqual(cb.mirror_fen(board.fen()), board.mirror().fen())
+
+    def test_mirroring_states(self):
+        for fen_code in TEST_FENS:
+            board = chess.Board(fen_code)
+            mirrored_state = mirror_states(encode_board(board))
+            self.assertListEqual(mirrored_state.tolist(), encode_board(board.mirror()).tolist())
 
     def test_illegal_move(self):
         move = chess.Move(chess.A1, chess.A2)
@@ -133,5 +244,32 @@ class ChessBoardTests(unittest.TestCase):
         self.assertEqual(board.get_results(), cb.CHECKMATE)
 
 
+class VectorChessBoardTests(unittest.TestCase):
+    def test_getting_possible_moves_of_all_games(self):
+        boards = cb.VectorChessBoard(3)
+        boards.make_moves([chess.Move(chess.E2, chess.E4), None, chess.Move(chess.G1, chess.F3)])
+        moves, states, offsets = boards.get_moves_batch()
+        self.assertEqual(len(offsets), 4)
+        self.assertEqual(offsets[-1], len(states))
+        for i, board in enumerate(boards.boards):
+            expected_moves, expected_states = board.get_moves_batch(flip=not board.current_turn())
+            self.assertEqual(moves[i], expected_moves)
+            self.assertTrue(np.array_equal(states[offsets[i]:offsets[i + 1]], expected_states))
+        first_moves = [game_moves[0] for game_moves in moves]
+        for board, move, fen in zip(boards.boards, first_moves, boards.get_fens(first_moves)):
+            _, _, expected_fens = board.get_moves(flip=not board.current_turn())
+            self.assertEqual(fen, expected_fens[0])
+
+    def test_results_of_all_games(self):
+        boards = cb.VectorChessBoard(2)
+        boards.boards[0] = cb.ChessBoard("8/8/8/5K1k/8/8/8/6R1 w k - 0 1")
+        boards.boards[1] = cb.ChessBoard("rnbqkbnr/ppp1pppp/8/3p4/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 1")
+        boards.make_moves([chess.Move(chess.G1, chess.H1), chess.Move(chess.E4, chess.D5)], flipped=False)
+        self.assertEqual(boards.get_results().tolist(), [cb.CHECKMATE, cb.ATTACK])
+        # finished game starts again
+        self.assertEqual(boards.boards[0]._current_state.board_fen(), chess.STARTING_BOARD_FEN)
+        self.assertEqual(boards.get_results().tolist(), [0, 0])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,316 @@
+import chess
+import numpy as np
+from chess.polyglot import POLYGLOT_RANDOM_ARRAY
+
+STATE_SIZE = 384
+# upper bound of legal moves in any reachable chess position
+MAX_MOVES = 218
+
+# Bitboards serialised as big-endian bytes unpack from h8 down to a1,
+# while the network input lists squares in FEN order (a8..h8, ..., a1..h1).
+_FEN_ORDER = np.arange(64) ^ 7
+
+
+def encode_board(board: chess.BaseBoard, out: np.ndarray = None):
+    """Encodes board's pieces into 384 element vector
+
+    Reads the 12 piece bitboards straight from the board, so the result is identical
+    to `ChessBoard._encode_board(board.fen())` without building and parsing a FEN.
+
+    # Arguments
+        board: position to encode
+        out: optional array of 384 elements the encoding is written into
+
+    # Returns
+        int8 array (or `out`) holding 1-of-6 piece codes per square, negative for white pieces
+    """
+    bitboards = np.array(
+        [board.pieces_mask(piece_type, color)
+         for color in (chess.BLACK, chess.WHITE)
+         for piece_type in chess.PIECE_TYPES],
+        dtype=">u8")
+    bits = np.unpackbits(bitboards.view(np.uint8)).reshape((2, 6, 64))[:, :, _FEN_ORDER]
+    if out is None:
+        out = np.empty(STATE_SIZE, dtype=np.int8)
+    np.subtract(bits[0].T, bits[1].T, out=out.reshape((64, 6)), dtype=out.dtype, casting="unsafe")
+    return out
+
+
+def _field(square: chess.Square, piece_type: chess.PieceType):
+    return (square ^ 56) * 6 + piece_type - 1
+
+
+def move_delta(board: chess.Board, move: chess.Move):
+    """Lists changes made in board's encoding by a legal move
+
+    Only the from-square, the to-square and squares of captured pawn (en passant)
+    or castling rook change, so the encoding of the position after the move is
+    `encode_board(board)` with `changes` added at `indices`.
+
+    # Returns
+        indices of changed elements and values added to them (lists of up to 4 ints, indices are distinct)
+    """
+    sign = 1 if board.turn == chess.BLACK else -1
+    piece_type = board.piece_type_at(move.from_square)
+    indices = [_field(move.from_square, piece_type)]
+    changes = [-sign]
+    if board.is_castling(move):
+        rank = chess.square_rank(move.from_square)
+        kingside = board.is_kingside_castling(move)
+        king_to = chess.square(6 if kingside else 2, rank)
+        rook_from = chess.square(7 if kingside else 0, rank)
+        rook_to = chess.square(5 if kingside else 3, rank)
+        indices += [_field(king_to, chess.KING), _field(rook_from, chess.ROOK), _field(rook_to, chess.ROOK)]
+        changes += [sign, -sign, sign]
+        return indices, changes
+
+    captured_type = board.piece_type_at(move.to_square)
+    placed_type = move.promotion or piece_type
+    if captured_type == placed_type:
+        # the field changes from captured piece to ours at once
+        indices.append(_field(move.to_square, placed_type))
+        changes.append(2 * sign)
+        return indices, changes
+    if captured_type is not None:
+        indices.append(_field(move.to_square, captured_type))
+        changes.append(sign)
+    elif board.is_en_passant(move):
+        captured_square = move.to_square + (-8 if board.turn == chess.WHITE else 8)
+        indices.append(_field(captured_square, chess.PAWN))
+        changes.append(sign)
+    indices.append(_field(move.to_square, placed_type))
+    changes.append(sign)
+    return indices, changes
+
+
+def encode_children(board: chess.Board, moves, out: np.ndarray = None):
+    """Encodes positions after each of moves by applying `move_delta` to board's encoding
+
+    # Arguments
+        board: position the moves are made from
+        moves: sequence of legal moves
+        out: optional array of shape (len(moves), 384) the encodings are written into
+
+    # Returns
+        int8 array (or `out`) with encoding of position after i-th move in i-th row
+    """
+    if out is None:
+        out = np.empty((len(moves), STATE_SIZE), dtype=np.int8)
+    out[:] = encode_board(board)
+    for move, state in zip(moves, out):
+        indices, changes = move_delta(board, move)
+        for index, change in zip(indices, changes):
+            state[index] += change
+    return out
+
+
+# changes of a move are padded to MAX_DELTA entries, padding points past the encoding (at STATE_SIZE)
+MAX_DELTA = 4
+
+
+def encode_deltas(board: chess.Board, moves, mirrored=False):
+    """Lists changes made in board's encoding by each of moves (`move_delta` padded into arrays)
+
+    # Arguments
+        board: position the moves are made from
+        moves: sequence of legal moves
+        mirrored: if True, changes are made in encoding of mirrored board, as `mirror_states` gives it
+
+    # Returns
+        (len(moves), 4) array of changed elements' indices, STATE_SIZE where padded,
+        and int8 array of the same shape with values added at them, 0 where padded
+    """
+    indices = np.full((len(moves), MAX_DELTA), STATE_SIZE, dtype=np.intp)
+    changes = np.zeros((len(moves), MAX_DELTA), dtype=np.int8)
+    for i, move in enumerate(moves):
+        move_indices, move_changes = move_delta(board, move)
+        indices[i, :len(move_indices)] = move_indices
+        changes[i, :len(move_changes)] = move_changes
+    if mirrored:
+        indices = _MIRRORED_FIELDS[indices]
+        np.negative(changes, out=changes)
+    return indices, changes
+
+
+def apply_delta(state: np.ndarray, indices: np.ndarray, changes: np.ndarray):
+    """Encoding after a move, given encoding before it and the move's row of `encode_deltas`"""
+    child = np.append(state, np.zeros(1, dtype=state.dtype))
+    np.add.at(child, indices, changes)
+    return child[:STATE_SIZE]
+
+
+def mirror_states(states: np.ndarray, out: np.ndarray = None):
+    """Encodes states as seen by the other player
+
+    Same as encoding `board.mirror()`: ranks are swapped and pieces change colour,
+    so the fields are reindexed and negated instead of building mirrored boards.
+
+    # Arguments
+        states: array of shape (..., 384)
+        out: optional array of the same shape the result is written into (must not be `states`)
+    """
+    fields = states.reshape(states.shape[:-1] + (8, 8, 6))
+    if out is None:
+        out = np.empty_like(states)
+    np.negative(fields[..., ::-1, :, :], out=out.reshape(fields.shape))
+    return out
+
+
+# index of each element (and of padding) in encoding of mirrored board
+_MIRRORED_FIELDS = np.append(np.arange(STATE_SIZE).reshape((8, 8, 6))[::-1].ravel(), STATE_SIZE)
+
+
+# Zobrist keys of encoding's elements, from polyglot's random numbers: `zobrist_keys(encode_board(board))`
+# is python-chess's `chess.polyglot.ZobristHasher(POLYGLOT_RANDOM_ARRAY).hash_board(board)`,
+# the part of `chess.polyglot.zobrist_hash` given by pieces. Rows are indexed by element (padding
+# of `encode_deltas` included), columns by element's value + 1 (white piece, empty, black piece).
+def _zobrist_table():
+    table = np.zeros((STATE_SIZE + 1, 3), dtype=np.uint64)
+    for square in chess.SQUARES:
+        for piece_type in chess.PIECE_TYPES:
+            for value, pivot in ((-1, 1), (1, 0)):
+                piece_index = (piece_type - 1) * 2 + pivot
+                table[_field(square, piece_type), value + 1] = POLYGLOT_RANDOM_ARRAY[64 * piece_index + square]
+    return table
+
+
+_ZOBRIST = _zobrist_table()
+
+
+def zobrist_keys(states: np.ndarray):
+    """Zobrist keys of encoded positions (XOR of keys of their pieces), see `_ZOBRIST`
+
+    # Arguments
+        states: array of shape (..., 384)
+
+    # Returns
+        uint64 array of shape states.shape[:-1]
+    """
+    states = np.asarray(states)
+    flat = states.reshape((-1, STATE_SIZE))
+    # searching a boolean array is several times faster than np.nonzero of the states
+    occupied = np.flatnonzero(flat != 0)
+    rows, fields = np.divmod(occupied, STATE_SIZE)
+    pieces = _ZOBRIST[fields, flat.ravel()[occupied].astype(np.intp) + 1]
+    keys = np.zeros(len(flat), dtype=np.uint64)
+    counts = np.bincount(rows, minlength=len(flat))
+    filled = counts > 0
+    if filled.any():
+        keys[filled] = np.bitwise_xor.reduceat(pieces, (np.cumsum(counts) - counts)[filled])
+    return keys.reshape(states.shape[:-1])
+
+
+def zobrist_child_keys(key, state: np.ndarray, indices: np.ndarray, changes: np.ndarray):
+    """Zobrist keys of positions after moves, updated from the key of position before them
+
+    # Arguments
+        key: `zobrist_keys` of state
+        state: 384 element encoding of the position the moves are made from
+        indices: (number of moves, 4) indices of changed elements, as `encode_deltas` returns them
+        changes: values added at indices
+
+    # Returns
+        uint64 array of keys, same as `zobrist_keys` of states after the moves
+    """
+    before = np.append(state, 0).astype(np.intp)[indices]
+    after = before + changes
+    toggled = _ZOBRIST[indices, before + 1] ^ _ZOBRIST[indices, after + 1]
+    return np.bitwise_xor.reduce(toggled, axis=1) ^ np.uint64(key)
+
+
+PACKED_STATE_SIZE = 96
+
+
+def pack_states(states: np.ndarray):
+    """Packs states into 96 bytes each (a bit for every positive and every negative field)
+
+    # Arguments
+        states: array of shape (..., 384) with values -1, 0 and 1
+
+    # Returns
+        uint8 array of shape (..., 96)
+    """
+    planes = np.concatenate([states > 0, states < 0], axis=-1)
+    return np.packbits(planes, axis=-1)
+
+
+def unpack_states(packed: np.ndarray, dtype=np.int8):
+    """Expands states packed with `pack_states` back to arrays of shape (..., 384)"""
+    planes = np.unpackbits(packed, axis=-1).astype(dtype)
+    return planes[..., :STATE_SIZE] - planes[..., STATE_SIZE:]
+
+
+def pack_moves(moves):
+    """Packs moves into uint16 array (from square, to square and promotion in 6, 6 and 4 bits)"""
+    return np.array([move.from_square | move.to_square << 6 | (move.promotion or 0) << 12 for move in moves],
+                    dtype=np.uint16)
+
+
+def unpack_moves(packed: np.ndarray):
+    return [chess.Move(int(code) & 63, int(code) >> 6 & 63, int(code) >> 12 or None) for code in packed]
+
+
+# ASCII codes of pieces by colour (black, white) and piece type index, white pieces are encoded as negative values
+_PIECE_LETTERS = np.array([list(b"pnbrqk"), list(b"PNBRQK")], dtype=np.uint8)
+
+
+def decode_board_fens(states: np.ndarray):
+    """Piece placement parts of FENs of encoded states, the inverse of `encode_board`
+
+    # Arguments
+        states: array of shape (number of states, 384)
+
+    # Returns
+        list of board FENs (e.g. `chess.STARTING_BOARD_FEN`)
+    """
+    fields = np.asarray(states).reshape((-1, 64, 6))
+    piece_types = np.abs(fields).argmax(axis=2)
+    white = (fields.min(axis=2) < 0).astype(np.int64)
+    # every rank is written as 8 characters followed by "/", or a new line after the last rank,
+    # so all FENs are built in one string with empty squares as "1"
+    text = np.empty((len(fields), 8, 9), dtype=np.uint8)
+    text[:, :, :8] = np.where(fields.any(axis=2), _PIECE_LETTERS[white, piece_types], ord("1")).reshape((-1, 8, 8))
+    text[:, :, 8] = ord("/")
+    text[:, 7, 8] = ord("\n")
+    fens = text.tobytes().decode("ascii")
+    for run in range(8, 1, -1):
+        fens = fens.replace("1" * run, str(run))
+    return fens.split("\n")[:-1]
+
+
+_CASTLING_RIGHTS = "KQkq"
+_NO_EN_PASSANT = 8
+
+
+def pack_position_keys(fens):
+    """Packs everything but the piece placement of FENs into uint64 keys
+
+    Bits hold side to move (1), castling rights (4), en passant file (4, 8 for none),
+    halfmove clock (16) and fullmove number (16). With the placement recovered from the encoded state
+    by `decode_board_fens`, `unpack_position_keys` gives back the whole FEN.
+    """
+    keys = np.empty(len(fens), dtype=np.uint64)
+    for i, fen in enumerate(fens):
+        _, turn, castling, en_passant, halfmove, fullmove = fen.split(" ")
+        key = 1 if turn == "w" else 0
+        for bit, right in enumerate(_CASTLING_RIGHTS):
+            if right in castling:
+                key |= 1 << (1 + bit)
+        key |= (_NO_EN_PASSANT if en_passant == "-" else ord(en_passant[0]) - ord("a")) << 5
+        key |= int(halfmove) << 9
+        key |= int(fullmove) << 25
+        keys[i] = key
+    return keys
+
+
+def unpack_position_keys(board_fens, keys):
+    """Joins board FENs with positions' keys packed by `pack_position_keys` into full FENs"""
+    fens = []
+    for board_fen, key in zip(board_fens, np.asarray(keys, dtype=np.uint64).tolist()):
+        white = key & 1
+        castling = "".join(right for bit, right in enumerate(_CASTLING_RIGHTS) if key >> (1 + bit) & 1) or "-"
+        file = key >> 5 & 15
+        en_passant = "-" if file == _NO_EN_PASSANT else chr(ord("a") + file) + ("6" if white else "3")
+        fens.append(" ".join([board_fen, "w" if white else "b", castling, en_passant,
+                              str(key >> 9 & 0xFFFF), str(key >> 25 & 0xFFFF)]))
+    return fens
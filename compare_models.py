@@ -1,8 +1,8 @@
 import copy
 import chess
 import itertools
-from keras.engine.saving import load_model
 from chess_environment.chessboard import ChessBoard, STALEMATE, CHECKMATE
+from dqn_tools.cache import EvaluationCache
 from engine import DQNChessEngine
 
 
@@ -44,10 +44,11 @@ competitors_paths = {
     "BuzdyganDQNv0 50k active": "final/BuzdyganDQNv0_50k_active.h5f",
     "BuzdyganDQNv0 50k target": "final/BuzdyganDQNv0_50k_target.h5f",
 }
+# positions cached by each competitor, the openings repeat in every game
+CACHE_SIZE = 1 << 18
 competitors = {}
 for competitor, path in zip(competitors_paths.keys(), competitors_paths.values()):
-    model = load_model(path)
-    competitors[competitor] = DQNChessEngine(model)
+    competitors[competitor] = DQNChessEngine.from_file(path, EvaluationCache(CACHE_SIZE))
 
 
 GAMES_PER_PAIR = 2
@@ -98,3 +99,5 @@ for r_k in results.keys():
     list_of_results = results[r_k]
     for r in list_of_results:
         print(r[0], str(r[1]))
+for competitor, engine in competitors.items():
+    print(competitor, engine.cache)
@@ -0,0 +1,20 @@
+import glob
+import os
+import sys
+
+from dqn_tools.columns import convert_pickled_memory, has_memory_columns
+
+# rewrites every pickled replay memory (<name>_memory.obj) in given directories as columns,
+# e.g. python convert_memory.py tmp final models/LeakyDQNv0/IntermediateModels
+REMOVE_PICKLES = False
+
+if __name__ == "__main__":
+    directories = sys.argv[1:] or ["tmp", "final"]
+    for directory in directories:
+        for path in sorted(glob.glob(os.path.join(directory, "*_memory.obj"))):
+            name = os.path.basename(path)[:-len("_memory.obj")]
+            if has_memory_columns(directory, name):
+                print("{} already converted".format(path))
+                continue
+            memory = convert_pickled_memory(directory, name, remove=REMOVE_PICKLES)
+            print("{}: {} records".format(path, len(memory)))
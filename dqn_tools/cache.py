@@ -0,0 +1,109 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+class EvaluationCache:
+    """Bounded LRU cache of positions' values keyed by Zobrist keys of their encodings (`zobrist_keys`)
+
+    Every entry is tagged with the weights version it was computed with. `invalidate` starts a new version
+    when weights of the evaluated model change (`DQNTrainer` does it for its target cache), entries
+    of older versions are never returned and are replaced or evicted as the least recently used ones.
+
+    # Arguments
+        max_size: number of entries kept
+
+    Usage:
+        values = cache.evaluate(zobrist_keys(states), lambda missing: predict_values(model, states[missing]))
+    """
+    def __init__(self, max_size: int = 1 << 20):
+        if max_size < 1:
+            raise ValueError("Cache has to hold at least one entry, got max_size={}".format(max_size))
+        self.max_size = max_size
+        self.version = 0
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def invalidate(self):
+        """Starts new weights version, values cached so far are not used any more"""
+        self.version += 1
+
+    """Cached values of keys
+
+    # Returns
+        float32 array of values (0 where missing) and boolean array marking keys which are not cached
+    """
+    def lookup(self, keys: np.ndarray):
+        values = np.zeros(len(keys), dtype=np.float32)
+        missing = np.ones(len(keys), dtype=bool)
+        entries = self._entries
+        version = self.version
+        for i, key in enumerate(np.asarray(keys).tolist()):
+            entry = entries.get(key)
+            if entry is None:
+                continue
+            if entry[0] != version:
+                self.stale += 1
+                continue
+            entries.move_to_end(key)
+            values[i] = entry[1]
+            missing[i] = False
+        hits = len(keys) - int(missing.sum())
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return values, missing
+
+    """Caches values of keys
+
+    # Arguments
+        version: weights version the values were computed with, the current one by default
+    """
+    def store(self, keys: np.ndarray, values: np.ndarray, version: int = None):
+        entries = self._entries
+        version = self.version if version is None else version
+        for key, value in zip(np.asarray(keys).tolist(), np.asarray(values).reshape(-1).tolist()):
+            entries[key] = (version, value)
+            entries.move_to_end(key)
+        while len(entries) > self.max_size:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    """Values of keys, the ones which are not cached are computed and stored
+
+    # Arguments
+        keys: uint64 array of Zobrist keys
+        evaluate: function of boolean array marking missing keys, returning their values in the same order
+
+    # Returns
+        float32 array of values
+    """
+    def evaluate(self, keys: np.ndarray, evaluate):
+        version = self.version
+        values, missing = self.lookup(keys)
+        if missing.any():
+            computed = np.asarray(evaluate(missing), dtype=np.float32).reshape(-1)
+            values[missing] = computed
+            self.store(np.asarray(keys)[missing], computed, version)
+        return values
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "stale": self.stale, "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0., "size": len(self), "version": self.version}
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def __str__(self):
+        stats = self.stats()
+        return "Cache: {size} entries, {hits} hits, {misses} misses ({stale} stale), hit rate {hit_rate:.1%}, " \
+               "{evictions} evicted".format(**stats)
@@ -0,0 +1,95 @@
+import copy
+import os
+import re
+import threading
+
+import keras
+
+from dqn_tools.io import CHECKPOINT_SUFFIXES, model_to_bytes, write_checkpoint
+
+
+class AsyncCheckpointer:
+    """Saves checkpoints named `<name>_<step>` in background and removes old ones
+
+    `save` only takes snapshots: models are serialized in memory and replay memory is copied with its
+    `snapshot` method, then files are written by another thread while training goes on. Every file is written
+    under temporary name and renamed, so an interrupted write never leaves a broken checkpoint file.
+    After a checkpoint is written, only the last `keep_last` checkpoints written by this checkpointer
+    and those of steps divisible by `keep_every` are kept. Checkpoints already in the directory (e.g. left
+    by an earlier run this one resumes) are never removed.
+    `MemmapMemory` is not copied, checkpoints only refer to its files, which training keeps changing,
+    so only the latest checkpoint restores the memory it was saved with.
+
+    # Arguments
+        directory: where checkpoints are written, e.g. "tmp"
+        name: prefix of checkpoints' names, e.g. template's NAME
+        keep_last: number of most recent checkpoints kept
+        keep_every: checkpoints of steps divisible by it are never removed, None to keep only the last ones
+        with_memory: whether replay memory is saved in checkpoints
+    """
+    def __init__(self, directory: str, name: str, keep_last: int = 3, keep_every: int = None,
+                 with_memory: bool = True):
+        if keep_last < 1:
+            raise ValueError("At least the last checkpoint has to be kept, got keep_last={}".format(keep_last))
+        self.directory = directory
+        self.name = name
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+        self.with_memory = with_memory
+        self._pattern = re.compile(
+            "^{}_(\\d+)({})$".format(re.escape(name), "|".join(re.escape(suffix) for suffix in CHECKPOINT_SUFFIXES)))
+        self._writer = None
+        self._error = None
+        self._written = []
+
+    """Snapshot models and memory and write them in background
+
+    Waits for the previous checkpoint if it is still being written.
+    """
+    def save(self, step: int, active_model: keras.models.Model, target_model: keras.models.Model, memory=None):
+        self.wait()
+        active = model_to_bytes(active_model)
+        target = model_to_bytes(target_model)
+        if memory is not None and self.with_memory:
+            memory = memory.snapshot() if hasattr(memory, "snapshot") else copy.deepcopy(memory)
+        else:
+            memory = None
+        self._writer = threading.Thread(target=self._write, args=(step, active, target, memory))
+        self._writer.start()
+
+    def wait(self):
+        """Blocks until the checkpoint being written is finished, raises error the writing has failed with"""
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def steps(self):
+        """Steps of checkpoints in directory, in increasing order"""
+        if not os.path.isdir(self.directory):
+            return []
+        matches = (self._pattern.match(file_name) for file_name in os.listdir(self.directory))
+        return sorted({int(match.group(1)) for match in matches if match is not None})
+
+    def _write(self, step: int, active: bytes, target: bytes, memory):
+        try:
+            write_checkpoint(self.directory, "{}_{}".format(self.name, step), active, target, memory)
+            if step not in self._written:
+                self._written.append(step)
+            self._remove_old()
+        except Exception as error:
+            self._error = error
+
+    def _remove_old(self):
+        removed = set(self._written[:-self.keep_last])
+        if self.keep_every:
+            removed = {step for step in removed if step % self.keep_every != 0}
+        if not removed:
+            return
+        self._written = [step for step in self._written if step not in removed]
+        for file_name in os.listdir(self.directory):
+            match = self._pattern.match(file_name)
+            if match is not None and int(match.group(1)) in removed:
+                os.remove(os.path.join(self.directory, file_name))
@@ -0,0 +1,37 @@
+import shutil
+import tempfile
+import unittest
+
+import keras
+from keras.layers import Dense
+
+from dqn_tools.checkpoints import AsyncCheckpointer
+
+
+class AsyncCheckpointerTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.model = keras.Sequential([Dense(1, input_shape=(384,))])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def save(self, checkpointer: AsyncCheckpointer, steps: range):
+        for step in steps:
+            checkpointer.save(step, self.model, self.model)
+        checkpointer.wait()
+
+    def test_retention(self):
+        checkpointer = AsyncCheckpointer(self.directory, "Test", keep_last=2, keep_every=30)
+        self.save(checkpointer, range(10, 80, 10))
+        self.assertListEqual(checkpointer.steps(), [30, 60, 70])
+
+    def test_resuming_before_newer_checkpoints(self):
+        self.save(AsyncCheckpointer(self.directory, "Test", keep_last=2), range(100, 300, 100))
+        checkpointer = AsyncCheckpointer(self.directory, "Test", keep_last=2)
+        self.save(checkpointer, range(10, 40, 10))
+        self.assertListEqual(checkpointer.steps(), [20, 30, 100, 200])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import json
+import os
+import pickle
+
+import numpy as np
+
+from chess_environment.encoding import decode_board_fens, pack_position_keys, pack_states, unpack_position_keys, \
+    unpack_states, PACKED_STATE_SIZE
+from dqn_tools.memory import ArrayMemory, PrioritizedMemory, SimpleMemory
+
+COLUMNS_FORMAT = 1
+# file name endings of replay memory saved by `save_memory_columns` under given name
+COLUMN_SUFFIXES = ("_memory_states.npy", "_memory_rewards.npy", "_memory_positions.npy", "_memory_columns.json")
+MEMORY_TYPES = {memory_type.__name__: memory_type for memory_type in (SimpleMemory, ArrayMemory, PrioritizedMemory)}
+
+
+def _path(directory: str, name: str, suffix: str):
+    return "{}/{}{}".format(directory, name, suffix)
+
+
+def save_memory_columns(directory: str, name: str, memory, chunk_size: int = 65536):
+    """Saves replay memory as columns of records, oldest first
+
+    States are packed into 96 bytes (`pack_states`), rewards are float32 and FENs are reduced to uint64 keys
+    (`pack_position_keys`), as their piece placement is already given by states. Columns are written chunk
+    by chunk into .npy files and the header `<name>_memory_columns.json` is written last, every file is
+    replaced atomically. Stored successors are not kept, they are generated again when records are sampled.
+
+    # Arguments
+        memory: `SimpleMemory`, `ArrayMemory` or `PrioritizedMemory` (its configuration and annealed alpha
+            and beta are kept, priorities are not: loaded records start with equal ones)
+    """
+    memory_type = type(memory).__name__
+    if memory_type not in MEMORY_TYPES:
+        raise ValueError("Memory of type {} cannot be saved as columns".format(memory_type))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    length = len(memory)
+    column_specs = (("_memory_states.npy", np.uint8, (length, PACKED_STATE_SIZE)),
+                    ("_memory_rewards.npy", np.float32, (length,)),
+                    ("_memory_positions.npy", np.uint64, (length,)))
+    paths = [_path(directory, name, suffix) for suffix, _, _ in column_specs]
+    states, rewards, positions = [
+        np.lib.format.open_memmap(path + ".tmp", mode="w+", dtype=dtype, shape=shape)
+        for path, (_, dtype, shape) in zip(paths, column_specs)]
+    start = 0
+    for chunk_states, chunk_rewards, chunk_fens in memory.iter_columns(chunk_size):
+        end = start + len(chunk_fens)
+        board_fens = decode_board_fens(chunk_states)
+        for board_fen, fen in zip(board_fens, chunk_fens):
+            if fen.split(" ")[0] != board_fen:
+                raise ValueError("Record's FEN {} does not describe its state {}".format(fen, board_fen))
+        states[start:end] = pack_states(chunk_states)
+        rewards[start:end] = chunk_rewards
+        positions[start:end] = pack_position_keys(chunk_fens)
+        start = end
+    for column in (states, rewards, positions):
+        column.flush()
+    del states, rewards, positions
+    for path in paths:
+        os.replace(path + ".tmp", path)
+    header = {"format": COLUMNS_FORMAT, "memory": memory_type, "size": memory.size, "length": length}
+    if isinstance(memory, PrioritizedMemory):
+        header["config"] = memory.get_config()
+        header["annealed"] = {"alpha": memory.alpha, "beta": memory.beta}
+    header_path = _path(directory, name, "_memory_columns.json")
+    with open(header_path + ".tmp", "w") as handler:
+        json.dump(header, handler)
+    os.replace(header_path + ".tmp", header_path)
+
+
+def has_memory_columns(directory: str, name: str):
+    return os.path.isfile(_path(directory, name, "_memory_columns.json"))
+
+
+def load_memory_columns(directory: str, name: str, chunk_size: int = 65536, memory=None):
+    """Loads memory saved by `save_memory_columns`
+
+    Columns are mapped into memory and added chunk by chunk, so only one chunk of unpacked states
+    is held at once besides the memory itself.
+
+    # Arguments
+        memory: empty memory records are added to, by default a new one of the saved type, size
+            and configuration (`PrioritizedMemory` continues annealing from the saved alpha and beta)
+
+    # Returns
+        memory with records in the order they were saved
+    """
+    with open(_path(directory, name, "_memory_columns.json"), "r") as handler:
+        header = json.load(handler)
+    if header["format"] != COLUMNS_FORMAT:
+        raise ValueError("Unknown memory columns format {}".format(header["format"]))
+    if memory is None:
+        memory = MEMORY_TYPES[header["memory"]](header["size"], **header.get("config", {}))
+        if "annealed" in header:
+            memory.alpha = header["annealed"]["alpha"]
+            memory.beta = header["annealed"]["beta"]
+    states = np.load(_path(directory, name, "_memory_states.npy"), mmap_mode="r")
+    rewards = np.load(_path(directory, name, "_memory_rewards.npy"), mmap_mode="r")
+    positions = np.load(_path(directory, name, "_memory_positions.npy"), mmap_mode="r")
+    for start in range(0, header["length"], chunk_size):
+        chunk_states = unpack_states(np.array(states[start:start + chunk_size]))
+        fens = unpack_position_keys(decode_board_fens(chunk_states), np.array(positions[start:start + chunk_size]))
+        memory.extend(chunk_states, np.array(rewards[start:start + chunk_size]), fens)
+    return memory
+
+
+def convert_pickled_memory(directory: str, name: str, remove: bool = False):
+    """Rewrites memory pickled into `<name>_memory.obj` as columns
+
+    # Arguments
+        remove: whether the pickle is removed after the columns are written
+    """
+    pickle_path = _path(directory, name, "_memory.obj")
+    with open(pickle_path, "rb") as handler:
+        memory = pickle.load(handler)
+    save_memory_columns(directory, name, memory)
+    if remove:
+        os.remove(pickle_path)
+    return memory
@@ -0,0 +1,207 @@
+import multiprocessing
+import queue
+import random
+
+import keras
+import numpy as np
+
+import chess_environment.chessboard as cb
+from dqn_tools.trainers import DQNTrainer
+
+
+class TransitionQueue:
+    """Memory passed to actor's `action`, sends records to the learner instead of keeping them"""
+    def __init__(self, transitions: multiprocessing.Queue):
+        self._transitions = transitions
+
+    def add(self, record):
+        self._transitions.put(record)
+
+
+def _latest(weights_queue: multiprocessing.Queue):
+    weights = None
+    while True:
+        try:
+            weights = weights_queue.get_nowait()
+        except queue.Empty:
+            return weights
+
+
+def act(action, model: keras.Model, memory: TransitionQueue, board: cb.ChessBoard, epsilon: float):
+    """Actor's move with template's action, timed as acting phase by `Instrumentation`"""
+    action(model, memory, board, epsilon)
+
+
+def _run_actor(model_config: str, weights: list, action, get_epsilon, actor: int, actors: int, spread: float,
+               seed: int, step, transitions: multiprocessing.Queue, weights_queue: multiprocessing.Queue, stop,
+               instrumentation_log: str = None, summary_every: int = 100):
+    random.seed(seed)
+    np.random.seed(seed)
+    model = keras.models.model_from_json(model_config)
+    model.set_weights(weights)
+    memory = TransitionQueue(transitions)
+    board = cb.ChessBoard()
+    instrumentation = None
+    if instrumentation_log is not None:
+        # imported here, it replaces functions of this module
+        from dqn_tools.instrumentation import Instrumentation
+        instrumentation = Instrumentation(instrumentation_log.format(actor), summary_every=summary_every)
+        instrumentation.enable()
+    try:
+        while not stop.is_set():
+            weights = _latest(weights_queue)
+            if weights is not None:
+                model.set_weights(weights)
+            act(action, model, memory, board, actor_epsilon(get_epsilon, step.value, actor, actors, spread))
+            if instrumentation is not None:
+                instrumentation.step(step.value)
+    finally:
+        if instrumentation is not None:
+            instrumentation.disable()
+
+
+def actor_epsilons(actors: int, epsilon: float = 0.4, alpha: float = 7.):
+    """Spreads exploration over actors: i-th one uses epsilon ** (1 + alpha * i / (actors - 1))"""
+    if actors == 1:
+        return [epsilon]
+    return [epsilon ** (1 + alpha * i / (actors - 1)) for i in range(actors)]
+
+
+def actor_epsilon(get_epsilon, step: int, actor: int, actors: int, spread: float = 0.):
+    """Epsilon of actor at learner's step: template's `get_epsilon(step)` spread over actors by `actor_epsilons`
+
+    Full exploration (epsilon 1) stays 1 for every actor, so the template's warm-up is kept whatever the spread.
+    """
+    return actor_epsilons(actors, get_epsilon(step), spread)[actor]
+
+
+class ParallelTrainer:
+    """Runs self-play in actor processes while this process trains with `DQNTrainer`
+
+    Every actor plays its own games with a copy of active model, refreshed every `sync_every`
+    training steps. Actors follow template's exploration schedule at the learner's current step
+    (shared with them), optionally spread over actors by `actor_epsilon`. Records made by actors' `action`
+    are streamed through a queue of at most `queue_size` records (actors wait when it is full) to the learner,
+    which adds them to trainer's memory before each training step, waiting for at least one.
+
+    # Arguments
+        trainer: learner's trainer owning the models and the replay memory
+        action: template's `action`, it has to be picklable (e.g. method of a template instance)
+        get_epsilon: template's `get_epsilon`, picklable like `action`
+        actors: number of actor processes
+        sync_every: number of training steps between sending active model's weights to actors
+        queue_size: maximal number of records waiting for the learner
+        epsilon_spread: alpha of `actor_epsilons` once exploration drops below 1, 0 keeps template's epsilon
+            for every actor
+        seed: actors are seeded with seed + actor's number
+        instrumentation_log: if given, every actor times its acting with `Instrumentation` and appends
+            summaries (a step is an action) to this path formatted with actor's number, e.g. "tmp/actor_{}.jsonl"
+        summary_every: number of actions between actors' summaries
+    """
+    def __init__(self, trainer: DQNTrainer, action, get_epsilon, actors: int = 4, sync_every: int = 100,
+                 queue_size: int = 1000, epsilon_spread: float = 0., seed: int = 0, instrumentation_log: str = None,
+                 summary_every: int = 100):
+        if actors < 1:
+            raise ValueError("At least one actor is needed, got actors={}".format(actors))
+        self._trainer = trainer
+        self._action = action
+        self._get_epsilon = get_epsilon
+        self._actors = actors
+        self._epsilon_spread = epsilon_spread
+        self._sync_every = sync_every
+        self._queue_size = queue_size
+        self._seed = seed
+        self._instrumentation_log = instrumentation_log
+        self._summary_every = summary_every
+        # TensorFlow does not survive forking, so actors are started as new interpreters
+        self._context = multiprocessing.get_context("spawn")
+        self._transitions = None
+        self._weights_queues = []
+        self._processes = []
+        self._stop = None
+        self._step = None
+        self.received = 0
+
+    def start(self, step: int = 0):
+        """Starts actors, they explore as at learner's step `step` until `run` moves it on"""
+        model = self._trainer.get_active_model()
+        model_config = model.to_json()
+        weights = model.get_weights()
+        self._transitions = self._context.Queue(maxsize=self._queue_size)
+        self._stop = self._context.Event()
+        # written only by the learner, actors just read it
+        self._step = self._context.Value("q", step, lock=False)
+        for i in range(self._actors):
+            weights_queue = self._context.Queue(maxsize=1)
+            process = self._context.Process(
+                target=_run_actor,
+                args=(model_config, weights, self._action, self._get_epsilon, i, self._actors, self._epsilon_spread,
+                      self._seed + i, self._step, self._transitions, weights_queue, self._stop,
+                      self._instrumentation_log, self._summary_every),
+                daemon=True)
+            process.start()
+            self._weights_queues.append(weights_queue)
+            self._processes.append(process)
+
+    def stop(self):
+        self._stop.set()
+        # actors blocked on full queue have to be released before they can finish
+        self._collect()
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        self._weights_queues = []
+
+    def _collect(self, wait=False):
+        """Moves records sent by actors to trainer's memory, if `wait` is True at least one is waited for"""
+        collected = 0
+        while True:
+            try:
+                if wait and collected == 0:
+                    record = self._transitions.get(timeout=1)
+                else:
+                    record = self._transitions.get_nowait()
+            except queue.Empty:
+                if not wait or collected > 0:
+                    break
+                if not any(process.is_alive() for process in self._processes):
+                    raise RuntimeError("All actors have stopped")
+                continue
+            self._trainer.remember(record)
+            collected += 1
+        self.received += collected
+        return collected
+
+    def _sync_weights(self):
+        weights = self._trainer.get_active_model().get_weights()
+        for weights_queue in self._weights_queues:
+            _latest(weights_queue)
+            try:
+                weights_queue.put_nowait(weights)
+            except queue.Full:
+                pass
+
+    """Train with records coming from actors
+
+    # Arguments
+        start_step, steps: training steps are numbered from start_step to steps - 1 (like in train_model.py)
+        batch_size, gamma, theta: passed to `DQNTrainer.train`
+        callback: optional function called with step number after each training step, e.g. for saving
+    """
+    def run(self, start_step: int, steps: int, batch_size: int = 32, gamma: float = 0.99, theta: float = 0.,
+            callback=None):
+        if not self._processes:
+            self.start(start_step)
+        try:
+            for step in range(start_step, steps):
+                self._step.value = step
+                self._collect(wait=True)
+                self._trainer.train(batch_size=batch_size, gamma=gamma, theta=theta, step=step)
+                if (step - start_step + 1) % self._sync_every == 0:
+                    self._sync_weights()
+                if callback is not None:
+                    callback(step)
+        finally:
+            self.stop()
@@ -0,0 +1,47 @@
+import multiprocessing
+import queue
+import threading
+import unittest
+
+import keras
+from keras.layers import Dense
+
+from dqn_tools.distributed import _run_actor, actor_epsilon, actor_epsilons
+from models.model_template import ModelTemplate
+
+
+class ActorEpsilonTests(unittest.TestCase):
+    def setUp(self):
+        self.template = ModelTemplate()
+
+    def test_warm_up_explores_fully(self):
+        for step in (0, int(self.template.EPSILON_THRESHOLD) - 1):
+            for spread in (0., 7.):
+                self.assertEqual([actor_epsilon(self.template.get_epsilon, step, actor, 4, spread)
+                                  for actor in range(4)], [1] * 4)
+
+    def test_following_template_after_warm_up(self):
+        step = int(self.template.EPSILON_THRESHOLD) + 1
+        self.assertEqual([actor_epsilon(self.template.get_epsilon, step, actor, 4) for actor in range(4)],
+                         [self.template.EPSILON] * 4)
+        self.assertEqual([actor_epsilon(self.template.get_epsilon, step, actor, 4, 7.) for actor in range(4)],
+                         actor_epsilons(4, self.template.EPSILON, 7.))
+
+    def test_actor_uses_learners_step(self):
+        model = keras.Sequential([Dense(1, input_shape=(384,))])
+        step = multiprocessing.Value("q", 0, lock=False)
+        stop = threading.Event()
+        epsilons = []
+
+        def action(acting_model, memory, board, epsilon):
+            epsilons.append(epsilon)
+            step.value = int(self.template.EPSILON_THRESHOLD) + 1
+            if len(epsilons) == 2:
+                stop.set()
+        _run_actor(model.to_json(), model.get_weights(), action, self.template.get_epsilon, 0, 2, 0., 0, step,
+                   queue.Queue(), queue.Queue(), stop)
+        self.assertEqual(epsilons, [1, self.template.EPSILON])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,210 @@
+import json
+import os
+import sys
+import threading
+import time
+
+import keras
+
+import chess_environment.chessboard as cb
+import chess_environment.encoding as encoding
+import dqn_tools.distributed as distributed
+import dqn_tools.targets as targets
+from dqn_tools.memory import ArrayMemory, PrioritizedMemory, SimpleMemory
+from dqn_tools.trainers import DQNTrainer
+
+
+class Timer:
+    __slots__ = ("calls", "seconds", "items")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.
+        self.items = 0
+
+
+def _first_length(position: int):
+    """Items of a call counted as length of its argument at position (self included for methods)"""
+    return lambda args: len(args[position]) if len(args) > position else 0
+
+
+# timed methods: (class, method name, timer name, items counter or None)
+_METHODS = [
+    (cb.ChessBoard, "get_moves", "get_moves", None),
+    (cb.ChessBoard, "get_moves_batch", "get_moves", None),
+    (keras.Model, "predict", "predict", _first_length(1)),
+    (keras.Model, "train_on_batch", "train_on_batch", _first_length(1)),
+    (DQNTrainer, "update_target", "target_update", None),
+    (DQNTrainer, "save", "save", None),
+    (DQNTrainer, "checkpoint", "save", None),
+    (SimpleMemory, "get_batch", "sampling", None),
+    (ArrayMemory, "get_batch", "sampling", None),
+    (PrioritizedMemory, "get_batch", "sampling", None),
+]
+# timed functions, replaced in every module which has imported them
+_FUNCTIONS = [
+    (encoding, "encode_children", "encoding", _first_length(1)),
+    (targets, "double_dqn_targets", "targets", None),
+    (targets, "opponent_reply_targets", "targets", None),
+]
+# phases of a training step, owners are classes or modules; `PipelinedTrainer` acts with `take_action`
+# and `ParallelTrainer`'s actors with `distributed.act`
+_PHASES = [
+    (DQNTrainer, "take_action", "acting"),
+    (distributed, "act", "acting"),
+    (DQNTrainer, "train", "training"),
+]
+# timers also counted separately in each phase, as "<timer>/<phase>"
+_PER_PHASE = {"predict"}
+
+
+class Instrumentation:
+    """Optional timers and counters of training loop's hot paths
+
+    While enabled, methods and functions listed in `_METHODS`, `_FUNCTIONS` and `_PHASES` are replaced by
+    wrappers summing calls, time and items (e.g. positions encoded, states predicted). Predict calls are also
+    counted per phase (acting or training). Functions are replaced in modules which have imported them
+    by the time of enabling. Disabling puts the originals back, so instrumentation costs
+    nothing unless it is enabled. Timers are updated under a lock, so threads of `PipelinedTrainer`
+    can be timed together. `step` is called after every training step and every `summary_every`
+    steps a JSON line with throughput of the last steps and totals is appended to the log.
+
+    # Arguments
+        log_path: file the summaries are appended to, None prints them
+        summary_every: number of steps between summaries
+
+    Usage:
+        with Instrumentation("tmp/training.jsonl") as instrumentation:
+            for i in range(steps):
+                ...
+                instrumentation.step(i)
+    """
+    def __init__(self, log_path: str = None, summary_every: int = 100):
+        self.log_path = log_path
+        self.summary_every = summary_every
+        self.timers = {}
+        self.steps = 0
+        self._started = None
+        self._last_summary = None
+        self._restore = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disable()
+
+    def enable(self):
+        if self._restore:
+            return
+        self._started = time.perf_counter()
+        self._last_summary = (self._started, 0, self._snapshot())
+        for owner, method_name, timer_name, count in _METHODS:
+            self._replace(owner, method_name, self._timed(vars(owner)[method_name], timer_name, count))
+        for owner, method_name, phase in _PHASES:
+            self._replace(owner, method_name, self._phase(vars(owner)[method_name], phase))
+        for module, function_name, timer_name, count in _FUNCTIONS:
+            original = getattr(module, function_name)
+            wrapper = self._timed(original, timer_name, count)
+            for loaded_module in list(sys.modules.values()):
+                if loaded_module is not None and getattr(loaded_module, function_name, None) is original:
+                    self._replace(loaded_module, function_name, wrapper)
+
+    def disable(self):
+        for owner, name, original in reversed(self._restore):
+            setattr(owner, name, original)
+        self._restore = []
+
+    def _replace(self, owner, name, wrapper):
+        self._restore.append((owner, name, vars(owner)[name]))
+        setattr(owner, name, wrapper)
+
+    def _timer(self, name: str):
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = Timer()
+        return timer
+
+    def _add(self, name: str, seconds: float, items: int):
+        """Adds a call to timer, the caller holds `_lock`"""
+        timer = self._timer(name)
+        timer.calls += 1
+        timer.seconds += seconds
+        timer.items += items
+
+    def _timed(self, function, timer_name: str, count):
+        per_phase = timer_name in _PER_PHASE
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            result = function(*args, **kwargs)
+            seconds = time.perf_counter() - started
+            items = count(args) if count is not None else 0
+            with self._lock:
+                self._add(timer_name, seconds, items)
+                if per_phase:
+                    self._add("{}/{}".format(timer_name, getattr(self._local, "phase", None)), seconds, items)
+            return result
+        timed.__wrapped__ = function
+        return timed
+
+    def _phase(self, function, phase: str):
+        timed = self._timed(function, phase, None)
+
+        def in_phase(*args, **kwargs):
+            outer_phase = getattr(self._local, "phase", None)
+            self._local.phase = phase
+            try:
+                return timed(*args, **kwargs)
+            finally:
+                self._local.phase = outer_phase
+        in_phase.__wrapped__ = function
+        return in_phase
+
+    def _snapshot(self):
+        with self._lock:
+            return {name: (timer.calls, timer.seconds, timer.items) for name, timer in self.timers.items()}
+
+    """Summary of the steps since `since` = (time, steps, timers' snapshot), or since enabling"""
+    def summary(self, since: tuple = None):
+        now = time.perf_counter()
+        since_time, since_steps, since_timers = since if since is not None else (self._started, 0, {})
+        seconds = now - since_time
+        steps = self.steps - since_steps
+        phases = {}
+        for name, (total_calls, total_seconds, total_items) in self._snapshot().items():
+            calls, timer_seconds, items = since_timers.get(name, (0, 0., 0))
+            phases[name] = {"calls": total_calls - calls, "seconds": total_seconds - timer_seconds,
+                            "items": total_items - items}
+        empty = {"calls": 0, "seconds": 0., "items": 0}
+        return {
+            "steps": steps,
+            "seconds": seconds,
+            "steps_per_second": steps / seconds if seconds > 0 else 0.,
+            "positions_encoded_per_second": phases.get("encoding", empty)["items"] / seconds if seconds > 0 else 0.,
+            "predicts_per_step": phases.get("predict", empty)["calls"] / steps if steps > 0 else 0.,
+            "acting_predicts_per_step": phases.get("predict/acting", empty)["calls"] / steps if steps > 0 else 0.,
+            "timers": phases,
+        }
+
+    def step(self, step: int):
+        """Counts finished training step, summary is written every `summary_every` of them"""
+        self.steps += 1
+        if self.steps % self.summary_every == 0:
+            self.write_summary(step)
+
+    def write_summary(self, step: int):
+        line = json.dumps({"step": step, "time": time.time(), "last": self.summary(self._last_summary),
+                           "total": self.summary()})
+        self._last_summary = (time.perf_counter(), self.steps, self._snapshot())
+        if self.log_path is None:
+            print(line)
+        else:
+            directory = os.path.dirname(self.log_path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(self.log_path, "a") as handler:
+                handler.write(line + "\n")
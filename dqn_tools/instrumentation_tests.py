@@ -0,0 +1,55 @@
+import json
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import unittest
+
+import chess_environment.chessboard as cb
+from dqn_tools.distributed import _run_actor
+from dqn_tools.instrumentation import Instrumentation
+from dqn_tools.memory import SimpleMemory
+from dqn_tools.pipeline import PipelinedTrainer
+from dqn_tools.trainers import DQNTrainer
+from models.model_template import ModelTemplate
+
+
+class InstrumentationTests(unittest.TestCase):
+    def setUp(self):
+        self.template = ModelTemplate()
+        self.model = self.template.new_model(0)
+
+    def test_pipelined_acting_phase(self):
+        trainer = DQNTrainer(self.model, SimpleMemory(self.template.MEMORY_SIZE), self.template.action,
+                             self.template.training)
+        pipelined_trainer = PipelinedTrainer(trainer, self.template.prepare_batch, self.template.fit_batch)
+        with Instrumentation(summary_every=1000) as instrumentation:
+            pipelined_trainer.run(cb.ChessBoard(), 0, 1, lambda step: 0., batch_size=self.template.BATCH)
+        self.assertEqual(instrumentation.timers["acting"].calls, 1)
+        self.assertGreater(instrumentation.timers["predict/acting"].calls, 0)
+        self.assertNotIn("predict/None", instrumentation.timers)
+
+    def test_actor_acting_phase(self):
+        step = multiprocessing.Value("q", 0, lock=False)
+        stop = threading.Event()
+        actions = []
+
+        def action(acting_model, memory, board, epsilon):
+            self.template.action(acting_model, memory, board, 0.)
+            actions.append(epsilon)
+            if len(actions) == 2:
+                stop.set()
+        with tempfile.TemporaryDirectory() as directory:
+            log_path = os.path.join(directory, "actor_{}.jsonl")
+            _run_actor(self.model.to_json(), self.model.get_weights(), action, self.template.get_epsilon, 1, 2, 0.,
+                       0, step, queue.Queue(), queue.Queue(), stop, log_path, summary_every=2)
+            with open(log_path.format(1), "r") as handler:
+                summary = json.loads(handler.readline())
+        self.assertEqual(summary["total"]["steps"], 2)
+        self.assertEqual(summary["total"]["timers"]["acting"]["calls"], 2)
+        self.assertGreater(summary["total"]["acting_predicts_per_step"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
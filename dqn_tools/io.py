@@ -1,17 +1,63 @@
+import json
 import os
 import pickle
+from io import BytesIO
+
+import h5py
 import keras
 from keras.engine.saving import load_model
 
+from dqn_tools.columns import has_memory_columns, load_memory_columns, save_memory_columns, \
+    COLUMN_SUFFIXES, MEMORY_TYPES
+from dqn_tools.memory import MemmapMemory
 
-def save(directory: str, name: str, active_model: keras.models.Model, target_model: keras.models.Model, memory=None):
+CHECKPOINT_SUFFIXES = ("_active.h5f", "_target.h5f", "_memory.obj", "_memory.json") + COLUMN_SUFFIXES
+
+
+def _write_atomically(path: str, write):
+    """Calls write with a handler of temporary file which then replaces path, so path is never half written"""
+    temporary_path = path + ".tmp"
+    with open(temporary_path, 'wb') as handler:
+        write(handler)
+    os.replace(temporary_path, path)
+
+
+def model_to_bytes(model: keras.models.Model):
+    """Serializes model into contents of .h5f file without touching disk"""
+    buffer = BytesIO()
+    with h5py.File(buffer, 'w') as h5_file:
+        keras.models.save_model(model, h5_file)
+    return buffer.getvalue()
+
+
+def write_checkpoint(directory: str, name: str, active_model: bytes, target_model: bytes, memory=None):
+    """Writes serialized models and memory, each file is replaced atomically
+
+    # Arguments
+        active_model, target_model: contents of .h5f files given by `model_to_bytes`
+        memory: memory saved as columns (see `save_memory_columns`), pickled if it has other type,
+            or flushed `MemmapMemory` of which only location is written
+    """
     if not os.path.isdir(directory):
-        os.mkdir(directory)
-    active_model.save("{}/{}_active.h5f".format(directory, name))
-    target_model.save("{}/{}_target.h5f".format(directory, name))
-    if memory is not None:
-        with open("{}/{}_memory.obj".format(directory, name), 'wb') as handler:
-            pickle.dump(memory, handler, pickle.HIGHEST_PROTOCOL)
+        os.makedirs(directory)
+    _write_atomically("{}/{}_active.h5f".format(directory, name), lambda handler: handler.write(active_model))
+    _write_atomically("{}/{}_target.h5f".format(directory, name), lambda handler: handler.write(target_model))
+    if isinstance(memory, MemmapMemory):
+        # memory already is on disk, only its location is saved with the models
+        reference = {"directory": memory.directory, "name": memory.name}
+        _write_atomically("{}/{}_memory.json".format(directory, name),
+                          lambda handler: handler.write(json.dumps(reference).encode()))
+    elif type(memory).__name__ in MEMORY_TYPES:
+        save_memory_columns(directory, name, memory)
+    elif memory is not None:
+        _write_atomically("{}/{}_memory.obj".format(directory, name),
+                          lambda handler: pickle.dump(memory, handler, pickle.HIGHEST_PROTOCOL))
+
+
+def save(directory: str, name: str, active_model: keras.models.Model, target_model: keras.models.Model, memory=None):
+    if isinstance(memory, MemmapMemory):
+        memory.flush()
+    write_checkpoint(directory, name, model_to_bytes(active_model), model_to_bytes(target_model), memory)
 
 
 def load(directory: str, name: str, has_memory: bool=False):
@@ -19,6 +65,14 @@ def load(directory: str, name: str, has_memory: bool=False):
     target_model = load_model("{}/{}_target.h5f".format(directory, name))
     memory = None
     if has_memory:
-        with open("{}/{}_memory.obj".format(directory, name), 'rb') as handler:
-            memory = pickle.load(handler)
+        reference_path = "{}/{}_memory.json".format(directory, name)
+        if os.path.isfile(reference_path):
+            with open(reference_path, 'r') as handler:
+                reference = json.load(handler)
+            memory = MemmapMemory.open(reference["directory"], reference["name"])
+        elif has_memory_columns(directory, name):
+            memory = load_memory_columns(directory, name)
+        else:
+            with open("{}/{}_memory.obj".format(directory, name), 'rb') as handler:
+                memory = pickle.load(handler)
     return active_model, target_model, memory
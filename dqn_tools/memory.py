@@ -1,6 +1,14 @@
 import collections
+import copy
+import json
+import os
 import random
 
+import numpy as np
+
+from chess_environment.encoding import STATE_SIZE
+from training_tools import PackedChessRecord
+
 
 class MemoryRecord:
     def __init__(self):
@@ -12,6 +20,13 @@ class SimpleMemory:
         self._max_len = size
         self._deque = collections.deque()
 
+    def __len__(self):
+        return len(self._deque)
+
+    @property
+    def size(self):
+        return self._max_len
+
     def add(self, record):
         current_size = len(self._deque)
         if current_size >= self._max_len:
@@ -25,3 +40,362 @@ class SimpleMemory:
             return None
         batch = random.sample(self._deque, batch_size)
         return batch
+
+    def snapshot(self):
+        """Copy not affected by later `add` calls, records are shared as they are not changed once added"""
+        memory = SimpleMemory(self._max_len)
+        memory._deque = collections.deque(self._deque)
+        return memory
+
+    def iter_columns(self, chunk_size: int):
+        """Yields states, rewards and FENs of records, oldest first, in chunks of at most chunk_size"""
+        records = list(self._deque)
+        for start in range(0, len(records), chunk_size):
+            chunk = records[start:start + chunk_size]
+            if all(isinstance(record, PackedChessRecord) for record in chunk):
+                yield PackedChessRecord.gather(chunk)
+                continue
+            yield (np.array([np.reshape(record.state, STATE_SIZE) for record in chunk], dtype=np.int8),
+                   np.array([np.reshape(record.reward, -1)[0] for record in chunk], dtype=np.float32),
+                   [record.fen for record in chunk])
+
+    def extend(self, states: np.ndarray, rewards: np.ndarray, fens: list):
+        """Adds records given as columns, oldest first"""
+        for state, reward, fen in zip(states, rewards, fens):
+            self.add(PackedChessRecord(state, reward, fen))
+
+
+class MemoryBatch:
+    """Sampled records gathered into arrays
+
+    # Attributes
+        states: (batch size, 384) array
+        rewards: (batch size,) float32 array
+        fens: list of FENs
+        successors: list of records' stored successors (or Nones)
+        indices: positions of the records in memory, if it keeps them in arrays
+        weights: importance-sampling weights of the records if they were not sampled uniformly
+    """
+    def __init__(self, states: np.ndarray, rewards: np.ndarray, fens: list, successors: list,
+                 indices=None, weights=None):
+        self.states = states
+        self.rewards = rewards
+        self.fens = fens
+        self.successors = successors
+        self.indices = indices
+        self.weights = weights
+
+    def __len__(self):
+        return len(self.fens)
+
+    @staticmethod
+    def from_records(records: list):
+        if len(records) > 0 and all(isinstance(record, PackedChessRecord) for record in records):
+            # packed records are expanded together
+            states, rewards, fens = PackedChessRecord.gather(records)
+            return MemoryBatch(states, rewards, fens, [record.successors for record in records])
+        return MemoryBatch(
+            states=np.array([record.state for record in records]),
+            rewards=np.array([np.reshape(record.reward, -1)[0] for record in records], dtype=np.float32),
+            fens=[record.fen for record in records],
+            successors=[getattr(record, "successors", None) for record in records])
+
+
+def as_memory_batch(batch):
+    """Gets `MemoryBatch` from result of any memory's `get_batch`"""
+    if batch is None or isinstance(batch, MemoryBatch):
+        return batch
+    return MemoryBatch.from_records(batch)
+
+
+class ArrayMemory:
+    """Replay memory holding records in preallocated arrays used as ring buffer
+
+    States are kept in (size, 384) int8 matrix, rewards in float32 vector and FENs in fixed width
+    byte strings, so sampling is a fancy indexing of them returning `MemoryBatch`.
+    """
+    FEN_WIDTH = 92
+
+    def __init__(self, size: int):
+        self._max_len = size
+        self._states = np.zeros((size, STATE_SIZE), dtype=np.int8)
+        self._rewards = np.zeros(size, dtype=np.float32)
+        self._fens = np.zeros(size, dtype="S{}".format(self.FEN_WIDTH))
+        self._successors = np.full(size, None, dtype=object)
+        self._next = 0
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def size(self):
+        return self._max_len
+
+    def add(self, record):
+        index = self._next
+        self._states[index] = np.reshape(record.state, STATE_SIZE)
+        self._rewards[index] = np.reshape(record.reward, -1)[0]
+        self._fens[index] = record.fen.encode()
+        self._successors[index] = getattr(record, "successors", None)
+        self._next = (index + 1) % self._max_len
+        self._length = min(self._length + 1, self._max_len)
+
+    """Adds records given as columns, oldest first, with one write per column
+
+    # Returns
+        indices the records were written at
+    """
+    def extend(self, states: np.ndarray, rewards: np.ndarray, fens: list):
+        number = len(fens)
+        if number > self._max_len:
+            # only the newest ones would stay anyway
+            states, rewards, fens = states[-self._max_len:], rewards[-self._max_len:], fens[-self._max_len:]
+            number = self._max_len
+        indices = (self._next + np.arange(number)) % self._max_len
+        self._states[indices] = np.reshape(states, (number, STATE_SIZE))
+        self._rewards[indices] = np.reshape(rewards, number)
+        self._fens[indices] = [fen.encode() for fen in fens]
+        if self._successors is not None:
+            self._successors[indices] = None
+        self._next = (self._next + number) % self._max_len
+        self._length = min(self._length + number, self._max_len)
+        return indices
+
+    def get_batch(self, batch_size: int, min_rows: int = None):
+        if min_rows is None:
+            min_rows = self._length / 3
+        if self._length < min_rows:
+            return None
+        indices = np.array(random.sample(range(self._length), batch_size), dtype=np.int64)
+        return self._gather(indices)
+
+    def iter_columns(self, chunk_size: int):
+        """Yields states, rewards and FENs of records, oldest first, in chunks of at most chunk_size"""
+        first = self._next if self._length == self._max_len else 0
+        order = (first + np.arange(self._length)) % self._max_len
+        for start in range(0, self._length, chunk_size):
+            indices = order[start:start + chunk_size]
+            yield (np.array(self._states[indices]), np.array(self._rewards[indices]),
+                   [fen.decode() for fen in self._fens[indices]])
+
+    def _gather(self, indices: np.ndarray):
+        return MemoryBatch(
+            states=self._states[indices],
+            rewards=self._rewards[indices],
+            fens=[fen.decode() for fen in self._fens[indices]],
+            successors=list(self._successors[indices]),
+            indices=indices)
+
+    def snapshot(self):
+        """Copy not affected by later `add` calls, stored successors are shared as they are not changed"""
+        memory = copy.copy(self)
+        for key, value in vars(self).items():
+            if isinstance(value, np.ndarray):
+                setattr(memory, key, value.copy())
+        return memory
+
+
+class SumTree:
+    """Binary tree with priorities in leaves and sums of their subtrees in inner nodes
+
+    Nodes are kept in one array (root at 1, children of i at 2i and 2i + 1), so updates and
+    searches of many leaves at once go level by level with vectorized operations, O(log n) each.
+    """
+    def __init__(self, size: int):
+        self._leaves = 1
+        while self._leaves < size:
+            self._leaves *= 2
+        self._tree = np.zeros(2 * self._leaves, dtype=np.float64)
+
+    def total(self):
+        return self._tree[1]
+
+    def copy(self):
+        tree = copy.copy(self)
+        tree._tree = self._tree.copy()
+        return tree
+
+    def get(self, indices: np.ndarray):
+        return self._tree[np.asarray(indices) + self._leaves]
+
+    def update(self, indices: np.ndarray, priorities: np.ndarray):
+        nodes = np.asarray(indices) + self._leaves
+        self._tree[nodes] = priorities
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self._tree[nodes] = self._tree[2 * nodes] + self._tree[2 * nodes + 1]
+            nodes = np.unique(nodes // 2)
+
+    def rebuild(self, priorities: np.ndarray):
+        self._tree[:] = 0
+        self._tree[self._leaves:self._leaves + len(priorities)] = priorities
+        level = self._leaves
+        while level > 1:
+            level //= 2
+            self._tree[level:2 * level] = self._tree[2 * level:4 * level:2] + self._tree[2 * level + 1:4 * level:2]
+
+    def find(self, values: np.ndarray):
+        """Finds leaves at which cumulative sum of priorities reaches values"""
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        while nodes[0] < self._leaves:
+            left = self._tree[2 * nodes]
+            go_right = values >= left
+            values -= np.where(go_right, left, 0.)
+            nodes = 2 * nodes + go_right
+        return nodes - self._leaves
+
+
+class PrioritizedMemory(ArrayMemory):
+    """`ArrayMemory` sampling records proportionally to their priorities
+
+    Priority of a record is (|TD error| + epsilon) ** alpha, new records get the highest priority seen so far.
+    Sampled batches carry importance-sampling weights (N * P(i)) ** -beta normalized by their maximum.
+    Alpha and beta are annealed linearly to `alpha_end` and `beta_end` over `anneal_steps` training steps
+    by calling `anneal` with current step (`DQNTrainer.train` does it when given the step).
+    """
+    def __init__(self, size: int, alpha: float = 0.6, beta: float = 0.4, alpha_end: float = None,
+                 beta_end: float = 1., anneal_steps: int = 100000, start_step: int = 0, epsilon: float = 1e-3):
+        super().__init__(size)
+        self._tree = SumTree(size)
+        self._errors = np.zeros(size, dtype=np.float64)
+        self._max_error = 1.
+        self._epsilon = epsilon
+        self._alpha_start = alpha
+        self._alpha_end = alpha if alpha_end is None else alpha_end
+        self._beta_start = beta
+        self._beta_end = beta_end
+        self._anneal_steps = anneal_steps
+        self._start_step = start_step
+        self.alpha = alpha
+        self.beta = beta
+
+    def add(self, record):
+        index = self._next
+        super().add(record)
+        self._errors[index] = self._max_error
+        self._tree.update([index], [self._max_error ** self.alpha])
+
+    def get_batch(self, batch_size: int, min_rows: int = None):
+        if min_rows is None:
+            min_rows = self._length / 3
+        if self._length < min_rows:
+            return None
+        total = self._tree.total()
+        # one value from each of batch_size equal parts of the priorities' sum
+        values = (np.arange(batch_size) + np.random.uniform(size=batch_size)) * total / batch_size
+        indices = np.minimum(self._tree.find(values), self._length - 1)
+        probabilities = self._tree.get(indices) / total
+        weights = (self._length * probabilities) ** -self.beta
+        batch = self._gather(indices)
+        batch.weights = (weights / weights.max()).astype(np.float32)
+        return batch
+
+    def extend(self, states: np.ndarray, rewards: np.ndarray, fens: list):
+        indices = super().extend(states, rewards, fens)
+        if len(indices) > 0:
+            self._errors[indices] = self._max_error
+            self._tree.update(indices, np.full(len(indices), self._max_error ** self.alpha))
+        return indices
+
+    def update_priorities(self, indices: np.ndarray, td_errors: np.ndarray):
+        errors = np.abs(np.reshape(td_errors, -1)) + self._epsilon
+        self._errors[indices] = errors
+        self._max_error = max(self._max_error, errors.max())
+        self._tree.update(indices, errors ** self.alpha)
+
+    def get_config(self):
+        """Arguments of the constructor besides size, `PrioritizedMemory(size, **config)` samples like this one"""
+        return {"alpha": self._alpha_start, "beta": self._beta_start, "alpha_end": self._alpha_end,
+                "beta_end": self._beta_end, "anneal_steps": self._anneal_steps, "start_step": self._start_step,
+                "epsilon": self._epsilon}
+
+    def anneal(self, step: int):
+        progress = min(max(step - self._start_step, 0) / self._anneal_steps, 1.)
+        self.beta = self._beta_start + (self._beta_end - self._beta_start) * progress
+        alpha = self._alpha_start + (self._alpha_end - self._alpha_start) * progress
+        # changing alpha changes every priority, so the tree is rebuilt only when it has moved noticeably
+        if abs(alpha - self.alpha) >= 0.01:
+            self.alpha = alpha
+            self._tree.rebuild(self._errors[:self._length] ** alpha)
+
+    def snapshot(self):
+        memory = super().snapshot()
+        memory._tree = self._tree.copy()
+        return memory
+
+
+class MemmapMemory(ArrayMemory):
+    """`ArrayMemory` whose arrays live in .npy files mapped into memory
+
+    States, rewards and FENs are written straight to `<directory>/<name>_states.npy`, `_rewards.npy`
+    and `_fens.npy`, and sampled batches are read from the page cache, so the memory can be much bigger
+    than RAM. Its position is kept in `<name>_meta.json` by `flush`, after which the memory can be reopened
+    instantly with `MemmapMemory.open`. Stored successors are not kept.
+    """
+    def __init__(self, size: int, directory: str, name: str):
+        self.directory = directory
+        self.name = name
+        self._max_len = size
+        self._next = 0
+        self._length = 0
+        mode = "w+"
+        if os.path.isfile(self._meta_path()):
+            with open(self._meta_path(), "r") as handler:
+                meta = json.load(handler)
+            if meta["size"] != size:
+                raise ValueError("Memory in {} has size {}, not {}".format(directory, meta["size"], size))
+            self._next = meta["next"]
+            self._length = meta["length"]
+            mode = "r+"
+        elif not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._states = self._open_array("states", mode, np.int8, (size, STATE_SIZE))
+        self._rewards = self._open_array("rewards", mode, np.float32, (size,))
+        self._fens = self._open_array("fens", mode, "S{}".format(self.FEN_WIDTH), (size,))
+        self._successors = None
+
+    @staticmethod
+    def open(directory: str, name: str):
+        with open("{}/{}_meta.json".format(directory, name), "r") as handler:
+            meta = json.load(handler)
+        return MemmapMemory(meta["size"], directory, name)
+
+    def _meta_path(self):
+        return "{}/{}_meta.json".format(self.directory, self.name)
+
+    def _open_array(self, column: str, mode: str, dtype, shape: tuple):
+        path = "{}/{}_{}.npy".format(self.directory, self.name, column)
+        return np.lib.format.open_memmap(path, mode=mode, dtype=dtype, shape=shape if mode == "w+" else None)
+
+    def add(self, record):
+        index = self._next
+        self._states[index] = np.reshape(record.state, STATE_SIZE)
+        self._rewards[index] = np.reshape(record.reward, -1)[0]
+        self._fens[index] = record.fen.encode()
+        self._next = (index + 1) % self._max_len
+        self._length = min(self._length + 1, self._max_len)
+
+    def _gather(self, indices: np.ndarray):
+        indices = np.sort(indices)
+        return MemoryBatch(
+            states=np.array(self._states[indices]),
+            rewards=np.array(self._rewards[indices]),
+            fens=[fen.decode() for fen in self._fens[indices]],
+            successors=[None] * len(indices),
+            indices=indices)
+
+    def snapshot(self):
+        """Memory stays in its files, so they are flushed and the memory itself is returned"""
+        self.flush()
+        return self
+
+    def flush(self):
+        """Writes arrays and position of the memory to disk"""
+        for array in (self._states, self._rewards, self._fens):
+            array.flush()
+        temporary_path = self._meta_path() + ".tmp"
+        with open(temporary_path, "w") as handler:
+            json.dump({"size": self._max_len, "next": self._next, "length": self._length}, handler)
+        os.replace(temporary_path, self._meta_path())
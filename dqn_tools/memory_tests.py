@@ -0,0 +1,271 @@
+import pickle
+import random
+import shutil
+import tempfile
+import unittest
+
+import chess
+import numpy as np
+
+import chess_environment.chessboard as cb
+from dqn_tools.cache import EvaluationCache
+from dqn_tools.columns import convert_pickled_memory, load_memory_columns, save_memory_columns
+from dqn_tools.memory import ArrayMemory, MemmapMemory, MemoryBatch, PrioritizedMemory, SimpleMemory, SumTree, \
+    as_memory_batch
+from training_tools import DQNChessRecord, PackedChessRecord
+
+
+def make_records(number: int):
+    board = cb.ChessBoard(chess.STARTING_FEN)
+    records = []
+    for i in range(number):
+        flip = not board.current_turn()
+        moves, states, fens = board.get_moves(flip=flip)
+        board.make_move(moves[i % len(moves)], flip)
+        record = DQNChessRecord()
+        record.state = np.array(states[i % len(moves)]).reshape((384,))
+        record.fen = fens[i % len(moves)]
+        record.reward = np.array([[board.get_results() + i]])
+        records.append(record)
+    return records
+
+
+class ArrayMemoryTests(unittest.TestCase):
+    def setUp(self):
+        random.seed(1)
+        self.records = make_records(10)
+
+    def test_not_enough_rows(self):
+        memory = ArrayMemory(8)
+        for record in self.records[:3]:
+            memory.add(record)
+        self.assertIsNone(memory.get_batch(2, min_rows=4))
+
+    def test_ring_overwrites_oldest(self):
+        memory = ArrayMemory(4)
+        for record in self.records:
+            memory.add(record)
+        self.assertEqual(len(memory), 4)
+        batch = memory.get_batch(4, min_rows=4)
+        self.assertSetEqual(set(batch.fens), set(record.fen for record in self.records[-4:]))
+
+    def test_snapshot_is_not_changed_by_adding(self):
+        memory = ArrayMemory(4)
+        for record in self.records[:4]:
+            memory.add(record)
+        snapshot = memory.snapshot()
+        for record in self.records[4:]:
+            memory.add(record)
+        batch = snapshot.get_batch(4, min_rows=4)
+        self.assertSetEqual(set(batch.fens), set(record.fen for record in self.records[:4]))
+
+    def test_batch_matches_records(self):
+        memory = ArrayMemory(16)
+        for record in self.records:
+            memory.add(record)
+        batch = memory.get_batch(5, min_rows=1)
+        self.assertIsInstance(batch, MemoryBatch)
+        self.assertEqual(batch.states.shape, (5, 384))
+        self.assertEqual(batch.states.dtype, np.int8)
+        self.assertEqual(batch.rewards.dtype, np.float32)
+        records_by_fen = {record.fen: record for record in self.records}
+        for state, reward, fen in zip(batch.states, batch.rewards, batch.fens):
+            record = records_by_fen[fen]
+            self.assertListEqual(state.tolist(), record.state.tolist())
+            self.assertEqual(reward, record.reward[0, 0])
+
+    def test_simple_memory_batch_conversion(self):
+        memory = SimpleMemory(16)
+        for record in self.records:
+            memory.add(record)
+        batch = as_memory_batch(memory.get_batch(3, min_rows=1))
+        self.assertEqual(batch.states.shape, (3, 384))
+        self.assertEqual(len(batch.successors), 3)
+
+    def test_packed_records(self):
+        memory = SimpleMemory(16)
+        for record in self.records:
+            packed_record = PackedChessRecord(record.state, record.reward, record.fen)
+            self.assertListEqual(packed_record.state.tolist(), record.state.tolist())
+            self.assertEqual(packed_record.fen, record.fen)
+            memory.add(packed_record)
+        batch = as_memory_batch(memory.get_batch(10, min_rows=10))
+        records_by_fen = {record.fen: record for record in self.records}
+        self.assertEqual(batch.states.shape, (10, 384))
+        for state, reward, fen in zip(batch.states, batch.rewards, batch.fens):
+            self.assertListEqual(state.tolist(), records_by_fen[fen].state.tolist())
+            self.assertEqual(reward, records_by_fen[fen].reward[0, 0])
+
+
+class PrioritizedMemoryTests(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(1)
+        self.records = make_records(10)
+
+    def test_sum_tree(self):
+        tree = SumTree(5)
+        tree.update(np.arange(5), np.array([1., 2., 3., 4., 0.]))
+        self.assertEqual(tree.total(), 10.)
+        self.assertListEqual(tree.find(np.array([0., 0.5, 1., 2.9, 3., 9.9])).tolist(), [0, 0, 1, 1, 2, 3])
+        tree.update(np.array([1, 3]), np.array([0., 1.]))
+        self.assertEqual(tree.total(), 5.)
+        rebuilt = SumTree(5)
+        rebuilt.rebuild(np.array([1., 0., 3., 1., 0.]))
+        self.assertListEqual(rebuilt._tree.tolist(), tree._tree.tolist())
+
+    def test_sampling_follows_priorities(self):
+        memory = PrioritizedMemory(16, alpha=1.)
+        for record in self.records[:4]:
+            memory.add(record)
+        memory.update_priorities(np.arange(4), np.array([0., 0., 0., 10.]))
+        batch = memory.get_batch(8, min_rows=1)
+        self.assertTrue(all(fen == self.records[3].fen for fen in batch.fens))
+        self.assertEqual(batch.weights.shape, (8,))
+        self.assertAlmostEqual(float(batch.weights.max()), 1.)
+
+    def test_new_records_get_highest_priority(self):
+        memory = PrioritizedMemory(16)
+        memory.add(self.records[0])
+        memory.update_priorities(np.array([0]), np.array([5.]))
+        memory.add(self.records[1])
+        self.assertAlmostEqual(memory._tree.get([1])[0], memory._tree.get([0])[0])
+
+    def test_snapshot_keeps_priorities(self):
+        memory = PrioritizedMemory(16)
+        for record in self.records[:4]:
+            memory.add(record)
+        snapshot = memory.snapshot()
+        memory.update_priorities(np.arange(4), np.array([1., 2., 3., 4.]))
+        self.assertAlmostEqual(snapshot._tree.total(), 4.)
+
+    def test_annealing(self):
+        memory = PrioritizedMemory(16, alpha=0.6, alpha_end=0.2, beta=0.4, anneal_steps=100, start_step=100)
+        for record in self.records[:4]:
+            memory.add(record)
+        memory.update_priorities(np.arange(4), np.array([1., 2., 3., 4.]))
+        memory.anneal(150)
+        self.assertAlmostEqual(memory.beta, 0.7)
+        self.assertAlmostEqual(memory.alpha, 0.4)
+        self.assertAlmostEqual(memory._tree.total(), float(np.sum((np.arange(1, 5) + 1e-3) ** 0.4)))
+        memory.anneal(1000)
+        self.assertAlmostEqual(memory.beta, 1.)
+
+
+class MemmapMemoryTests(unittest.TestCase):
+    def setUp(self):
+        random.seed(1)
+        self.records = make_records(10)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_reopening(self):
+        memory = MemmapMemory(8, self.directory, "replay")
+        for record in self.records:
+            memory.add(record)
+        memory.flush()
+        del memory
+
+        memory = MemmapMemory.open(self.directory, "replay")
+        self.assertEqual(len(memory), 8)
+        batch = memory.get_batch(8, min_rows=8)
+        self.assertSetEqual(set(batch.fens), set(record.fen for record in self.records[-8:]))
+        records_by_fen = {record.fen: record for record in self.records}
+        for state, fen in zip(batch.states, batch.fens):
+            self.assertListEqual(state.tolist(), records_by_fen[fen].state.tolist())
+
+        memory.add(self.records[0])
+        self.assertEqual(memory._next, 3)
+
+    def test_size_mismatch(self):
+        MemmapMemory(8, self.directory, "replay").flush()
+        with self.assertRaises(ValueError):
+            MemmapMemory(16, self.directory, "replay")
+
+
+class MemoryColumnsTests(unittest.TestCase):
+    def setUp(self):
+        self.records = make_records(10)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertSameColumns(self, memory, loaded):
+        self.assertIs(type(loaded), type(memory))
+        self.assertEqual(loaded.size, memory.size)
+        for (states, rewards, fens), (loaded_states, loaded_rewards, loaded_fens) in zip(
+                memory.iter_columns(4), loaded.iter_columns(4)):
+            self.assertListEqual(loaded_states.tolist(), states.tolist())
+            self.assertListEqual(loaded_rewards.tolist(), rewards.tolist())
+            self.assertListEqual(loaded_fens, fens)
+
+    def test_saving_and_loading_in_chunks(self):
+        for memory in (ArrayMemory(8), PrioritizedMemory(8), SimpleMemory(8)):
+            for record in self.records:
+                memory.add(record)
+            save_memory_columns(self.directory, "replay", memory, chunk_size=3)
+            self.assertSameColumns(memory, load_memory_columns(self.directory, "replay", chunk_size=5))
+
+    def test_prioritized_memory_configuration(self):
+        memory = PrioritizedMemory(8, alpha=0.7, beta=0.5, alpha_end=0.3, beta_end=0.9, anneal_steps=100,
+                                   start_step=10, epsilon=1e-2)
+        for record in self.records:
+            memory.add(record)
+        memory.anneal(60)
+        save_memory_columns(self.directory, "replay", memory)
+        loaded = load_memory_columns(self.directory, "replay")
+        self.assertSameColumns(memory, loaded)
+        self.assertDictEqual(loaded.get_config(), memory.get_config())
+        self.assertAlmostEqual(loaded.alpha, 0.5)
+        self.assertAlmostEqual(loaded.beta, 0.7)
+        self.assertAlmostEqual(loaded._tree.total(), 8.)
+        for annealed in (memory, loaded):
+            annealed.anneal(110)
+        self.assertAlmostEqual(loaded.alpha, memory.alpha)
+        self.assertAlmostEqual(loaded.beta, memory.beta)
+
+    def test_converting_pickle(self):
+        memory = SimpleMemory(16)
+        for record in self.records:
+            memory.add(record)
+        with open("{}/replay_memory.obj".format(self.directory), "wb") as handler:
+            pickle.dump(memory, handler, pickle.HIGHEST_PROTOCOL)
+        convert_pickled_memory(self.directory, "replay", remove=True)
+        self.assertSameColumns(memory, load_memory_columns(self.directory, "replay"))
+
+
+class EvaluationCacheTests(unittest.TestCase):
+    def test_evaluating_missing_values(self):
+        cache = EvaluationCache(max_size=10)
+        evaluated = []
+
+        def evaluate(keys):
+            def evaluate_missing(missing):
+                evaluated.append(keys[missing].tolist())
+                return keys[missing].astype(np.float32) * 10
+            return cache.evaluate(keys, evaluate_missing).tolist()
+        self.assertListEqual(evaluate(np.array([1, 2, 3], dtype=np.uint64)), [10., 20., 30.])
+        self.assertListEqual(evaluate(np.array([3, 4], dtype=np.uint64)), [30., 40.])
+        self.assertListEqual(evaluated, [[1, 2, 3], [4]])
+        self.assertEqual((cache.hits, cache.misses), (1, 4))
+
+    def test_invalidating_and_evicting(self):
+        cache = EvaluationCache(max_size=2)
+        cache.store(np.array([1, 2], dtype=np.uint64), np.array([1., 2.]))
+        cache.lookup(np.array([1], dtype=np.uint64))
+        cache.store(np.array([3], dtype=np.uint64), np.array([3.]))
+        _, missing = cache.lookup(np.array([1, 2, 3], dtype=np.uint64))
+        self.assertListEqual(missing.tolist(), [False, True, False])
+        self.assertEqual(cache.evictions, 1)
+        cache.invalidate()
+        _, missing = cache.lookup(np.array([1, 3], dtype=np.uint64))
+        self.assertListEqual(missing.tolist(), [True, True])
+        self.assertEqual(cache.stale, 2)
+        cache.store(np.array([1], dtype=np.uint64), np.array([5.]), version=cache.version - 1)
+        self.assertTrue(cache.lookup(np.array([1], dtype=np.uint64))[1][0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,200 @@
+import json
+
+import numpy as np
+
+ACTIVATIONS = {
+    "linear": lambda x, alpha: x,
+    "relu": lambda x, alpha: np.maximum(x, 0),
+    # maximum is several times faster than where and the same for slopes up to 1
+    "leaky_relu": lambda x, alpha: np.maximum(x, alpha * x) if 0 <= alpha <= 1 else np.where(x > 0, x, alpha * x),
+    "tanh": lambda x, alpha: np.tanh(x),
+    "sigmoid": lambda x, alpha: 1 / (1 + np.exp(-x)),
+}
+# layers which do nothing at inference time
+_IGNORED_LAYERS = {"InputLayer", "Dropout"}
+
+
+def _decode(value):
+    return value.decode("utf8") if isinstance(value, bytes) else value
+
+
+class NumpyModel:
+    """Stack of Dense layers and activations evaluated with NumPy, a stand-in for `keras.Model` at inference
+
+    It has `predict` like Keras model, so it can be given to `DQNChessEngine`, while loading it needs neither
+    Keras nor TensorFlow: weights come from NumPy's .npz written by `save`, or straight from Keras .h5/.h5f
+    file with h5py (see `from_h5` and `export_model`).
+
+    # Arguments
+        layers: list of ("dense", kernel, bias or None), ("activation", name, alpha) or ("flatten",)
+        input_shape: shape of a single input, e.g. (384,) or (1, 384)
+    """
+    def __init__(self, layers: list, input_shape: tuple):
+        self.layers = layers
+        self.input_shape = (None,) + tuple(input_shape)
+        for layer in layers:
+            if layer[0] == "activation" and layer[1] not in ACTIVATIONS:
+                raise ValueError("Unsupported activation {}".format(layer[1]))
+
+    """Values of states, same as `keras.Model.predict` within float32 rounding
+
+    # Arguments
+        states: array of shape (number of states,) + input shape
+        batch_size: ignored, all states are evaluated at once
+    """
+    def predict(self, states, batch_size: int = None):
+        x = np.asarray(states, dtype=np.float32)
+        for layer in self.layers:
+            if layer[0] == "dense":
+                x = np.dot(x, layer[1])
+                if layer[2] is not None:
+                    x += layer[2]
+            elif layer[0] == "activation":
+                x = ACTIVATIONS[layer[1]](x, layer[2])
+            else:
+                x = x.reshape((len(x), -1))
+        return x
+
+    def save(self, path: str):
+        """Writes model into .npz file readable by `load`"""
+        spec = {"input_shape": list(self.input_shape[1:]), "layers": []}
+        arrays = {}
+        for i, layer in enumerate(self.layers):
+            if layer[0] == "dense":
+                arrays["kernel_{}".format(i)] = layer[1]
+                if layer[2] is not None:
+                    arrays["bias_{}".format(i)] = layer[2]
+                spec["layers"].append({"type": "dense", "bias": layer[2] is not None})
+            elif layer[0] == "activation":
+                spec["layers"].append({"type": "activation", "name": layer[1], "alpha": layer[2]})
+            else:
+                spec["layers"].append({"type": "flatten"})
+        np.savez(path, spec=np.array(json.dumps(spec)), **arrays)
+
+    @staticmethod
+    def load(path: str):
+        with np.load(path) as arrays:
+            spec = json.loads(str(arrays["spec"]))
+            layers = []
+            for i, layer in enumerate(spec["layers"]):
+                if layer["type"] == "dense":
+                    bias = arrays["bias_{}".format(i)] if layer["bias"] else None
+                    layers.append(("dense", arrays["kernel_{}".format(i)], bias))
+                elif layer["type"] == "activation":
+                    layers.append(("activation", layer["name"], layer["alpha"]))
+                else:
+                    layers.append(("flatten",))
+        return NumpyModel(layers, spec["input_shape"])
+
+    """Reads architecture and weights of Keras model saved by `model.save` (e.g. final/*.h5f) with h5py
+
+    Supported layers are Dense, LeakyReLU, ReLU, Activation, Flatten, Dropout and InputLayer.
+    """
+    @staticmethod
+    def from_h5(path: str):
+        import h5py
+
+        with h5py.File(path, "r") as h5_file:
+            if "model_config" not in h5_file.attrs:
+                raise ValueError("{} has no model configuration, it has to be saved with model.save".format(path))
+            config = json.loads(_decode(h5_file.attrs["model_config"]))["config"]
+            layer_configs = config["layers"] if isinstance(config, dict) else config
+            weights = h5_file["model_weights"] if "model_weights" in h5_file else h5_file
+            layers = []
+            input_shape = None
+            for layer_config in layer_configs:
+                class_name = layer_config["class_name"]
+                layer = layer_config["config"]
+                if input_shape is None and "batch_input_shape" in layer:
+                    input_shape = layer["batch_input_shape"][1:]
+                if class_name == "Dense":
+                    group = weights[layer["name"]]
+                    values = [np.array(group[_decode(name)], dtype=np.float32) for name in group.attrs["weight_names"]]
+                    layers.append(("dense", values[0], values[1] if layer.get("use_bias", True) else None))
+                    layers.append(("activation", layer.get("activation", "linear"), 0.))
+                elif class_name == "LeakyReLU":
+                    layers.append(("activation", "leaky_relu", float(layer["alpha"])))
+                elif class_name == "ReLU" and not layer.get("max_value") and not layer.get("threshold"):
+                    layers.append(("activation", "leaky_relu", float(layer.get("negative_slope", 0.))))
+                elif class_name == "Activation":
+                    layers.append(("activation", layer["activation"], 0.))
+                elif class_name == "Flatten":
+                    layers.append(("flatten",))
+                elif class_name not in _IGNORED_LAYERS:
+                    raise ValueError("Layer {} of {} is not supported".format(class_name, path))
+        if input_shape is None:
+            raise ValueError("Input shape of {} is unknown".format(path))
+        return NumpyModel([layer for layer in layers if layer[:2] != ("activation", "linear")], input_shape)
+
+
+class AccumulatorModel:
+    """Evaluates children of a position by updating first layer's pre-activation, as NNUE does
+
+    Encoding has at most 32 non-zero elements of 384 and a move changes at most 4 of them, so instead of
+    multiplying every child's encoding by the first kernel, the parent's pre-activation (accumulator) is
+    computed from its non-zero elements once and each child adds the kernel rows of elements its move changes
+    (`encode_deltas`). Only the layers above the first one are evaluated for every child.
+
+    # Arguments
+        model: `NumpyModel` whose first layer is dense and takes the 384 element encoding
+    """
+    def __init__(self, model: NumpyModel):
+        if not AccumulatorModel.supports(model):
+            raise ValueError("First layer of the model has to be dense over the encoding")
+        kernel = model.layers[0][1]
+        bias = model.layers[0][2]
+        # row of zeros picked by padding indices of `encode_deltas`
+        self._kernel = np.vstack([kernel, np.zeros((1, kernel.shape[1]), dtype=kernel.dtype)])
+        self._bias = bias if bias is not None else np.zeros(kernel.shape[1], dtype=kernel.dtype)
+        self._upper = NumpyModel(model.layers[1:], (kernel.shape[1],))
+
+    @staticmethod
+    def supports(model):
+        return isinstance(model, NumpyModel) and len(model.layers) > 0 and model.layers[0][0] == "dense" \
+            and model.layers[0][1].shape[0] == model.input_shape[-1]
+
+    def accumulate(self, state: np.ndarray):
+        """First layer's pre-activation for 384 element encoding of a position"""
+        fields = np.flatnonzero(state)
+        return self._bias + np.dot(np.asarray(state[fields], dtype=self._kernel.dtype), self._kernel[fields])
+
+    """Accumulators after moves
+
+    # Arguments
+        accumulator: pre-activation of the position the moves are made from
+        indices: (number of moves, 4) indices of changed elements, as `encode_deltas` returns them
+        changes: values added at indices
+
+    # Returns
+        array of shape (number of moves, first layer's units)
+    """
+    def update(self, accumulator: np.ndarray, indices: np.ndarray, changes: np.ndarray):
+        deltas = np.einsum("mdu,md->mu", self._kernel[indices], changes.astype(self._kernel.dtype))
+        return deltas + accumulator
+
+    def evaluate(self, accumulators: np.ndarray):
+        """Values of positions given their accumulators, shape (number of positions, 1)"""
+        return self._upper.predict(accumulators)
+
+    def predict_children(self, state: np.ndarray, indices: np.ndarray, changes: np.ndarray):
+        """Values of positions after moves, same as model's `predict` of their encodings"""
+        return self.evaluate(self.update(self.accumulate(state), indices, changes))
+
+
+def export_model(h5_path: str, npz_path: str = None):
+    """Exports Keras model file into .npz loadable with `NumpyModel.load`, next to it by default
+
+    # Returns
+        path of written file
+    """
+    if npz_path is None:
+        npz_path = h5_path.rsplit(".", 1)[0] + ".npz"
+    NumpyModel.from_h5(h5_path).save(npz_path)
+    return npz_path
+
+
+def load_numpy_model(path: str):
+    """Loads `NumpyModel` from .npz written by `export_model` or from Keras .h5/.h5f file"""
+    if path.endswith(".npz"):
+        return NumpyModel.load(path)
+    return NumpyModel.from_h5(path)
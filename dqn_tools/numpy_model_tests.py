@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+
+import chess_environment.chessboard as cb
+from dqn_tools.numpy_model import AccumulatorModel, NumpyModel
+
+# shipped Keras models: input shape and activations after their three dense layers
+SHIPPED_MODELS = {
+    "final/BuzdyganDQNv1_20k_active.h5f": ((384,), [("leaky_relu", 0.01), ("leaky_relu", 0.01), ("linear", 0.)]),
+    "models/LeakyDQNv0/FinalModel/LeakyDQNv0_120k_active.h5f": (
+        (384,), [("leaky_relu", 0.3), ("leaky_relu", 0.3), ("linear", 0.)]),
+    "models/SimpleDQNv2/SimpleDQNv2_200k.h5": ((None, 384), [("relu", 0.), ("relu", 0.), ("relu", 0.)]),
+}
+
+
+def make_model(random: np.random.RandomState):
+    return NumpyModel([("dense", random.normal(size=(384, 20)).astype(np.float32),
+                        random.normal(size=20).astype(np.float32)),
+                       ("activation", "leaky_relu", 0.3),
+                       ("dense", random.normal(size=(20, 1)).astype(np.float32), None)], (384,))
+
+
+class NumpyModelTests(unittest.TestCase):
+    def test_predict(self):
+        random = np.random.RandomState(12345)
+        model = make_model(random)
+        states = random.randint(-1, 2, size=(40, 384))
+        hidden = states.dot(model.layers[0][1].astype(np.float64)) + model.layers[0][2]
+        expected = np.where(hidden > 0, hidden, 0.3 * hidden).dot(model.layers[2][1])
+        values = model.predict(states)
+        self.assertEqual(values.dtype, np.float32)
+        self.assertEqual(values.shape, (40, 1))
+        np.testing.assert_allclose(values, expected, rtol=1e-4, atol=1e-4)
+        np.testing.assert_allclose(model.predict(states.reshape((40, 1, 384))).reshape((40, 1)), values,
+                                   rtol=1e-4, atol=1e-4)
+
+    def test_save_and_load(self):
+        random = np.random.RandomState(12345)
+        model = make_model(random)
+        states = random.randint(-1, 2, size=(8, 384))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "model.npz")
+            model.save(path)
+            loaded = NumpyModel.load(path)
+        self.assertEqual(loaded.input_shape, (None, 384))
+        np.testing.assert_array_equal(loaded.predict(states), model.predict(states))
+
+    def test_loading_keras_models(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        states = np.random.RandomState(12345).randint(-1, 2, size=(16, 384))
+        for path, (input_shape, activations) in SHIPPED_MODELS.items():
+            model = NumpyModel.from_h5(os.path.join(root, path))
+            self.assertEqual(model.input_shape, (None,) + input_shape)
+            self.assertListEqual([layer[0] for layer in model.layers if layer[0] != "activation"], ["dense"] * 3)
+            self.assertListEqual([(layer[1], round(layer[2], 6)) for layer in model.layers if layer[0] == "activation"],
+                                 [activation for activation in activations if activation[0] != "linear"])
+            expected = states.astype(np.float64)
+            with h5py.File(os.path.join(root, path), "r") as h5_file:
+                for i, (activation, alpha) in enumerate(activations):
+                    group = h5_file["model_weights"]["dense_{}".format(i + 1)]
+                    kernel, bias = [np.array(group[name]) for name in group.attrs["weight_names"]]
+                    expected = expected.dot(kernel) + bias
+                    if activation != "linear":
+                        expected = np.where(expected > 0, expected, alpha * expected)
+            shape = (len(states),) + tuple(1 if size is None else size for size in input_shape)
+            np.testing.assert_allclose(model.predict(states.reshape(shape)).reshape((-1, 1)), expected,
+                                       rtol=1e-4, atol=1e-4 * np.abs(expected).max())
+
+    def test_accumulator_model(self):
+        model = make_model(np.random.RandomState(12345))
+        accumulator_model = AccumulatorModel(model)
+        board = cb.ChessBoard("r3k2r/pPpp1ppp/8/3Pp3/8/8/P1PP1PPP/R3K2R w KQkq e6 0 10")
+        for flip in (False, True):
+            _, states = board.get_moves_batch(flip=flip)
+            _, state, indices, changes = board.get_moves_deltas(flip=flip)
+            np.testing.assert_allclose(accumulator_model.predict_children(state, indices, changes),
+                                       model.predict(states), rtol=1e-4, atol=1e-4)
+        self.assertFalse(AccumulatorModel.supports(NumpyModel([("flatten",)], (1, 384))))
+
+    def test_unknown_activation(self):
+        with self.assertRaises(ValueError):
+            NumpyModel([("activation", "softplus", 0.)], (384,))
+
+
+if __name__ == "__main__":
+    unittest.main()
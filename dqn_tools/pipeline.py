@@ -0,0 +1,201 @@
+import queue
+import threading
+import time
+
+import keras.backend as K
+
+from dqn_tools.trainers import DQNTrainer
+
+
+class LockedMemory:
+    """Replay memory shared by threads, every call holds the same lock"""
+    def __init__(self, memory, lock: threading.Lock = None):
+        self._memory = memory
+        self.lock = lock if lock is not None else threading.Lock()
+
+    def add(self, record):
+        with self.lock:
+            self._memory.add(record)
+
+    def get_batch(self, batch_size: int, min_rows: int = 0):
+        with self.lock:
+            return self._memory.get_batch(batch_size, min_rows=min_rows)
+
+    def update_priorities(self, indices, td_errors):
+        if hasattr(self._memory, "update_priorities"):
+            with self.lock:
+                self._memory.update_priorities(indices, td_errors)
+
+    def anneal(self, step: int):
+        if hasattr(self._memory, "anneal"):
+            with self.lock:
+                self._memory.anneal(step)
+
+
+class PipelineStats:
+    """Seconds spent by each part of the pipeline, waits are times the part was blocked by another one"""
+    def __init__(self):
+        self.steps = 0
+        self.actions = 0
+        self.acting = 0.
+        self.acting_wait = 0.
+        self.preparing = 0.
+        self.preparing_wait = 0.
+        self.fitting = 0.
+        self.fitting_wait = 0.
+        self.wall = 0.
+
+    def as_dict(self):
+        result = dict(vars(self))
+        busy = self.acting + self.preparing + self.fitting
+        # 1 means parts ran one after another like in the sequential loop, 3 is the best possible overlap
+        result["overlap"] = busy / self.wall if self.wall > 0 else 0.
+        return result
+
+    def __str__(self):
+        return ", ".join("{}: {:.3f}".format(key, value) if isinstance(value, float) else "{}: {}".format(key, value)
+                         for key, value in self.as_dict().items())
+
+
+class PipelinedTrainer:
+    """Acts, prepares batches and fits the model at the same time
+
+    The acting thread plays with trainer's `action` and a thread preparing batches samples memory and computes
+    targets with template's `prepare_batch`, while this one fits models with `fit_batch` on prepared batches
+    taken from a queue of at most `queue_size` of them. Like in the sequential loop of `take_action` and
+    `train`, batch for n-th training step is sampled after n-th action, the acting thread can be at most
+    `max_lead` actions ahead of finished training steps and the target model is advanced after every step.
+    Targets of a batch are computed with models at most `queue_size` steps older than the fitted one.
+
+    Keras models are shared between threads, so the backend graph is made default in each of them.
+
+    # Arguments
+        trainer: trainer owning models and memory, acting thread plays with its `take_action`
+        prepare_batch: template's `prepare_batch`
+        fit_batch: template's `fit_batch`
+        queue_size: maximal number of prepared batches waiting for fitting
+        max_lead: maximal number of actions made ahead of training
+    """
+    def __init__(self, trainer: DQNTrainer, prepare_batch, fit_batch, queue_size: int = 2, max_lead: int = 2):
+        if max_lead < 1:
+            raise ValueError("Acting thread has to be allowed to lead by at least one action")
+        self._trainer = trainer
+        self._prepare_batch = prepare_batch
+        self._fit_batch = fit_batch
+        self._queue_size = queue_size
+        self._max_lead = max_lead
+        self.stats = PipelineStats()
+
+    """Train like `train_model.py` does with `take_action` and `train` for steps from start_step to steps - 1
+
+    # Arguments
+        environment: board the acting thread plays on
+        epsilon: function of step number giving exploration probability, e.g. template's `get_epsilon`
+        batch_size, gamma, theta: as in `DQNTrainer.train`
+        callback: optional function called with step number after each training step, e.g. for saving,
+            memory is locked during the call
+
+    # Returns
+        `PipelineStats` of this run
+    """
+    def run(self, environment, start_step: int, steps: int, epsilon, batch_size: int = 32, gamma: float = 0.99,
+            theta: float = 0., callback=None):
+        trainer = self._trainer
+        active_model = trainer.get_active_model()
+        target_model = trainer.get_target_model()
+        # predict functions built lazily from several threads at once would race
+        active_model._make_predict_function()
+        target_model._make_predict_function()
+        graph = K.get_session().graph
+        memory = LockedMemory(trainer.get_memory())
+        batches = queue.Queue(maxsize=self._queue_size)
+        acted = threading.Condition()
+        lead = threading.Semaphore(self._max_lead)
+        stop = threading.Event()
+        errors = []
+        stats = self.stats = PipelineStats()
+
+        def act():
+            for step in range(start_step, steps):
+                waiting_since = time.perf_counter()
+                while not lead.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                started = time.perf_counter()
+                trainer.take_action(environment, epsilon(step), memory)
+                stats.acting_wait += started - waiting_since
+                stats.acting += time.perf_counter() - started
+                with acted:
+                    stats.actions += 1
+                    acted.notify_all()
+
+        def prepare():
+            for step in range(start_step, steps):
+                waiting_since = time.perf_counter()
+                with acted:
+                    while stats.actions <= step - start_step:
+                        acted.wait(timeout=0.1)
+                        if stop.is_set():
+                            return
+                started = time.perf_counter()
+                memory.anneal(step)
+                prepared_batch = self._prepare_batch(active_model, target_model, memory, batch_size, gamma)
+                put_since = time.perf_counter()
+                stats.preparing += put_since - started
+                while True:
+                    try:
+                        batches.put(prepared_batch, timeout=0.1)
+                        break
+                    except queue.Full:
+                        if stop.is_set():
+                            return
+                stats.preparing_wait += (started - waiting_since) + (time.perf_counter() - put_since)
+
+        def in_graph(target):
+            def run_target():
+                try:
+                    with graph.as_default():
+                        target()
+                except BaseException as error:
+                    errors.append(error)
+                    stop.set()
+            return run_target
+
+        threads = [threading.Thread(target=in_graph(act), daemon=True),
+                   threading.Thread(target=in_graph(prepare), daemon=True)]
+        run_started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        try:
+            for step in range(start_step, steps):
+                waiting_since = time.perf_counter()
+                while True:
+                    if errors:
+                        raise errors[0]
+                    try:
+                        prepared_batch = batches.get(timeout=0.1)
+                        break
+                    except queue.Empty:
+                        pass
+                started = time.perf_counter()
+                stats.fitting_wait += started - waiting_since
+                if prepared_batch is not None:
+                    priorities_update = self._fit_batch(active_model, *prepared_batch)
+                    if priorities_update is not None:
+                        memory.update_priorities(*priorities_update)
+                trainer.advance_target(theta)
+                stats.fitting += time.perf_counter() - started
+                stats.steps += 1
+                lead.release()
+                if callback is not None:
+                    # acting thread must not add records while e.g. memory is being saved
+                    with memory.lock:
+                        callback(step)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            stats.wall = time.perf_counter() - run_started
+        if errors:
+            raise errors[0]
+        return stats
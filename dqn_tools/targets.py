@@ -0,0 +1,228 @@
+import keras
+import numpy as np
+
+import chess_environment.chessboard as cb
+from chess_environment.encoding import pack_moves, pack_states, unpack_moves, unpack_states, zobrist_keys, \
+    PACKED_STATE_SIZE, STATE_SIZE
+
+
+class Successors:
+    """Next states of several positions packed into one ragged array
+
+    # Attributes
+        states: (total number of next states, 384) array
+        offsets: (positions + 1) array, next states of i-th position are `states[offsets[i]:offsets[i + 1]]`
+        terminal: boolean array marking positions in which the game is over (they have no next states)
+        moves: list of moves leading to the states, in the same order
+    """
+    def __init__(self, states: np.ndarray, offsets: np.ndarray, terminal: np.ndarray, moves: list = None):
+        self.states = states
+        self.offsets = offsets
+        self.terminal = terminal
+        self.moves = moves
+
+    def __len__(self):
+        return len(self.terminal)
+
+    def counts(self):
+        return np.diff(self.offsets)
+
+
+def gather_successors(boards: list, flip=False):
+    """Generates next states of every board with `ChessBoard.get_moves_batch`
+
+    Boards with finished games are marked as terminal and get no next states.
+    """
+    terminal = np.zeros(len(boards), dtype=bool)
+    counts = np.zeros(len(boards), dtype=np.int64)
+    moves_list = []
+    states_list = []
+    for i, board in enumerate(boards):
+        if board.game_over():
+            terminal[i] = True
+            continue
+        moves, states = board.get_moves_batch(flip=flip)
+        counts[i] = len(moves)
+        moves_list += moves
+        states_list.append(states)
+    offsets = np.zeros(len(boards) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    states = np.concatenate(states_list) if states_list else np.empty((0, STATE_SIZE), dtype=np.int8)
+    return Successors(states, offsets, terminal, moves_list)
+
+
+class PackedSuccessors:
+    """Next states of a single position stored in a replay record
+
+    States are packed with `pack_states` (96 bytes each) and moves, if kept, with `pack_moves`.
+    """
+    __slots__ = ("states", "moves", "terminal")
+
+    def __init__(self, states: np.ndarray, moves: np.ndarray = None, terminal=False):
+        self.states = states
+        self.moves = moves
+        self.terminal = terminal
+
+
+def pack_successors(board: cb.ChessBoard, flip=False, with_moves=False, max_successors: int = None):
+    """Generates and packs next states of board for storing them in replay memory
+
+    # Arguments
+        flip: passed to `ChessBoard.get_moves_batch`
+        with_moves: whether moves leading to the states should be kept too
+        max_successors: if board has more legal moves, nothing is stored
+
+    # Returns
+        `PackedSuccessors`, or None if there are more than `max_successors` of them
+    """
+    if board.game_over():
+        moves = np.empty(0, dtype=np.uint16) if with_moves else None
+        return PackedSuccessors(np.empty((0, PACKED_STATE_SIZE), dtype=np.uint8), moves, terminal=True)
+    moves, states = board.get_moves_batch(flip=flip)
+    if max_successors is not None and len(moves) > max_successors:
+        return None
+    return PackedSuccessors(pack_states(states), pack_moves(moves) if with_moves else None)
+
+
+def collect_successors(stored: list, fens: list, flip=False, with_moves=False):
+    """Joins next states of sampled records into `Successors`
+
+    Records' stored `PackedSuccessors` are used when present, others are generated from FENs.
+    """
+    packed = [s if s is not None else pack_successors(cb.ChessBoard(starting_fen=f), flip, with_moves)
+              for s, f in zip(stored, fens)]
+    counts = np.array([len(p.states) for p in packed], dtype=np.int64)
+    offsets = np.zeros(len(packed) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    terminal = np.array([p.terminal for p in packed], dtype=bool)
+    states = unpack_states(np.concatenate([p.states for p in packed])) if len(packed) > 0 \
+        else np.empty((0, STATE_SIZE), dtype=np.int8)
+    moves = unpack_moves(np.concatenate([p.moves for p in packed])) if with_moves and len(packed) > 0 else None
+    return Successors(states, offsets, terminal, moves)
+
+
+def predict_values(model: keras.Model, states: np.ndarray, state_shape: tuple = (1, 384), cache=None):
+    """Evaluates all states in one forward pass and returns their values as flat array
+
+    Given `EvaluationCache` of the model's weights, only states which are not cached are evaluated.
+    """
+    states_num = len(states)
+    if states_num == 0:
+        return np.empty(0, dtype=np.float32)
+    if cache is not None:
+        return cache.evaluate(zobrist_keys(states),
+                              lambda missing: predict_values(model, np.asarray(states)[missing], state_shape))
+    values = model.predict(
+        np.asarray(states, dtype=np.float32).reshape((states_num,) + tuple(state_shape[1:])),
+        batch_size=states_num)
+    return values.reshape(states_num)
+
+
+def segment_argmax(values: np.ndarray, offsets: np.ndarray):
+    """Finds index of the first highest value in each segment `values[offsets[i]:offsets[i + 1]]`
+
+    # Returns
+        array of indices into `values`, -1 for empty segments
+    """
+    counts = np.diff(offsets)
+    result = np.full(len(counts), -1, dtype=np.int64)
+    filled = counts > 0
+    if filled.any():
+        starts = offsets[:-1][filled]
+        maxima = np.maximum.reduceat(values, starts)
+        segment_maxima = np.repeat(maxima, counts[filled])
+        positions = np.where(values == segment_maxima, np.arange(len(values)), len(values))
+        result[filled] = np.minimum.reduceat(positions, starts)
+    return result
+
+
+def segment_max(values: np.ndarray, offsets: np.ndarray, empty_value=0.):
+    """Highest value of each segment `values[offsets[i]:offsets[i + 1]]`, `empty_value` for empty ones"""
+    best = segment_argmax(values, offsets)
+    maxima = np.full(len(best), empty_value, dtype=np.float32)
+    maxima[best >= 0] = values[best[best >= 0]]
+    return maxima
+
+
+def double_dqn_targets(acting_model: keras.Model,
+                       target_model: keras.Model,
+                       rewards,
+                       successors: Successors,
+                       gamma: float,
+                       state_shape: tuple = (1, 384),
+                       target_cache=None):
+    """Double DQN targets for a minibatch
+
+    Next state is chosen by acting model among all successors and valued by target model:
+    q = r + gamma * Q_target(argmax_s' Q_active(s')), or q = r for finished games.
+    All successors go through one acting model pass and the chosen ones through one target model pass.
+
+    # Arguments
+        successors: next states of sampled positions (see `gather_successors`)
+        rewards: rewards of sampled positions
+        target_cache: optional `EvaluationCache` of target model's values
+
+    # Returns
+        (batch size, 1) array of reinforced rewards
+    """
+    targets = np.array(rewards, dtype=np.float32).reshape(len(successors))
+    chosen = segment_argmax(predict_values(acting_model, successors.states, state_shape), successors.offsets)
+    continuing = chosen >= 0
+    estimated_next_prizes = predict_values(target_model, successors.states[chosen[continuing]], state_shape,
+                                           target_cache)
+    targets[continuing] += gamma * estimated_next_prizes
+    return targets.reshape((-1, 1))
+
+
+def opponent_reply_targets(target_model: keras.Model,
+                           boards: list,
+                           rewards,
+                           gamma: float,
+                           is_final,
+                           state_shape: tuple = (1, 384),
+                           replies: Successors = None,
+                           target_cache=None):
+    """Targets taking opponent's reply into account
+
+    Opponent's reply is the move valued best by target model from opponent's perspective. If `is_final`
+    holds for the board after the reply and its reward, q = r - gamma * opponent's reward, otherwise
+    q = r + gamma * (max Q_target(s'') - opponent's reward), where s'' are states after our next moves.
+    Replies of the whole minibatch are valued in one pass and next moves in another one.
+
+    # Arguments
+        boards: `ChessBoard`s of sampled positions, replies are made on them
+        rewards: rewards of sampled positions
+        is_final: function of (board, opponent's reward) telling if next moves should not be valued
+        replies: opponent's moves with states for every board (e.g. from `collect_successors`),
+            generated from the boards if not given
+        target_cache: optional `EvaluationCache` of target model's values
+
+    # Returns
+        (batch size, 1) array of reinforced rewards
+    """
+    targets = np.array(rewards, dtype=np.float32).reshape(len(boards))
+    if replies is None:
+        replies = gather_successors(boards, flip=True)
+    chosen = segment_argmax(predict_values(target_model, replies.states, state_shape, target_cache), replies.offsets)
+    continuing_indices = []
+    continuing_prizes = []
+    for i, board in enumerate(boards):
+        if replies.terminal[i]:
+            continue
+        board.make_move(replies.moves[chosen[i]], flipped=True)
+        opponents_prize = board.get_results()
+        if is_final(board, opponents_prize):
+            targets[i] -= gamma * opponents_prize
+        else:
+            continuing_indices.append(i)
+            continuing_prizes.append(opponents_prize)
+
+    next_states = gather_successors([boards[i] for i in continuing_indices])
+    estimated_next_prizes = segment_max(
+        predict_values(target_model, next_states.states, state_shape, target_cache), next_states.offsets)
+    targets[continuing_indices] += gamma * (estimated_next_prizes - np.array(continuing_prizes))
+    return targets.reshape((-1, 1))
+
+
+def boards_from_fens(fens):
+    return [cb.ChessBoard(starting_fen=f) for f in fens]
@@ -0,0 +1,124 @@
+import unittest
+
+import numpy as np
+
+import chess_environment.chessboard as cb
+from dqn_tools.targets import boards_from_fens, collect_successors, double_dqn_targets, opponent_reply_targets, \
+    segment_argmax, segment_max
+
+FENS = [
+    "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N2N2/PP2BPPP/R2QKB1R w KQ - 4 8",
+    # game over, no successors
+    "rnb1kbnr/pppp1ppp/8/4p3/6Pq/5P2/PPPPP2P/RNBQKBNR w KQkq - 1 3",
+    # the only move takes the queen, leaving bare kings
+    "k7/1Q6/8/8/8/8/8/7K b - - 0 1",
+    # the only move takes the attacking rook, the game goes on
+    "k7/R7/8/4B3/8/8/7P/7K b - - 0 1",
+    "8/5pk1/6p1/8/3R4/6P1/5PKP/8 w - - 0 40",
+]
+REWARDS = [0., cb.CHECKMATE, 0., cb.ATTACK, 0.]
+GAMMA = 0.9
+
+
+class MaterialModel:
+    """Keras-like model valuing encodings by weighted material, quiet moves give equal values"""
+    def __init__(self, piece_values: list):
+        self._weights = np.tile(np.array(piece_values, dtype=np.float32), 64).reshape((384, 1))
+
+    def predict(self, states, batch_size: int = None):
+        return np.asarray(states, dtype=np.float32).reshape((len(states), 384)).dot(self._weights)
+
+
+ACTING_MODEL = MaterialModel([1, 3, 5, 3, 9, 0])
+TARGET_MODEL = MaterialModel([2, 5, 7, 5, 12, 1])
+
+
+def best_state(model, states):
+    """Index and value of the first best valued state, comparing them one by one"""
+    best_index, best_value = None, None
+    for i, state in enumerate(states):
+        value = float(model.predict(np.array([state]))[0][0])
+        if best_value is None or value > best_value:
+            best_index, best_value = i, value
+    return best_index, best_value
+
+
+def double_dqn_target(fen: str, reward: float):
+    board = cb.ChessBoard(starting_fen=fen)
+    if board.game_over():
+        return reward
+    _, states, _ = board.get_moves()
+    chosen, _ = best_state(ACTING_MODEL, states)
+    return reward + GAMMA * float(TARGET_MODEL.predict(np.array([states[chosen]]))[0][0])
+
+
+def opponent_reply_target(fen: str, reward: float, is_final):
+    board = cb.ChessBoard(starting_fen=fen)
+    if board.game_over():
+        return reward, "terminal"
+    moves, states, _ = board.get_moves(flip=True)
+    chosen, _ = best_state(TARGET_MODEL, states)
+    board.make_move(moves[chosen], flipped=True)
+    opponents_prize = board.get_results()
+    if is_final(board, opponents_prize):
+        return reward - GAMMA * opponents_prize, "final"
+    _, next_states, _ = board.get_moves()
+    _, next_prize = best_state(TARGET_MODEL, next_states)
+    return reward + GAMMA * (next_prize - opponents_prize), "continuing"
+
+
+class SegmentTests(unittest.TestCase):
+    def test_first_of_equal_values_wins(self):
+        values = np.array([1., 3., 3., 2., 5., 5., 5., 0., -1., -1.], dtype=np.float32)
+        offsets = np.array([0, 4, 4, 7, 8, 10])
+        best = segment_argmax(values, offsets)
+        for i, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+            expected = start + int(np.argmax(values[start:end])) if end > start else -1
+            self.assertEqual(best[i], expected)
+        self.assertListEqual(best.tolist(), [1, -1, 4, 7, 8])
+        self.assertListEqual(segment_max(values, offsets, empty_value=-7.).tolist(), [3., -7., 5., 0., -1.])
+
+    def test_single_value_segments(self):
+        values = np.array([4., -2., 0.], dtype=np.float32)
+        offsets = np.arange(4)
+        self.assertListEqual(segment_argmax(values, offsets).tolist(), [0, 1, 2])
+        self.assertListEqual(segment_max(values, offsets).tolist(), values.tolist())
+
+    def test_no_values(self):
+        offsets = np.zeros(3, dtype=np.int64)
+        self.assertListEqual(segment_argmax(np.empty(0, dtype=np.float32), offsets).tolist(), [-1, -1])
+        self.assertListEqual(segment_max(np.empty(0, dtype=np.float32), offsets).tolist(), [0., 0.])
+
+
+class TargetsTests(unittest.TestCase):
+    def test_double_dqn_targets(self):
+        successors = collect_successors([None] * len(FENS), FENS)
+        self.assertListEqual(successors.terminal.tolist(), [False, True, False, False, False])
+        self.assertEqual(successors.counts()[2], 1)
+        targets = double_dqn_targets(ACTING_MODEL, TARGET_MODEL, REWARDS, successors, GAMMA)
+        self.assertEqual(targets.shape, (len(FENS), 1))
+        for target, fen, reward in zip(targets[:, 0], FENS, REWARDS):
+            self.assertAlmostEqual(float(target), double_dqn_target(fen, reward), places=4)
+
+    def assertSameOpponentReplyTargets(self, is_final):
+        expected = [opponent_reply_target(fen, reward, is_final) for fen, reward in zip(FENS, REWARDS)]
+        for replies in (None, collect_successors([None] * len(FENS), FENS, flip=True, with_moves=True)):
+            targets = opponent_reply_targets(TARGET_MODEL, boards_from_fens(FENS), REWARDS, GAMMA, is_final,
+                                             replies=replies)
+            self.assertEqual(targets.shape, (len(FENS), 1))
+            for target, (expected_target, _) in zip(targets[:, 0], expected):
+                self.assertAlmostEqual(float(target), expected_target, places=4)
+        return [path for _, path in expected]
+
+    def test_opponent_reply_targets_v0(self):
+        paths = self.assertSameOpponentReplyTargets(lambda board, opponents_prize: opponents_prize > cb.ATTACK)
+        self.assertListEqual(paths, ["continuing", "terminal", "final", "continuing", "continuing"])
+
+    def test_opponent_reply_targets_v1(self):
+        # `get_results` restarts finished games, so the board is not over any more when is_final checks it
+        paths = self.assertSameOpponentReplyTargets(lambda board, opponents_prize: board.game_over())
+        self.assertListEqual(paths, ["continuing", "terminal", "continuing", "continuing", "continuing"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,20 @@
 import keras
+import keras.backend as K
 import numpy as np
 from dqn_tools.io import save, load
 
 
 class DQNTrainer:
-    def __init__(self, model: keras.Model, memory, action, training, target_model: keras.Model = None):
+    """Trains model with replay memory and target network
+
+    # Arguments
+        target_update_every: target network is updated once per this many training steps,
+            with theta raised so that old target weights decay as fast as with updates after every step
+        target_cache: `EvaluationCache` of target network's values used by training, it is invalidated
+            whenever target network's weights change
+    """
+    def __init__(self, model: keras.Model, memory, action, training, target_model: keras.Model = None,
+                 target_update_every: int = 1, target_cache=None):
         self._active_model = model
         if target_model is None:
             self._target_model = keras.models.clone_model(model)
@@ -13,6 +23,12 @@ class DQNTrainer:
         self._memory = memory
         self.action = action
         self.training = training
+        if target_update_every < 1:
+            raise ValueError("Target update interval has to be positive, got {}".format(target_update_every))
+        self._target_update_every = target_update_every
+        self._steps_since_target_update = 0
+        self._target_update = None
+        self._target_cache = target_cache
 
     """Train your model
     
@@ -21,24 +37,67 @@ class DQNTrainer:
         gamma: power of reinforcement (q = Q(s) + gamma * Q(s'))
         theta: coefficient by which target network should be updated
             If continuous updating is not wanted, then leave it at zero and target network won't be changed
+        step: current training step, passed to memory's `anneal` if it has one (e.g. PrioritizedMemory)
     
+    If training returns indices of sampled records and their TD errors, they are passed
+    to memory's `update_priorities`.
+    """
+    def train(self, batch_size: int = 32, gamma: float = 0.99, theta: float = 0., step: int = None):
+        if step is not None and hasattr(self._memory, "anneal"):
+            self._memory.anneal(step)
+        priorities_update = self.training(self._active_model, self._target_model, self._memory, batch_size, gamma)
+        if priorities_update is not None and hasattr(self._memory, "update_priorities"):
+            self._memory.update_priorities(*priorities_update)
+        self.advance_target(theta)
+
+    """Count a training step and update target network if it is due
+
+    After k steps target network is updated with theta_k = 1 - (1 - theta) ** k, so weights it had
+    k steps ago keep the same share as after k updates with theta.
     """
-    def train(self, batch_size: int = 32, gamma: float = 0.99, theta: float = 0.):
-        self.training(self._active_model, self._target_model, self._memory, batch_size, gamma)
-        if theta > 0:
-            self._update_target(theta)
+    def advance_target(self, theta: float):
+        if theta <= 0:
+            return
+        self._steps_since_target_update += 1
+        if self._steps_since_target_update >= self._target_update_every:
+            self.update_target(1 - (1 - theta) ** self._steps_since_target_update)
+            self._steps_since_target_update = 0
+
+    """Move target network's weights towards active network's ones: t = theta * a + (1 - theta) * t
 
-    def _update_target(self, theta: float):
-        t_weights = np.array(self._target_model.get_weights())
-        a_weights = np.array(self._active_model.get_weights())
-        new_t_weights = a_weights * theta + (1 - theta) * t_weights
-        self._target_model.set_weights(new_t_weights)
+    All variables are updated by one backend function built on first call, so weights stay in the backend.
+    """
+    def update_target(self, theta: float):
+        if self._target_update is None:
+            self._target_update = self._build_target_update()
+        self._target_update([np.float32(theta)])
+        self._invalidate_target_cache()
+
+    def _build_target_update(self):
+        target_weights = self._target_model.weights
+        active_weights = self._active_model.weights
+        if len(target_weights) != len(active_weights):
+            raise ValueError("Target model has {} weights and active model {}".format(
+                len(target_weights), len(active_weights)))
+        theta = K.placeholder(shape=(), dtype="float32")
+        updates = [K.update(t, theta * a + (1 - theta) * t) for t, a in zip(target_weights, active_weights)]
+        return K.function([theta], [], updates=updates)
 
     def copy_weights_to_target(self):
         self._target_model.set_weights(self._active_model.get_weights())
+        self._invalidate_target_cache()
+
+    def _invalidate_target_cache(self):
+        if self._target_cache is not None:
+            self._target_cache.invalidate()
 
-    def take_action(self, environment, epsilon=0.):
-        self.action(self._active_model, self._memory, environment, epsilon)
+    """Make a move with active model, exploring with probability epsilon
+
+    # Arguments
+        memory: where the record goes instead of trainer's memory, e.g. `LockedMemory` shared by threads
+    """
+    def take_action(self, environment, epsilon=0., memory=None):
+        self.action(self._active_model, self._memory if memory is None else memory, environment, epsilon)
 
     def save(self, directory: str, name: str):
         save(directory, name,
@@ -46,17 +105,39 @@ class DQNTrainer:
              target_model=self._target_model,
              memory=self._memory)
 
+    """Save models and memory with `AsyncCheckpointer`, files are written in background"""
+    def checkpoint(self, checkpointer, step: int):
+        checkpointer.save(step, self._active_model, self._target_model, self._memory)
+
+    def get_active_model(self):
+        return self._active_model
+
+    def get_target_model(self):
+        return self._target_model
+
+    def get_target_cache(self):
+        return self._target_cache
+
+    def get_memory(self):
+        return self._memory
+
+    def remember(self, record):
+        self._memory.add(record)
+
     def add_memory(self, memory):
         if self._memory is None:
             self._memory = memory
 
 
-def load_trainer(directory: str, name: str, action, training, has_memory: bool = True):
+def load_trainer(directory: str, name: str, action, training, has_memory: bool = True,
+                 target_update_every: int = 1, target_cache=None):
     active, target, memory = load(directory, name, has_memory=has_memory)
     return DQNTrainer(
         model=active,
         target_model=target,
         memory=memory,
         action=action,
-        training=training
+        training=training,
+        target_update_every=target_update_every,
+        target_cache=target_cache
     )
@@ -1,21 +1,162 @@
-import keras
+import time
+
+import chess
 import numpy as np
-from chess_environment.chessboard import ChessBoard
+from chess_environment.chessboard import ChessBoard, mirror_move
+from chess_environment.encoding import apply_delta, encode_board, encode_children, encode_deltas, mirror_states, \
+    zobrist_child_keys, zobrist_keys
+from dqn_tools.numpy_model import AccumulatorModel, load_numpy_model
+from search import AlphaBetaSearch
+
+# deepest search with a deadline, it normally ends by running out of time
+DEADLINE_MAX_DEPTH = 32
+# part of deadline's budget kept for returning the move, at least DEADLINE_MIN_RESERVE seconds
+DEADLINE_RESERVE = 0.05
+DEADLINE_MIN_RESERVE = 0.002
 
 
 class DQNChessEngine:
-    def __init__(self, model: keras.Model):
+    """Picks moves with the best value given by model, greedily or by `AlphaBetaSearch` over its values
+
+    `NumpyModel` with dense first layer is evaluated incrementally with `AccumulatorModel`.
+    Given `EvaluationCache`, values of positions seen before are not evaluated again (model's weights
+    are expected not to change while the engine uses it).
+
+    # Arguments
+        model: anything with Keras-like `predict`, e.g. `keras.Model` or `NumpyModel`
+        cache: optional `EvaluationCache` of model's values
+        state_shape: shape of model's input for one state, used by search
+    """
+    def __init__(self, model, cache=None, state_shape: tuple = (1, 384)):
         self._model = model
+        self._accumulator = AccumulatorModel(model) if AccumulatorModel.supports(model) else None
+        self.cache = cache
+        self.state_shape = state_shape
+        self.searcher = AlphaBetaSearch(self.evaluate_moves)
+        self.last_search = None
+
+    @staticmethod
+    def from_file(path: str, cache=None):
+        """Engine evaluating model from .npz exported by `export_models.py` or Keras .h5/.h5f file with NumPy"""
+        model = load_numpy_model(path)
+        state_shape = (1,) + tuple(1 if size is None else size for size in model.input_shape[1:])
+        return DQNChessEngine(model, cache, state_shape)
+
+    """Choose move of the player to move
+
+    # Arguments
+        board: current position
+        flip: whether the board is mirrored for the model, True when black is to move;
+            then the returned move and state are mirrored too, as `ChessBoard.get_moves` gives them
+        state_shape: shape of model's input for one state
+        depth: 1 picks the move leading to the best valued position, deeper moves are searched
+            by `AlphaBetaSearch` (its result is kept in `last_search`)
+        max_nodes: limit of positions expanded by search
+        max_time: limit of search's time in seconds
+        deadline_ms: milliseconds the move has to be chosen in, see `_choose_move_until`; it searches
+            as deep as the time allows unless depth is given
+
+    # Returns
+        chosen move and state after it, or (None, None) if there are no legal moves
+    """
+    def choose_move(self, board: ChessBoard, flip=False, state_shape: tuple=(1, 384), depth: int = 1,
+                    max_nodes: int = None, max_time: float = None, deadline_ms: float = None):
+        if deadline_ms is not None:
+            return self._choose_move_until(board, flip, deadline_ms, depth if depth > 1 else DEADLINE_MAX_DEPTH,
+                                           max_nodes)
+        if depth > 1:
+            return self._search_move(board, flip, depth, max_nodes, max_time)
+        if self._accumulator is not None:
+            return self._choose_move_incrementally(board, flip)
+        moves, states = board.get_moves_batch(flip=flip, dtype=np.float32)
+        if len(moves) == 0:
+            return None, None
+        prizes = self._state_values(states, state_shape)
+        # argmax picks the first of equally valued moves, like comparing them one by one did
+        best_index = int(np.argmax(prizes))
+        return moves[best_index], states[best_index]
+
+    def _choose_move_incrementally(self, board: ChessBoard, flip: bool):
+        moves, state, indices, changes = board.get_moves_deltas(flip=flip)
+        if len(moves) == 0:
+            return None, None
+        prizes = self._children_values(state, indices, changes)
+        best_index = int(np.argmax(prizes))
+        return moves[best_index], apply_delta(state.astype(np.float32), indices[best_index], changes[best_index])
+
+    def _search_move(self, board: ChessBoard, flip: bool, depth: int, max_nodes: int, max_time: float):
+        real_board = board._current_state.copy()
+        self.last_search = self.searcher.search(real_board, depth, max_nodes=max_nodes, max_time=max_time)
+        return self._searched_move(real_board, flip)
+
+    """Anytime move selection: the best move found before the deadline
+
+    Search deepens iteratively, trying the most promising moves first, and stops before an expansion which
+    is not expected to end in time, returning the best move found so far. If not even one expansion fits
+    in the budget and the position was searched before, the move from transposition table is returned
+    without evaluating anything (source "table"). Otherwise the greedy move (depth 1, one batched evaluation
+    of the children, source "greedy") is the fallback, so the time limit can only be exceeded by that single
+    evaluation.
+    Budget's use is reported in `last_search`.
+    """
+    def _choose_move_until(self, board: ChessBoard, flip: bool, deadline_ms: float, depth: int, max_nodes: int):
+        started = time.perf_counter()
+        budget = deadline_ms / 1000.
+        real_board = board._current_state.copy()
+        search_time = budget - max(DEADLINE_MIN_RESERVE, DEADLINE_RESERVE * budget)
+        table_result = self.searcher.table_result(real_board)
+        if table_result is not None and search_time <= self.searcher.node_seconds:
+            self.last_search = table_result
+        else:
+            self.last_search = self.searcher.search(real_board, depth, max_nodes=max_nodes,
+                                                    max_time=max(search_time, 0.))
+            if self.last_search.stopped and self.last_search.depth == 1 and not self.last_search.partial:
+                self.last_search.source = "greedy"
+        chosen = self._searched_move(real_board, flip)
+        self.last_search.seconds = time.perf_counter() - started
+        self.last_search.budget = budget
+        return chosen
+
+    def _searched_move(self, board: chess.Board, flip: bool):
+        move = self.last_search.move
+        if move is None:
+            return None, None
+        state = self._move_state(board, move)
+        return (mirror_move(move), state) if flip else (move, state)
+
+    @staticmethod
+    def _move_state(board: chess.Board, move: chess.Move):
+        state = encode_children(board, [move]).astype(np.float32)
+        return (mirror_states(state) if board.turn == chess.BLACK else state)[0]
+
+    """Values of positions after legal moves as seen by the player to move (mirrored board when black moves),
+    the values greedy `choose_move` compares
+
+    # Returns
+        flat array of values, one per move
+    """
+    def evaluate_moves(self, board: chess.Board, moves: list):
+        flip = board.turn == chess.BLACK
+        if self._accumulator is not None:
+            state = encode_board(board)
+            indices, changes = encode_deltas(board, moves, mirrored=flip)
+            return self._children_values(mirror_states(state) if flip else state, indices, changes)
+        states = encode_children(board, moves)
+        return self._state_values(mirror_states(states) if flip else states, self.state_shape)
+
+    def _children_values(self, state: np.ndarray, indices: np.ndarray, changes: np.ndarray):
+        if self.cache is None:
+            return self._accumulator.predict_children(state, indices, changes).reshape(len(indices))
+        keys = zobrist_child_keys(zobrist_keys(state), state, indices, changes)
+        return self.cache.evaluate(keys, lambda missing: self._accumulator.predict_children(
+            state, indices[missing], changes[missing]))
+
+    def _state_values(self, states: np.ndarray, state_shape: tuple):
+        if self.cache is not None:
+            return self.cache.evaluate(zobrist_keys(states),
+                                       lambda missing: self._predict(states[missing], state_shape))
+        return self._predict(states, state_shape)
 
-    def choose_move(self, board: ChessBoard, flip=False, state_shape: tuple=(1, 384)):
-        moves, states, _ = board.get_moves(flip=flip)
-        highest_prize = 0
-        best_move = None
-        best_state = None
-        for m, s in zip(moves, states):
-            prize = self._model.predict(np.array(s).reshape(state_shape))
-            if prize > highest_prize or best_move is None:
-                highest_prize = prize
-                best_move = m
-                best_state = s
-        return best_move, best_state
+    def _predict(self, states: np.ndarray, state_shape: tuple):
+        return self._model.predict(np.asarray(states, dtype=np.float32).reshape((len(states),) + state_shape[1:]),
+                                   batch_size=len(states)).reshape(len(states))
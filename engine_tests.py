@@ -0,0 +1,81 @@
+import unittest
+from unittest import mock
+
+import chess
+import numpy as np
+
+from chess_environment.chessboard import ChessBoard, mirror_move
+from engine import DQNChessEngine
+
+MIDDLEGAME_FEN = "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N2N2/PP2BPPP/R2QKB1R {} KQ - 4 8"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+class MaterialModel:
+    """Keras-like model valuing encodings by material, every predict call takes `seconds` of the fake clock"""
+    def __init__(self, clock: FakeClock, seconds: float):
+        self._clock = clock
+        self._seconds = seconds
+        self._weights = np.tile(np.array([1, 3, 5, 3, 9, 0], dtype=np.float32), 64).reshape((384, 1))
+
+    def predict(self, states, batch_size: int = None):
+        self._clock.now += self._seconds
+        return np.asarray(states, dtype=np.float32).reshape((len(states), 384)).dot(self._weights)
+
+
+class DeadlineTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch("time.perf_counter", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.engine = DQNChessEngine(MaterialModel(self.clock, 0.005))
+
+    def assertLegalMove(self, board: ChessBoard, flip: bool, move: chess.Move, state: np.ndarray):
+        moves, states = board.get_moves_batch(flip=flip, dtype=np.float32)
+        self.assertIn(move, moves)
+        self.assertIn(mirror_move(move) if flip else move, board._current_state.legal_moves)
+        np.testing.assert_array_equal(state, states[moves.index(move)])
+
+    def test_greedy_fallback(self):
+        board = ChessBoard(MIDDLEGAME_FEN.format("w"))
+        move, state = self.engine.choose_move(board, deadline_ms=1)
+        self.assertEqual(self.engine.last_search.source, "greedy")
+        self.assertEqual(self.engine.last_search.depth, 1)
+        self.assertEqual(self.engine.last_search.nodes, 1)
+        self.assertEqual(move, self.engine.choose_move(board)[0])
+        self.assertLegalMove(board, False, move, state)
+
+    def test_table_fallback(self):
+        board = ChessBoard(MIDDLEGAME_FEN.format("b"))
+        searched, _ = self.engine.choose_move(board, flip=True, depth=2)
+        move, state = self.engine.choose_move(board, flip=True, deadline_ms=1)
+        result = self.engine.last_search
+        self.assertEqual(result.source, "table")
+        self.assertEqual((result.nodes, result.depth, result.seconds), (0, 2, 0.))
+        self.assertEqual(move, searched)
+        self.assertLegalMove(board, True, move, state)
+
+    def test_search_within_budget(self):
+        for turn, flip in (("w", False), ("b", True)):
+            board = ChessBoard(MIDDLEGAME_FEN.format(turn))
+            move, state = self.engine.choose_move(board, flip=flip, deadline_ms=200)
+            result = self.engine.last_search
+            self.assertEqual(result.source, "search")
+            self.assertEqual(result.budget, 0.2)
+            self.assertTrue(result.stopped)
+            self.assertGreaterEqual(result.depth, 2)
+            self.assertLessEqual(result.seconds, result.budget)
+            self.assertLessEqual(result.budget_used(), 1.)
+            self.assertLegalMove(board, flip, move, state)
+
+
+if __name__ == "__main__":
+    unittest.main()
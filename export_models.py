@@ -0,0 +1,22 @@
+import argparse
+import glob
+
+from dqn_tools.numpy_model import export_model
+
+# Exports Keras models into .npz files next to them, which DQNChessEngine.from_file evaluates with NumPy only
+# (no Keras, TensorFlow nor h5py needed), e.g.
+#   python export_models.py final/BuzdyganDQNv1_150k_target.h5f
+#   python export_models.py --all
+MODEL_PATTERNS = ["final/*.h5f", "models/*/FinalModel/*.h5f", "models/SimpleDQNv2/*.h5"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export Keras models for NumPy inference")
+    parser.add_argument("paths", nargs="*", help=".h5/.h5f files to export")
+    parser.add_argument("--all", action="store_true", help="export all shipped models")
+    arguments = parser.parse_args()
+
+    paths = list(arguments.paths)
+    if arguments.all:
+        paths += sorted(path for pattern in MODEL_PATTERNS for path in glob.glob(pattern))
+    for path in paths:
+        print("{} -> {}".format(path, export_model(path)))
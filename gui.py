@@ -1,22 +1,24 @@
 import chess
 import chess.svg
-import keras
-from chess_environment.chessboard import ChessBoard
+from chess_environment.chessboard import ChessBoard, mirror_move
 from PyQt5 import QtGui
 from PyQt5.QtCore import pyqtSlot, Qt
 from PyQt5.QtSvg import QSvgWidget
 from PyQt5.QtWidgets import QWidget, QApplication, QPushButton, QLabel
 
 # based on: https://stackoverflow.com/a/47329268/6708094
+from dqn_tools.cache import EvaluationCache
 from engine import DQNChessEngine
 
+# time the AI has for its move, so the window does not freeze for long
+AI_DEADLINE_MS = 300
+
 
 class Window(QWidget):
     def __init__(self):
         super().__init__()
 
-        model = keras.models.load_model("final/BuzdyganDQNv0_210k_target.h5f", compile=False)
-        self.ai_engine = DQNChessEngine(model)
+        self.ai_engine = DQNChessEngine.from_file("final/BuzdyganDQNv0_210k_target.h5f", EvaluationCache())
         self.board: chess.Board = chess.Board()
         self.chosen_piece = [None, None]
         self.last_ai_move: chess.Move = None
@@ -78,16 +80,6 @@ class Window(QWidget):
     def _can_next_player_move(self):
         return not self._is_game_over()
 
-    @staticmethod
-    def _flip_move(move: chess.Move):
-        uci = move.uci()
-        from_column = uci[0]
-        from_row = 9 - int(uci[1])
-        to_column = uci[2]
-        to_row = 9 - int(uci[3])
-        flipped_move = chess.Move.from_uci("{}{}{}{}".format(from_column, from_row, to_column, to_row))
-        return flipped_move
-
     @pyqtSlot(QWidget)
     def mousePressEvent(self, event: QtGui.QMouseEvent):
         if self.svgX < event.x() <= self.svgX + self.board_size and \
@@ -110,8 +102,8 @@ class Window(QWidget):
                             can_ai_move = self._can_next_player_move()
                             if can_ai_move:
                                 cb_board = ChessBoard(self.board.fen())
-                                ai_move, _ = self.ai_engine.choose_move(cb_board, flip=True)
-                                ai_move = self._flip_move(ai_move)
+                                ai_move, _ = self.ai_engine.choose_move(cb_board, flip=True, deadline_ms=AI_DEADLINE_MS)
+                                ai_move = mirror_move(ai_move)
                                 self.board.push(ai_move)
                                 self.last_ai_move = ai_move
                                 self._can_next_player_move()
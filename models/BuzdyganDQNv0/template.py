@@ -2,12 +2,14 @@ import chess_environment.chessboard as cb
 import keras
 import numpy as np
 
-from dqn_tools.memory import SimpleMemory
+from dqn_tools.memory import as_memory_batch, SimpleMemory
+from dqn_tools.targets import boards_from_fens, collect_successors, opponent_reply_targets, \
+    pack_successors, predict_values
 from keras.initializers import RandomNormal
 from keras.layers import Dense, LeakyReLU
 from keras.regularizers import l2
 from models.model_template import ModelTemplate
-from training_tools import DQNChessRecord
+from training_tools import PackedChessRecord
 
 
 class BuzdyganDQNv0Templte(ModelTemplate):
@@ -54,86 +56,55 @@ class BuzdyganDQNv0Templte(ModelTemplate):
 
     @staticmethod
     def choose_action(model: keras.Model, possible_moves, possible_states, fens):
-        highest_prize = 0
-        best_move = None
-        best_state = None
-        best_state_fen = None
-        for m, s, f in zip(possible_moves, possible_states, fens):
-            prize = model.predict(np.array(s).reshape((1, 384)))
-            if prize > highest_prize or best_move is None:
-                highest_prize = prize
-                best_move = m
-                best_state = s
-                best_state_fen = f
+        prizes = predict_values(model, np.array(possible_states))
+        # first of equally valued states is chosen
+        best_index = int(np.argmax(prizes))
+        return possible_moves[best_index], possible_states[best_index], fens[best_index], prizes[best_index]
 
-        return best_move, best_state, best_state_fen, highest_prize
+    """Opponent's replies (with moves) to keep in record of the position reached by a move made with `flip`"""
+    def stored_successors(self, environment: cb.ChessBoard, flip: bool):
+        return pack_successors(
+            environment, flip=not flip, with_moves=True, max_successors=self.MAX_STORED_SUCCESSORS)
 
     def action(self, acting_model: keras.Model, models_memory: SimpleMemory, environment: cb.ChessBoard, epsilon):
         flip = not environment.current_turn()
-        moves, states, fens = environment.get_moves(flip=flip)
+        moves, states, fens = environment.get_moves(flip=flip, lazy_fens=True)
         best_move = None
         best_state = None
         best_state_fen = None
         if np.random.uniform(0, 1) < epsilon:
-            moves_states_list = list(map(list, zip(moves, states, fens)))
-            choices = len(moves_states_list)
-            if choices > 1:
-                random_element = moves_states_list[np.random.randint(0, choices)]
-            else:
-                random_element = moves_states_list[0]
-            best_move, best_state, best_state_fen = random_element
+            choices = len(moves)
+            choice = np.random.randint(0, choices) if choices > 1 else 0
+            best_move, best_state, best_state_fen = moves[choice], states[choice], fens[choice]
         else:
             best_move, best_state, best_state_fen, _ = self.choose_action(acting_model, moves, states, fens)
         # make move
         environment.make_move(best_move, flip)
+        successors = self.stored_successors(environment, flip) if self.STORE_SUCCESSORS else None
         real_prize = environment.get_results()
         best_state = np.array(best_state).reshape((384,))
         real_prize = np.array([real_prize]).reshape((1, 1))
         if real_prize == cb.IGNORE_GO:
             return
-        record = DQNChessRecord()
+        record = PackedChessRecord()
         record.state = best_state
         record.fen = best_state_fen
         record.reward = real_prize
+        record.successors = successors
         models_memory.add(record)
 
-    def training(self,
+    def prepare_batch(self,
             acting_model: keras.Model,
             target_model: keras.Model,
             models_memory: SimpleMemory,
             batch_size: int,
             gamma: float):
-        training_batch = models_memory.get_batch(batch_size, min_rows=self.START_TRAINING_AT)
-        if training_batch is not None:
-            samples = [[record.state, record.reward, record.fen] for record in training_batch]
-            states, prizes, fens = list(map(list, zip(*samples)))
-            reinforced_prizes = []
-            for p, f in zip(prizes, fens):
-                training_board = cb.ChessBoard(starting_fen=f)
-                p = p[0]
-                if not training_board.game_over():
-                    # predict opponent's move
-                    opponents_next_moves, opponents_next_states, opponents_next_fens = \
-                        training_board.get_moves(flip=True)
-                    opponents_move, _, _, _ = self.choose_action(
-                        target_model, opponents_next_moves, np.array(opponents_next_states), opponents_next_fens)
-                    training_board.make_move(opponents_move, flipped=True)
-                    opponents_prize = training_board.get_results()
-                    if opponents_prize > cb.ATTACK:
-                        reinforced_p = p - gamma * opponents_prize
-                    else:
-                        # get expected next move's reward
-                        possible_moves, possible_states, possible_fens = training_board.get_moves()
-                        _, _, _, estimated_next_prize = self.choose_action(
-                            target_model, possible_moves, np.array(possible_states), possible_fens)
-                        estimated_next_prize = \
-                            estimated_next_prize if isinstance(estimated_next_prize, int) else estimated_next_prize[0]
-
-                        reinforced_p = p + gamma * (estimated_next_prize - opponents_prize)
-                else:
-                    reinforced_p = p
-                reinforced_prizes.append(reinforced_p)
-
-            states = np.array(states)
-            reinforced_prizes = np.array(reinforced_prizes)
-            acting_model.train_on_batch(states, reinforced_prizes)
+        training_batch = as_memory_batch(models_memory.get_batch(batch_size, min_rows=self.START_TRAINING_AT))
+        if training_batch is None:
+            return None
+        replies = collect_successors(training_batch.successors, training_batch.fens, flip=True, with_moves=True)
+        reinforced_prizes = opponent_reply_targets(
+            target_model, boards_from_fens(training_batch.fens), training_batch.rewards, gamma, replies=replies,
+            target_cache=self.target_cache,
+            is_final=lambda board, opponents_prize: opponents_prize > cb.ATTACK)
+        return training_batch, reinforced_prizes
@@ -5,7 +5,9 @@ from keras.layers import Dense, LeakyReLU
 from keras.regularizers import l2
 
 import chess_environment.chessboard as cb
+from dqn_tools.checkpoints import AsyncCheckpointer
 from dqn_tools.memory import SimpleMemory
+from dqn_tools.targets import boards_from_fens, gather_successors, double_dqn_targets
 from dqn_tools.trainers import DQNTrainer, load_trainer
 from training_tools import DQNChessRecord
 
@@ -109,21 +111,10 @@ def training(
     if training_batch is not None:
         samples = [[record.state, record.reward, record.fen] for record in training_batch]
         states, prizes, fens = list(map(list, zip(*samples)))
-        reinforced_prizes = []
-        for p, f in zip(prizes, fens):
-            training_board = cb.ChessBoard(starting_fen=f)
-            p = p[0]
-            if not training_board.game_over():
-                next_moves, next_states, next_fens = training_board.get_moves()
-                _, chosen_state, _ = choose_action(acting_model, next_moves, np.array(next_states), next_fens)
-                estimated_next_prize = target_model.predict(np.array(chosen_state.reshape((1, 384))))[0]
-                reinforced_p = p + gamma * estimated_next_prize
-            else:
-                reinforced_p = p
-            reinforced_prizes.append(reinforced_p)
+        successors = gather_successors(boards_from_fens(fens))
+        reinforced_prizes = double_dqn_targets(acting_model, target_model, prizes, successors, gamma)
 
         states = np.array(states)
-        reinforced_prizes = np.array(reinforced_prizes)
         acting_model.train_on_batch(states, reinforced_prizes)
 
 
@@ -134,13 +125,15 @@ else:
     memory = SimpleMemory(MEMORY_SIZE)
     model_trainer = DQNTrainer(model, memory, action, training)
 
+checkpointer = AsyncCheckpointer("tmp", NAME, keep_last=3, keep_every=10000)
 board = cb.ChessBoard()
 for i in range(START_AT_STEP, TRAINING_STEPS):
     print("Step {} of {}".format(i+1, TRAINING_STEPS))
     model_trainer.take_action(board, get_epsilon(i))
     model_trainer.train(batch_size=BATCH, gamma=GAMMA, theta=THETA)
     if i % 1000 == 0:
-        model_trainer.save("tmp", "{}_{}".format(NAME, i))
+        model_trainer.checkpoint(checkpointer, i)
 
+checkpointer.wait()
 model_trainer.save("final", "{}_{}k".format(NAME, int(TRAINING_STEPS / 1000)))
 
@@ -3,6 +3,7 @@ import keras
 from keras.layers import Dense
 import chess_environment.chessboard as cb
 from dqn_tools.memory import SimpleMemory
+from dqn_tools.targets import boards_from_fens, gather_successors, double_dqn_targets
 from dqn_tools.trainers import DQNTrainer
 from training_tools import DQNChessRecord
 
@@ -71,20 +72,11 @@ def training(
     if training_batch is not None:
         samples = [[record.state, record.reward, record.fen] for record in training_batch]
         states, prizes, fens = list(map(list, zip(*samples)))
-        reinforced_prizes = []
-        for p, f in zip(prizes, fens):
-            training_board = cb.ChessBoard(starting_fen=f)
-            if not training_board.game_over():
-                next_moves, next_states, next_fens = training_board.get_moves()
-                _, chosen_state, _ = choose_action(acting_model, next_moves, next_states, next_fens)
-                estimated_next_prize = target_model.predict(np.array(chosen_state).reshape((1, 1, 384)))[0]
-                reinforced_p = p + gamma * estimated_next_prize
-            else:
-                reinforced_p = p
-            reinforced_prizes.append(reinforced_p)
+        successors = gather_successors(boards_from_fens(fens))
+        reinforced_prizes = double_dqn_targets(
+            acting_model, target_model, prizes, successors, gamma, state_shape=(1, 1, 384)).reshape((-1, 1, 1))
 
         states = np.array(states)
-        reinforced_prizes = np.array(reinforced_prizes)
         acting_model.train_on_batch(states, reinforced_prizes)
 
 
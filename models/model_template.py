@@ -2,11 +2,14 @@ import chess_environment.chessboard as cb
 import keras
 import numpy as np
 
-from dqn_tools.memory import SimpleMemory
+from dqn_tools.cache import EvaluationCache
+from dqn_tools.memory import as_memory_batch, MemoryBatch, SimpleMemory
+from dqn_tools.targets import collect_successors, double_dqn_targets, pack_successors, predict_values, \
+    segment_argmax
 from keras.initializers import RandomNormal
 from keras.layers import Dense, LeakyReLU
 from keras.regularizers import l2
-from training_tools import DQNChessRecord
+from training_tools import PackedChessRecord
 
 
 class ModelTemplate:
@@ -18,9 +21,19 @@ class ModelTemplate:
     BATCH = 16
     GAMMA = 0.99
     THETA = 0.3
+    # target network update interval, see DQNTrainer
+    TARGET_UPDATE_EVERY = 1
+    # size of target network's values cache, 0 disables it; every target update invalidates the cache,
+    # so it pays off only with rare updates (large TARGET_UPDATE_EVERY)
+    TARGET_CACHE_SIZE = 0
     EPSILON = 0.25
     EPSILON_THRESHOLD = START_TRAINING_AT * 1.01
     SAVE_PER_STEPS = 100
+    STORE_SUCCESSORS = False
+    MAX_STORED_SUCCESSORS = 80
+
+    def __init__(self):
+        self.target_cache = EvaluationCache(self.TARGET_CACHE_SIZE) if self.TARGET_CACHE_SIZE > 0 else None
 
     @staticmethod
     def new_model(seed: int):
@@ -53,72 +66,129 @@ class ModelTemplate:
 
     @staticmethod
     def choose_action(model: keras.Model, possible_moves, possible_states, fens):
-        highest_prize = 0
-        best_move = None
-        best_state = None
-        best_state_fen = None
-        for m, s, f in zip(possible_moves, possible_states, fens):
-            prize = model.predict(np.array(s).reshape((1, 384)))
-            if prize > highest_prize or best_move is None:
-                highest_prize = prize
-                best_move = m
-                best_state = s
-                best_state_fen = f
+        prizes = predict_values(model, np.array(possible_states))
+        # first of equally valued states is chosen
+        best_index = int(np.argmax(prizes))
+        return possible_moves[best_index], possible_states[best_index], fens[best_index]
+
+    """Next states to keep in record of the position reached by a move made with `flip`
 
-        return best_move, best_state, best_state_fen
+    They are the ones `training` values, so it does not have to generate them each time the record is sampled.
+    Positions with more than MAX_STORED_SUCCESSORS of them are not stored.
+    """
+    def stored_successors(self, environment: cb.ChessBoard, flip: bool):
+        return pack_successors(environment, flip=flip, max_successors=self.MAX_STORED_SUCCESSORS)
 
     def action(self, acting_model: keras.Model, models_memory: SimpleMemory, environment: cb.ChessBoard, epsilon):
         flip = not environment.current_turn()
-        moves, states, fens = environment.get_moves(flip=flip)
+        moves, states, fens = environment.get_moves(flip=flip, lazy_fens=True)
         best_move = None
         best_state = None
         best_state_fen = None
         if np.random.uniform(0, 1) < epsilon:
-            moves_states_list = list(map(list, zip(moves, states, fens)))
-            choices = len(moves_states_list)
-            if choices > 1:
-                random_element = moves_states_list[np.random.randint(0, choices)]
-            else:
-                random_element = moves_states_list[0]
-            best_move, best_state, best_state_fen = random_element
+            choices = len(moves)
+            choice = np.random.randint(0, choices) if choices > 1 else 0
+            best_move, best_state, best_state_fen = moves[choice], states[choice], fens[choice]
         else:
             best_move, best_state, best_state_fen = self.choose_action(acting_model, moves, states, fens)
         # make move
         environment.make_move(best_move, flip)
+        successors = self.stored_successors(environment, flip) if self.STORE_SUCCESSORS else None
         real_prize = environment.get_results()
         best_state = np.array(best_state).reshape((384,))
         real_prize = np.array([real_prize]).reshape((1, 1))
         if real_prize == cb.IGNORE_GO:
             return
-        record = DQNChessRecord()
+        record = PackedChessRecord()
         record.state = best_state
         record.fen = best_state_fen
         record.reward = real_prize
+        record.successors = successors
         models_memory.add(record)
 
+    """Play one move in every game of `VectorChessBoard`
+
+    Exploring games are drawn first, moves of all the other games are valued in one forward pass
+    (there is none while every game explores, e.g. with epsilon 1 during warm-up).
+    """
+    def vector_action(self, acting_model: keras.Model, models_memory: SimpleMemory,
+                      environment: cb.VectorChessBoard, epsilon):
+        flips = ~environment.current_turns()
+        moves, states, offsets = environment.get_moves_batch(flip=flips)
+        chosen = np.full(len(moves), -1, dtype=np.int64)
+        greedy = []
+        for i, game_moves in enumerate(moves):
+            choices = len(game_moves)
+            if choices == 0:
+                continue
+            if np.random.uniform(0, 1) < epsilon:
+                chosen[i] = offsets[i] + (np.random.randint(0, choices) if choices > 1 else 0)
+            else:
+                greedy.append(i)
+        if greedy:
+            greedy_indices = np.concatenate([np.arange(offsets[i], offsets[i + 1]) for i in greedy])
+            greedy_offsets = np.zeros(len(greedy) + 1, dtype=np.int64)
+            np.cumsum(np.diff(offsets)[greedy], out=greedy_offsets[1:])
+            best = segment_argmax(predict_values(acting_model, states[greedy_indices]), greedy_offsets)
+            chosen[greedy] = greedy_indices[best]
+        best_moves = [game_moves[chosen[i] - offsets[i]] if chosen[i] >= 0 else None
+                      for i, game_moves in enumerate(moves)]
+        fens = environment.get_fens(best_moves, flips)
+        environment.make_moves(best_moves, flips)
+        successors = [self.stored_successors(board, flip) if self.STORE_SUCCESSORS and move is not None else None
+                      for board, move, flip in zip(environment.boards, best_moves, flips)]
+        real_prizes = environment.get_results()
+        for i, move in enumerate(best_moves):
+            if move is None or real_prizes[i] == cb.IGNORE_GO:
+                continue
+            record = PackedChessRecord()
+            record.state = np.array(states[chosen[i]]).reshape((384,))
+            record.fen = fens[i]
+            record.reward = np.array([real_prizes[i]]).reshape((1, 1))
+            record.successors = successors[i]
+            models_memory.add(record)
+
     def training(self,
             acting_model: keras.Model,
             target_model: keras.Model,
             models_memory: SimpleMemory,
             batch_size: int,
             gamma: float):
-        training_batch = models_memory.get_batch(batch_size, min_rows=self.START_TRAINING_AT)
-        if training_batch is not None:
-            samples = [[record.state, record.reward, record.fen] for record in training_batch]
-            states, prizes, fens = list(map(list, zip(*samples)))
-            reinforced_prizes = []
-            for p, f in zip(prizes, fens):
-                training_board = cb.ChessBoard(starting_fen=f)
-                p = p[0]
-                if not training_board.game_over():
-                    next_moves, next_states, next_fens = training_board.get_moves()
-                    _, chosen_state, _ = self.choose_action(acting_model, next_moves, np.array(next_states), next_fens)
-                    estimated_next_prize = target_model.predict(np.array(chosen_state.reshape((1, 384))))[0]
-                    reinforced_p = p + gamma * estimated_next_prize
-                else:
-                    reinforced_p = p
-                reinforced_prizes.append(reinforced_p)
-
-            states = np.array(states)
-            reinforced_prizes = np.array(reinforced_prizes)
-            acting_model.train_on_batch(states, reinforced_prizes)
+        prepared_batch = self.prepare_batch(acting_model, target_model, models_memory, batch_size, gamma)
+        if prepared_batch is not None:
+            return self.fit_batch(acting_model, *prepared_batch)
+
+    """Sample batch and compute its targets, the part of `training` which does not change models
+
+    # Returns
+        sampled `MemoryBatch` and its reinforced rewards, or None if memory does not have enough records yet
+    """
+    def prepare_batch(self,
+            acting_model: keras.Model,
+            target_model: keras.Model,
+            models_memory: SimpleMemory,
+            batch_size: int,
+            gamma: float):
+        training_batch = as_memory_batch(models_memory.get_batch(batch_size, min_rows=self.START_TRAINING_AT))
+        if training_batch is None:
+            return None
+        successors = collect_successors(training_batch.successors, training_batch.fens)
+        reinforced_prizes = double_dqn_targets(
+            acting_model, target_model, training_batch.rewards, successors, gamma, target_cache=self.target_cache)
+        return training_batch, reinforced_prizes
+
+    """Train acting model on sampled batch
+
+    Batches sampled with priorities are weighted by their importance-sampling weights.
+
+    # Returns
+        indices of the records and their TD errors for updating priorities, or None for uniformly sampled batches
+    """
+    @staticmethod
+    def fit_batch(acting_model: keras.Model, training_batch: MemoryBatch, reinforced_prizes: np.ndarray):
+        if training_batch.weights is None:
+            acting_model.train_on_batch(training_batch.states, reinforced_prizes)
+            return None
+        td_errors = reinforced_prizes.reshape(-1) - predict_values(acting_model, training_batch.states)
+        acting_model.train_on_batch(training_batch.states, reinforced_prizes, sample_weight=training_batch.weights)
+        return training_batch.indices, td_errors
@@ -1,11 +1,11 @@
 import chess
-import keras.models
 from chess_environment.chessboard import ChessBoard, IllegalMoveException
 from engine import DQNChessEngine
 
+AI_DEADLINE_MS = 1000
+
 board = ChessBoard()
-model = keras.models.load_model("./model.h5")
-ai_engine = DQNChessEngine(model)
+ai_engine = DQNChessEngine.from_file("./model.h5")
 while not board.game_over():
     if(board._current_state.turn):
         print(board._current_state)
@@ -27,6 +27,7 @@ while not board.game_over():
                 print("Illegal move!")
                 made_move = False
     else:
-        move, _ = ai_engine.choose_move(board, True)
+        move, _ = ai_engine.choose_move(board, True, deadline_ms=AI_DEADLINE_MS)
+        print(ai_engine.last_search)
         assert isinstance(move, chess.Move)
         board.make_move(move, True)
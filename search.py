@@ -0,0 +1,278 @@
+import time
+from collections import OrderedDict
+
+import chess
+import chess.polyglot
+import numpy as np
+
+# value of being checkmated at the root, mates further away are worth less by a ply each;
+# far above any value the networks give
+MATE_VALUE = 1e15
+MATE_THRESHOLD = MATE_VALUE / 2
+DRAW_VALUE = 0.
+# kinds of values stored in transposition table
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2
+# weight of the last interval in the running average of time between expansions
+NODE_TIME_DECAY = 0.2
+
+
+class SearchLimitReached(Exception):
+    pass
+
+
+class SearchResult:
+    """Outcome of `AlphaBetaSearch.search`
+
+    # Attributes
+        move: best move found, None if there are no legal moves
+        value: its value for the player to move (network's scale, +-MATE_VALUE for mates)
+        depth: depth `value` was searched to
+        principal_variation: expected moves, starting with `move`
+        nodes: positions expanded (children generated and evaluated in one batch)
+        evaluations: positions valued, including those found in evaluation cache
+        seconds: time spent searching
+        stopped: whether node or time limit ended the search before `max_depth`
+        partial: whether the iteration of `depth` was interrupted, then only some root moves were searched
+            (the previous iteration's best one first) and `move` is the best of them; for moves taken from
+            transposition table, whether `value` is only a bound
+        source: "search", or the fallback of a deadline too short to search: "greedy" (depth 1)
+            or "table" (transposition table's move)
+        budget: seconds the move had to be chosen in, None if there was no deadline
+    """
+    def __init__(self, move, value, depth, principal_variation, nodes, evaluations, seconds, stopped,
+                 partial: bool = False, source: str = "search", budget: float = None):
+        self.move = move
+        self.value = value
+        self.depth = depth
+        self.principal_variation = principal_variation
+        self.nodes = nodes
+        self.evaluations = evaluations
+        self.seconds = seconds
+        self.stopped = stopped
+        self.partial = partial
+        self.source = source
+        self.budget = budget
+
+    def nodes_per_second(self):
+        return self.nodes / self.seconds if self.seconds > 0 else 0.
+
+    def budget_used(self):
+        """Fraction of the budget spent, None without deadline"""
+        return self.seconds / self.budget if self.budget else None
+
+    def __str__(self):
+        text = "Depth {} move {} value {:.4g}: {} nodes, {} evaluations in {:.3f}s ({:.0f} nodes/s){}".format(
+            self.depth, self.move, self.value, self.nodes, self.evaluations, self.seconds, self.nodes_per_second(),
+            ", stopped" if self.stopped else "")
+        if self.partial:
+            text += ", partial"
+        if self.source != "search":
+            text += ", from {}".format(self.source)
+        if self.budget is not None:
+            text += ", {:.0%} of {:.0f}ms budget".format(self.budget_used(), self.budget * 1000)
+        return text
+
+
+def _to_table(value: float, ply: int):
+    """Mate values are stored relative to the node, so they stay right when the position is reached elsewhere"""
+    if value > MATE_THRESHOLD:
+        return value + ply
+    if value < -MATE_THRESHOLD:
+        return value - ply
+    return value
+
+
+def _from_table(value: float, ply: int):
+    if value > MATE_THRESHOLD:
+        return value - ply
+    if value < -MATE_THRESHOLD:
+        return value + ply
+    return value
+
+
+class AlphaBetaSearch:
+    """Negamax alpha-beta search with iterative deepening valuing leaves with the DQN value network
+
+    Expanding a position values all its children in one batch with `evaluate_moves`: those values order
+    the moves (best first, after the transposition table's move) and at the last ply they are the leaves'
+    values, so a search of depth d needs one evaluation batch per position at depth below d. Network values
+    are from the view of the player who moved, deeper values are negated values of the opponent's best reply.
+    Checkmates are valued by `MATE_VALUE`, stalemates and the fifty-move rule of expanded positions
+    by `DRAW_VALUE`.
+    Transposition table (bounded LRU keyed by `chess.polyglot.zobrist_hash`) is kept between searches,
+    it has to be cleared when the network changes.
+    Search is stopped before an expansion which is not expected to finish in time, judging by the running
+    average of time between expansions (`node_seconds`, kept between searches too).
+
+    # Arguments
+        evaluate_moves: function of (chess.Board, list of legal moves) returning array of positions' values
+            after the moves as seen by the player to move, e.g. `DQNChessEngine.evaluate_moves`
+        table_size: number of transposition table's entries
+    """
+    def __init__(self, evaluate_moves, table_size: int = 1 << 18):
+        self.evaluate_moves = evaluate_moves
+        self.table_size = table_size
+        self._table = OrderedDict()
+        self._nodes = 0
+        self._evaluations = 0
+        self._max_nodes = None
+        self._stop_at = None
+        self._last_check = None
+        self._root_best = None
+        self.node_seconds = 0.
+
+    def clear(self):
+        self._table.clear()
+
+    def table_move(self, board: chess.Board):
+        """Best move of position found by earlier searches, None if it is not in transposition table"""
+        entry = self._table.get(chess.polyglot.zobrist_hash(board))
+        if entry is None or entry[3] is None or not board.is_legal(entry[3]):
+            return None
+        return entry[3]
+
+    def table_result(self, board: chess.Board):
+        """`SearchResult` of position's entry in transposition table (no nodes searched), None without its move"""
+        move = self.table_move(board)
+        if move is None:
+            return None
+        depth, value, kind, _ = self._table[chess.polyglot.zobrist_hash(board)]
+        return SearchResult(move, _from_table(value, 0), depth, [move], nodes=0, evaluations=0, seconds=0.,
+                            stopped=True, partial=kind != EXACT, source="table")
+
+    """Best move found by deepening search until max_depth or a limit is reached
+
+    Depth 1 is always completed, so there is a move even if limits are exceeded by it. When an iteration
+    is interrupted after at least one root move was searched completely (the previous iteration's best one
+    is searched first), the best of those moves is returned with its value at the interrupted depth
+    as a partial result, otherwise the last completed iteration's result.
+
+    # Arguments
+        board: position to search, it is restored after searching
+        max_depth: plies searched in the last iteration
+        max_nodes: expanded positions after which search stops, None for no limit
+        max_time: seconds after which search stops, None for no limit
+    """
+    def search(self, board: chess.Board, max_depth: int = 3, max_nodes: int = None, max_time: float = None):
+        if max_depth < 1:
+            raise ValueError("Search has to be at least 1 ply deep, got max_depth={}".format(max_depth))
+        started = time.perf_counter()
+        self._nodes = 0
+        self._evaluations = 0
+        self._last_check = None
+        result = None
+        stopped = False
+        partial = False
+        for depth in range(1, max_depth + 1):
+            # limits do not apply to the first iteration
+            self._max_nodes = max_nodes if depth > 1 else None
+            self._stop_at = started + max_time if depth > 1 and max_time is not None else None
+            self._root_best = None
+            try:
+                value = self._negamax(board, depth, -np.inf, np.inf, 0)
+            except SearchLimitReached:
+                stopped = True
+                if self._root_best is not None:
+                    move, value = self._root_best
+                    result = (move, value, depth, [move])
+                    partial = True
+                break
+            principal_variation = self._principal_variation(board, depth)
+            result = (principal_variation[0] if principal_variation else None, value, depth, principal_variation)
+            if abs(value) > MATE_THRESHOLD:
+                break
+        self._max_nodes = None
+        self._stop_at = None
+        return SearchResult(*result, nodes=self._nodes, evaluations=self._evaluations,
+                            seconds=time.perf_counter() - started, stopped=stopped, partial=partial)
+
+    def _check_limits(self):
+        now = time.perf_counter()
+        if self._last_check is not None:
+            self.node_seconds += NODE_TIME_DECAY * (now - self._last_check - self.node_seconds)
+        self._last_check = now
+        if self._max_nodes is not None and self._nodes >= self._max_nodes:
+            raise SearchLimitReached()
+        if self._stop_at is not None and now + self.node_seconds >= self._stop_at:
+            raise SearchLimitReached()
+
+    def _negamax(self, board: chess.Board, depth: int, alpha: float, beta: float, ply: int):
+        key = chess.polyglot.zobrist_hash(board)
+        entry = self._table.get(key)
+        if entry is not None and ply > 0:
+            self._table.move_to_end(key)
+            entry_depth, entry_value, kind, _ = entry
+            if entry_depth >= depth:
+                value = _from_table(entry_value, ply)
+                if kind == EXACT or (kind == LOWER_BOUND and value >= beta) or (kind == UPPER_BOUND and value <= alpha):
+                    return value
+
+        moves = list(board.legal_moves)
+        if not moves:
+            return -MATE_VALUE + ply if board.is_check() else DRAW_VALUE
+        if board.halfmove_clock >= 100:
+            return DRAW_VALUE
+        self._check_limits()
+        self._nodes += 1
+        values = np.asarray(self.evaluate_moves(board, moves), dtype=np.float64).reshape(len(moves))
+        self._evaluations += len(moves)
+        order = np.argsort(-values, kind="stable")
+        if entry is not None and entry[3] in moves:
+            table_index = moves.index(entry[3])
+            order = np.concatenate([[table_index], order[order != table_index]])
+
+        original_alpha = alpha
+        best_value = -np.inf
+        best_move = None
+        for index in order:
+            move = moves[index]
+            if depth == 1:
+                value = self._leaf_value(board, move, values[index], ply)
+            else:
+                board.push(move)
+                try:
+                    value = -self._negamax(board, depth - 1, -beta, -alpha, ply + 1)
+                finally:
+                    board.pop()
+            if value > best_value:
+                best_value = value
+                best_move = move
+                if ply == 0:
+                    self._root_best = (move, value)
+            alpha = max(alpha, value)
+            if alpha >= beta:
+                break
+
+        if best_value <= original_alpha:
+            kind = UPPER_BOUND
+        elif best_value >= beta:
+            kind = LOWER_BOUND
+        else:
+            kind = EXACT
+        self._table[key] = (depth, _to_table(best_value, ply), kind, best_move)
+        self._table.move_to_end(key)
+        if len(self._table) > self.table_size:
+            self._table.popitem(last=False)
+        return best_value
+
+    @staticmethod
+    def _leaf_value(board: chess.Board, move: chess.Move, value: float, ply: int):
+        """Network's value of position after move, unless the move mates (stalemates are not looked for here)"""
+        board.push(move)
+        try:
+            mated = board.is_check() and not any(board.generate_legal_moves())
+        finally:
+            board.pop()
+        return MATE_VALUE - (ply + 1) if mated else value
+
+    def _principal_variation(self, board: chess.Board, depth: int):
+        moves = []
+        for _ in range(depth):
+            move = self.table_move(board)
+            if move is None:
+                break
+            moves.append(move)
+            board.push(move)
+        for _ in moves:
+            board.pop()
+        return moves
@@ -0,0 +1,99 @@
+import unittest
+
+import chess
+import numpy as np
+
+from search import AlphaBetaSearch, MATE_VALUE
+
+PIECE_VALUES = {chess.PAWN: 1, chess.KNIGHT: 3, chess.BISHOP: 3, chess.ROOK: 5, chess.QUEEN: 9, chess.KING: 0}
+
+
+def material(board: chess.Board, color: chess.Color):
+    return sum(PIECE_VALUES[piece.piece_type] * (1 if piece.color == color else -1)
+               for piece in board.piece_map().values())
+
+
+def evaluate_moves(board: chess.Board, moves: list):
+    values = []
+    for move in moves:
+        board.push(move)
+        values.append(material(board, not board.turn))
+        board.pop()
+    return np.array(values, dtype=np.float32)
+
+
+def minimax(board: chess.Board, depth: int):
+    moves = list(board.legal_moves)
+    if not moves:
+        return -MATE_VALUE if board.is_check() else 0.
+    values = evaluate_moves(board, moves)
+    best = -np.inf
+    for move, value in zip(moves, values):
+        board.push(move)
+        if depth == 1:
+            mated = board.is_checkmate()
+            value = MATE_VALUE - 1 if mated else value
+        else:
+            value = -minimax(board, depth - 1)
+            if abs(value) > MATE_VALUE / 2:
+                value -= np.sign(value)
+        board.pop()
+        best = max(best, value)
+    return best
+
+
+class AlphaBetaSearchTests(unittest.TestCase):
+    def test_same_value_as_minimax(self):
+        for fen in ("8/5pk1/6p1/8/3R4/6P1/5PKP/8 w - - 0 40",
+                    "r3k2r/pPpp1ppp/8/3Pp3/8/8/P1PP1PPP/R3K2R w KQkq e6 0 10"):
+            board = chess.Board(fen)
+            search = AlphaBetaSearch(evaluate_moves)
+            result = search.search(board, max_depth=3)
+            self.assertEqual(result.depth, 3)
+            self.assertEqual(result.value, minimax(board, 3))
+            self.assertEqual(board.fen(), fen)
+            self.assertEqual(result.principal_variation[0], result.move)
+            table_result = search.table_result(board)
+            self.assertEqual((table_result.move, table_result.value, table_result.depth, table_result.partial),
+                             (result.move, result.value, 3, False))
+
+    def test_finding_mate_in_one(self):
+        board = chess.Board("r1bqkbnr/pppp1ppp/2n5/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4")
+        result = AlphaBetaSearch(evaluate_moves).search(board, max_depth=3)
+        self.assertEqual(result.move, chess.Move.from_uci("h5f7"))
+        self.assertEqual(result.value, MATE_VALUE - 1)
+
+    def test_node_limit(self):
+        board = chess.Board()
+        result = AlphaBetaSearch(evaluate_moves).search(board, max_depth=5, max_nodes=30)
+        self.assertTrue(result.stopped)
+        self.assertLess(result.depth, 5)
+        self.assertLessEqual(result.nodes, 30)
+        self.assertIn(result.move, board.legal_moves)
+
+    def test_interrupted_iteration_keeps_searched_root_move(self):
+        board = chess.Board()
+        # depth 1 takes one expansion, depth 2 root and its first two children before the limit
+        result = AlphaBetaSearch(evaluate_moves).search(board, max_depth=3, max_nodes=4)
+        self.assertTrue(result.stopped)
+        self.assertTrue(result.partial)
+        self.assertEqual(result.depth, 2)
+        board.push(result.move)
+        self.assertEqual(result.value, -minimax(board, result.depth - 1))
+        board.pop()
+        completed = AlphaBetaSearch(evaluate_moves).search(board, max_depth=2)
+        self.assertFalse(completed.partial)
+        self.assertEqual(completed.depth, 2)
+
+    def test_time_limit(self):
+        board = chess.Board("r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N2N2/PP2BPPP/R2QKB1R w KQ - 4 8")
+        search = AlphaBetaSearch(evaluate_moves)
+        result = search.search(board, max_depth=10, max_time=0.2)
+        self.assertTrue(result.stopped)
+        self.assertLess(result.depth, 10)
+        self.assertIn(result.move, board.legal_moves)
+        self.assertGreater(search.node_seconds, 0.)
+
+
+if __name__ == "__main__":
+    unittest.main()
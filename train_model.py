@@ -1,41 +1,103 @@
 import numpy as np
 
 import chess_environment.chessboard as cb
-from dqn_tools.memory import SimpleMemory
+from dqn_tools.checkpoints import AsyncCheckpointer
+from dqn_tools.distributed import ParallelTrainer
+from dqn_tools.instrumentation import Instrumentation
+from dqn_tools.memory import ArrayMemory
+from dqn_tools.pipeline import PipelinedTrainer
 from dqn_tools.trainers import DQNTrainer, load_trainer
 from models.BuzdyganDQNv1.template import BuzdyganDQNv1Templte
 
 seed = 12345
-np.random.seed(seed)
 # temporary simple model for testing base concept
 model_template = BuzdyganDQNv1Templte()
 LOAD = True
 LOAD_MEMORY = True
 LOAD_FROM = "final/"
+# number of self-play processes feeding this one, 0 plays and trains alternately in this process
+ACTORS = 0
+ACTORS_SYNC_PER_STEPS = 100
+ACTORS_QUEUE_SIZE = 1000
+# actors follow template's get_epsilon, a positive spread gives them different epsilons after warm-up
+ACTORS_EPSILON_SPREAD = 0.
+# act, prepare batches and fit in separate threads (used when ACTORS is 0)
+PIPELINE = False
+# intermediate checkpoints kept in tmp: the last ones and those of steps divisible by KEEP_EVERY_CHECKPOINT
+KEEP_LAST_CHECKPOINTS = 3
+KEEP_EVERY_CHECKPOINT = 10000
+# timings of training's hot paths are summarised in this JSON lines file, None prints every step instead
+INSTRUMENTATION_LOG = "tmp/{}_training.jsonl".format(model_template.NAME)
+# actors' acting is timed in their processes, into this file formatted with actor's number
+ACTORS_INSTRUMENTATION_LOG = "tmp/{}_actor_{{}}.jsonl".format(model_template.NAME)
+INSTRUMENTATION_SUMMARY_STEPS = 100
 
-if LOAD:
-    model_trainer = load_trainer(
-        LOAD_FROM,
-        "{}_60k".format(model_template.NAME),
-        model_template.action,
-        model_template.training,
-        has_memory=LOAD_MEMORY)
-    if not LOAD_MEMORY:
-        memory = SimpleMemory(model_template.MEMORY_SIZE)
-        model_trainer.add_memory(memory)
-else:
-    model = model_template.new_model(seed)
-    memory = SimpleMemory(model_template.MEMORY_SIZE)
-    model_trainer = DQNTrainer(model, memory, model_template.action, model_template.training)
-
-board = cb.ChessBoard()
-for i in range(model_template.START_AT_STEP, model_template.TRAINING_STEPS):
-    print("Step {} of {}".format(i+1, model_template.TRAINING_STEPS))
-    model_trainer.take_action(board, model_template.get_epsilon(i))
-    model_trainer.train(batch_size=model_template.BATCH, gamma=model_template.GAMMA, theta=model_template.THETA)
-    if i % model_template.SAVE_PER_STEPS == 0:
-        model_trainer.save("tmp", "{}_{}".format(model_template.NAME, i))
-
-model_trainer.save("final", "{}_{}k".format(model_template.NAME,
-                                            int(model_template.TRAINING_STEPS / 1000)))
 
+def after_step(step: int):
+    if instrumentation is not None:
+        instrumentation.step(step)
+    if step % model_template.SAVE_PER_STEPS == 0:
+        model_trainer.checkpoint(checkpointer, step)
+
+
+# guarded, because actor processes import this module
+if __name__ == "__main__":
+    np.random.seed(seed)
+    if LOAD:
+        model_trainer = load_trainer(
+            LOAD_FROM,
+            "{}_60k".format(model_template.NAME),
+            model_template.action,
+            model_template.training,
+            has_memory=LOAD_MEMORY,
+            target_update_every=model_template.TARGET_UPDATE_EVERY,
+            target_cache=model_template.target_cache)
+        if not LOAD_MEMORY:
+            memory = ArrayMemory(model_template.MEMORY_SIZE)
+            model_trainer.add_memory(memory)
+    else:
+        model = model_template.new_model(seed)
+        memory = ArrayMemory(model_template.MEMORY_SIZE)
+        model_trainer = DQNTrainer(model, memory, model_template.action, model_template.training,
+                                   target_update_every=model_template.TARGET_UPDATE_EVERY,
+                                   target_cache=model_template.target_cache)
+
+    checkpointer = AsyncCheckpointer("tmp", model_template.NAME,
+                                     keep_last=KEEP_LAST_CHECKPOINTS, keep_every=KEEP_EVERY_CHECKPOINT)
+    instrumentation = None
+    if INSTRUMENTATION_LOG is not None:
+        instrumentation = Instrumentation(INSTRUMENTATION_LOG, summary_every=INSTRUMENTATION_SUMMARY_STEPS)
+        instrumentation.enable()
+    if ACTORS > 0:
+        parallel_trainer = ParallelTrainer(
+            model_trainer, model_template.action, model_template.get_epsilon,
+            actors=ACTORS, sync_every=ACTORS_SYNC_PER_STEPS, queue_size=ACTORS_QUEUE_SIZE,
+            epsilon_spread=ACTORS_EPSILON_SPREAD, seed=seed,
+            instrumentation_log=ACTORS_INSTRUMENTATION_LOG if INSTRUMENTATION_LOG is not None else None,
+            summary_every=INSTRUMENTATION_SUMMARY_STEPS)
+        parallel_trainer.run(model_template.START_AT_STEP, model_template.TRAINING_STEPS,
+                             batch_size=model_template.BATCH, gamma=model_template.GAMMA, theta=model_template.THETA,
+                             callback=after_step)
+    elif PIPELINE:
+        pipelined_trainer = PipelinedTrainer(model_trainer, model_template.prepare_batch, model_template.fit_batch)
+        stats = pipelined_trainer.run(cb.ChessBoard(), model_template.START_AT_STEP, model_template.TRAINING_STEPS,
+                                      model_template.get_epsilon, batch_size=model_template.BATCH,
+                                      gamma=model_template.GAMMA, theta=model_template.THETA, callback=after_step)
+        print(stats)
+    else:
+        board = cb.ChessBoard()
+        for i in range(model_template.START_AT_STEP, model_template.TRAINING_STEPS):
+            if instrumentation is None:
+                print("Step {} of {}".format(i+1, model_template.TRAINING_STEPS))
+            model_trainer.take_action(board, model_template.get_epsilon(i))
+            model_trainer.train(batch_size=model_template.BATCH, gamma=model_template.GAMMA,
+                                theta=model_template.THETA, step=i)
+            after_step(i)
+
+    checkpointer.wait()
+    if instrumentation is not None:
+        instrumentation.disable()
+    if model_template.target_cache is not None:
+        print(model_template.target_cache)
+    model_trainer.save("final", "{}_{}k".format(model_template.NAME,
+                                                int(model_template.TRAINING_STEPS / 1000)))
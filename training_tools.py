@@ -1,5 +1,82 @@
+import numpy as np
+
+from chess_environment.encoding import decode_board_fens, pack_position_keys, pack_states, unpack_position_keys, \
+    unpack_states, PACKED_STATE_SIZE, STATE_SIZE
+
+
 class DQNChessRecord:
+    # optional dqn_tools.targets.PackedSuccessors stored when the record is created,
+    # class attribute keeps records pickled before it was added readable
+    successors = None
+
     def __init__(self):
         self.state = None
         self.reward = None
         self.fen = None
+        self.successors = None
+
+
+class PackedChessRecord:
+    """Compact drop-in replacement of `DQNChessRecord`
+
+    State is kept packed into 96 bytes (`pack_states`), reward as float and FEN as uint64 key
+    (`pack_position_keys`), as its piece placement is given by the state. Attributes `state`, `reward`
+    and `fen` are properties, so records are filled and read like `DQNChessRecord`s, while `gather`
+    unpacks many of them at once. A record takes about 300 bytes instead of over 3 kB.
+    """
+    __slots__ = ("_packed_state", "_reward", "_position", "successors")
+
+    def __init__(self, state=None, reward=None, fen: str = None):
+        self._packed_state = None
+        self._reward = None
+        self._position = None
+        self.successors = None
+        if state is not None:
+            self.state = state
+        if reward is not None:
+            self.reward = reward
+        if fen is not None:
+            self.fen = fen
+
+    @property
+    def packed_state(self):
+        """Packed state as uint8 array viewing record's bytes, without copying"""
+        return np.frombuffer(self._packed_state, dtype=np.uint8)
+
+    @property
+    def state(self):
+        return unpack_states(self.packed_state)
+
+    @state.setter
+    def state(self, state):
+        self._packed_state = pack_states(np.reshape(state, STATE_SIZE)).tobytes()
+
+    @property
+    def reward(self):
+        return np.array([[self._reward]])
+
+    @reward.setter
+    def reward(self, reward):
+        self._reward = float(np.reshape(reward, -1)[0])
+
+    @property
+    def fen(self):
+        """FEN of the state, it has to be set after the state it describes"""
+        return unpack_position_keys(decode_board_fens(self.state[np.newaxis]), [self._position])[0]
+
+    @fen.setter
+    def fen(self, fen: str):
+        self._position = int(pack_position_keys([fen])[0])
+
+    @staticmethod
+    def gather(records: list):
+        """Unpacks states, rewards and FENs of records at once
+
+        # Returns
+            (number of records, 384) int8 array of states, float32 array of rewards and list of FENs
+        """
+        packed_states = np.frombuffer(b"".join(record._packed_state for record in records), dtype=np.uint8)
+        states = unpack_states(packed_states.reshape((len(records), PACKED_STATE_SIZE)))
+        rewards = np.array([record._reward for record in records], dtype=np.float32)
+        fens = unpack_position_keys(decode_board_fens(states), [record._position for record in records])
+        return states, rewards, fens